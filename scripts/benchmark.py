@@ -0,0 +1,249 @@
+# scripts/benchmark.py
+# Сквозной бенчмарк fetch → parse → merge на синтетике (train_delays.synth) в масштабах 1×/10×/100×.
+# Запуск из корня репо:
+#   python -m scripts.benchmark --scales 1 10 100
+#   python -m scripts.benchmark --scales 1 10 --compare latest     # сравнить с прошлым прогоном
+#
+# Каждая стадия идёт в отдельном процессе, поэтому пиковый RSS (ru_maxrss) — её собственный:
+#   generate — синтетический архив сырья (plan на каждый час + FCHG-снимки), как после crawl/poll;
+#   fetch    — crawl против локальной заглушки API (train_delays.stub_api), единица — запрос;
+#   parse    — train_delays.ingest.ingest_all по архиву → processed/{plan,changes};
+#   merge    — train_delays.merge.merge_partitions → processed/merged.
+# Результаты: reports/benchmarks/bench_<YYYYmmdd_HHMMSS>.json (параметры, версии, git-коммит, метрики).
+
+from pathlib import Path
+import argparse, json, os, platform, resource, shutil, subprocess, sys, tempfile, time
+from datetime import datetime, timedelta
+
+RESULTS_DIR = Path("reports/benchmarks")
+STAGES = ("generate", "fetch", "parse", "merge")
+
+# Базовый масштаб 1×: станции растут линейно с масштабом, остальное фиксировано
+BASE = {
+    "stations": 4,
+    "hours": 6,
+    "stops_per_hour": 20,
+    "msgs_per_stop": 2,
+    "snapshots_per_hour": 2,
+    "seed": 0,
+}
+BENCH_DAY = "251016"   # четверг; дата фиксирована, чтобы прогоны были сравнимы
+FIRST_HOUR = 6
+
+
+def _params(scale: int, overrides: dict) -> dict:
+    p = {**BASE, **{k: v for k, v in overrides.items() if v is not None}}
+    p["stations"] = p["stations"] * scale
+    p["scale"] = scale
+    p["evas"] = [str(8000000 + 100 + i) for i in range(p["stations"])]
+    p["hour_list"] = list(range(FIRST_HOUR, FIRST_HOUR + p["hours"]))
+    return p
+
+
+def _peak_rss_mb() -> dict:
+    """ru_maxrss процесса стадии и её дочерних процессов (пулы ingest/merge); на Linux — в КБ."""
+    unit = 1 if sys.platform == "darwin" else 1024
+    self_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2**20
+    children_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 2**20
+    return {"peak_rss_mb": round(self_mb, 1), "peak_rss_children_mb": round(children_mb, 1)}
+
+
+# ----------------- стадии (выполняются в дочернем процессе) -----------------
+def _stage_generate(p: dict, work: Path) -> dict:
+    from train_delays import synth
+    counts = synth.write_archive(work / "raw", p["evas"], [BENCH_DAY], p["hour_list"],
+                                 stops_per_hour=p["stops_per_hour"], msgs_per_stop=p["msgs_per_stop"],
+                                 snapshots_per_hour=p["snapshots_per_hour"], seed=p["seed"])
+    return {"rows": counts["plan"] + counts["fchg"], "unit": "payloads", "bytes": counts["bytes"]}
+
+
+def _stage_fetch(p: dict, work: Path) -> dict:
+    os.environ.setdefault("DB_CLIENT_ID", "bench")
+    os.environ.setdefault("DB_API_KEY", "bench")
+    from train_delays import crawl, fetch, stub_api
+
+    server = stub_api.serve_in_thread(stub_api.StubApi(
+        source="synthetic", latency_ms=p.get("latency_ms") or 0.0, seed=p["seed"],
+        stops_per_hour=p["stops_per_hour"], msgs_per_stop=p["msgs_per_stop"]))
+    fetch.BASE = server.base_url
+    try:
+        counts = crawl.crawl(p["evas"], date_from=BENCH_DAY, hours=p["hour_list"], outdir=work / "fetched",
+                             workers=min(8, fetch.HTTP_POOL_SIZE), rate_per_min=1e9)
+    finally:
+        server.shutdown()
+    return {"rows": counts["ok"], "unit": "requests", "failed": counts["failed"],
+            "bytes": int(server.api.stats["bytes_out"])}
+
+
+def _stage_parse(p: dict, work: Path) -> dict:
+    from train_delays.ingest import ingest_all
+    counts = ingest_all(work / "raw", work / "processed", workers=p.get("workers"))
+    return {"rows": counts["rows"], "unit": "rows", "sources": counts["sources"], "failed": counts["failed"]}
+
+
+def _stage_merge(p: dict, work: Path) -> dict:
+    from train_delays.merge import merge_partitions
+    counts = merge_partitions(work / "processed", workers=p.get("workers"))
+    return {"rows": counts["rows"], "unit": "rows", "partitions": counts["partitions"]}
+
+
+STAGE_FUNCS = {
+    "generate": _stage_generate,
+    "fetch": _stage_fetch,
+    "parse": _stage_parse,
+    "merge": _stage_merge,
+}
+
+
+def _run_stage_inline(stage: str, params_json: str, workdir: str) -> None:
+    """Точка входа дочернего процесса: выполняет стадию и печатает метрики одной JSON-строкой."""
+    p = json.loads(params_json)
+    work = Path(workdir)
+    os.chdir(work)  # data/stations.json и прочие относительные пути — внутри рабочей папки
+    t0 = time.perf_counter()
+    result = STAGE_FUNCS[stage](p, work)
+    wall = time.perf_counter() - t0
+    result.update(wall_s=round(wall, 3), rows_per_s=round(result["rows"] / wall, 1) if wall > 0 else None)
+    result.update(_peak_rss_mb())
+    print("BENCH_RESULT " + json.dumps(result))
+
+
+def _run_stage(stage: str, p: dict, work: Path) -> dict:
+    env = dict(os.environ)
+    src = str(Path(__file__).resolve().parents[1] / "src")
+    repo = str(Path(__file__).resolve().parents[1])
+    env["PYTHONPATH"] = os.pathsep.join([src, repo] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+    cmd = [sys.executable, "-m", "scripts.benchmark", "--_stage", stage,
+           "--_params", json.dumps(p), "--workdir", str(work)]
+    proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    lines = [ln for ln in proc.stdout.splitlines() if ln.startswith("BENCH_RESULT ")]
+    if proc.returncode != 0 or not lines:
+        raise RuntimeError(f"Стадия {stage} упала (код {proc.returncode}):\n{proc.stderr[-2000:]}")
+    return json.loads(lines[-1][len("BENCH_RESULT "):])
+
+
+# ----------------- отчёт -----------------
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=Path(__file__).resolve().parents[1]).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _environment() -> dict:
+    import pandas as pd
+    import pyarrow
+    return {
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "pyarrow": pyarrow.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def _print_table(runs: list) -> None:
+    print(f"\n{'scale':>6} {'stage':<9} {'rows':>10} {'wall, с':>9} {'rows/s':>12} {'RSS, МБ':>9} {'RSS дет., МБ':>13}")
+    for run in runs:
+        for stage, m in run["stages"].items():
+            print(f"{run['scale']:>5}× {stage:<9} {m['rows']:>10} {m['wall_s']:>9.2f} "
+                  f"{(m['rows_per_s'] or 0):>12.0f} {m['peak_rss_mb']:>9.1f} {m['peak_rss_children_mb']:>13.1f}")
+
+
+def _load_previous(spec: str, exclude: Path) -> dict:
+    if spec != "latest":
+        return json.loads(Path(spec).read_text(encoding="utf-8"))
+    files = sorted(f for f in RESULTS_DIR.glob("bench_*.json") if f.resolve() != exclude.resolve())
+    if not files:
+        raise FileNotFoundError(f"Нет прошлых прогонов в {RESULTS_DIR}")
+    return json.loads(files[-1].read_text(encoding="utf-8"))
+
+
+def _compare(current: dict, previous: dict) -> None:
+    """Отношение текущего к прошлому по wall time и пиковому RSS (меньше 1 — стало лучше)."""
+    prev = {(r["scale"], s): m for r in previous["runs"] for s, m in r["stages"].items()}
+    print(f"\nСравнение с {previous.get('git', '?')} от {previous.get('created_at', '?')} (текущее / прошлое):")
+    print(f"{'scale':>6} {'stage':<9} {'wall':>7} {'rows/s':>7} {'RSS':>7}")
+    for run in current["runs"]:
+        for stage, m in run["stages"].items():
+            old = prev.get((run["scale"], stage))
+            if old is None:
+                continue
+            ratio = lambda a, b: f"{a / b:.2f}" if a and b else "—"
+            print(f"{run['scale']:>5}× {stage:<9} {ratio(m['wall_s'], old['wall_s']):>7} "
+                  f"{ratio(m['rows_per_s'], old['rows_per_s']):>7} {ratio(m['peak_rss_mb'], old['peak_rss_mb']):>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк fetch → parse → merge на синтетике")
+    parser.add_argument("--scales", nargs="+", type=int, default=[1, 10, 100], help="Множители масштаба")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--stations", type=int, default=None, help=f"Станций при 1× (по умолчанию {BASE['stations']})")
+    parser.add_argument("--hours", type=int, default=None, help=f"Часов плана (по умолчанию {BASE['hours']})")
+    parser.add_argument("--stops-per-hour", type=int, default=None)
+    parser.add_argument("--msgs-per-stop", type=int, default=None)
+    parser.add_argument("--snapshots-per-hour", type=int, default=None, help="FCHG-снимков в час на станцию")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None, help="Процессов для parse/merge (по умолчанию = CPU)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Задержка заглушки API в стадии fetch")
+    parser.add_argument("--workdir", default=None, help="Рабочая папка (по умолчанию временная)")
+    parser.add_argument("--keep", action="store_true", help="Не удалять рабочую папку")
+    parser.add_argument("--out", default=None, help="Файл результатов (по умолчанию reports/benchmarks/bench_<время>.json)")
+    parser.add_argument("--compare", default=None, help="Путь к прошлому прогону или 'latest'")
+    parser.add_argument("--_stage", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--_params", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args._stage:
+        _run_stage_inline(args._stage, args._params, args.workdir)
+        return
+
+    overrides = {
+        "stations": args.stations, "hours": args.hours, "stops_per_hour": args.stops_per_hour,
+        "msgs_per_stop": args.msgs_per_stop, "snapshots_per_hour": args.snapshots_per_hour, "seed": args.seed,
+    }
+    stages = [s for s in STAGES if s in args.stages]
+    if ("parse" in stages or "merge" in stages) and "generate" not in stages:
+        parser.error("parse/merge работают по архиву из стадии generate — добавь её в --stages")
+
+    root = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix="train_delays_bench_"))
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "git": _git_commit(),
+        "environment": _environment(),
+        "base": {**BASE, **{k: v for k, v in overrides.items() if v is not None}},
+        "workers": args.workers,
+        "latency_ms": args.latency_ms,
+        "runs": [],
+    }
+    try:
+        for scale in args.scales:
+            p = _params(scale, overrides)
+            p.update(workers=args.workers, latency_ms=args.latency_ms)
+            work = root / f"x{scale}"
+            if work.exists():
+                shutil.rmtree(work)
+            work.mkdir(parents=True)
+            print(f"[{scale}×] станций: {p['stations']}, часов: {p['hours']}, остановок/час: {p['stops_per_hour']}")
+            run = {"scale": scale, "stations": p["stations"], "stages": {}}
+            for stage in stages:
+                run["stages"][stage] = m = _run_stage(stage, p, work)
+                print(f"  {stage:<9} {m['rows']:>9} {m['unit']:<9} {m['wall_s']:>8.2f} с  "
+                      f"{(m['rows_per_s'] or 0):>10.0f}/с  RSS {m['peak_rss_mb']:.0f} МБ")
+            report["runs"].append(run)
+    finally:
+        if not args.keep and not args.workdir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    out = Path(args.out) if args.out else RESULTS_DIR / f"bench_{datetime.now():%Y%m%d_%H%M%S}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    _print_table(report["runs"])
+    print(f"\nРезультаты: {out}")
+    if args.compare:
+        _compare(report, _load_previous(args.compare, exclude=out))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+# scripts/check_parsers.py
+# Дифференциальная проверка XML-бэкендов train_delays.parse (etree / expat / lxml, если установлен).
+# Запуск из корня репо:
+#   python -m scripts.check_parsers                       # синтетика + пограничные случаи
+#   python -m scripts.check_parsers --raw data/raw        # + все снимки архива сырья
+#   python -m scripts.check_parsers --raw data/raw --limit 200 --bench
+#
+# Каждый документ разбирается каждым бэкендом в обоих режимах (parse_*_xml из строки и
+# parse_*_file из потока) и сравнивается с etree (assert_frame_equal: значения, dtype, порядок
+# строк). Битый XML должен давать RuntimeError во всех бэкендах. Код выхода 1 — есть расхождения.
+# --bench — суммарное время разбора по бэкендам (только XML-фаза + сборка таблицы, без чтения).
+# Синтетика, пограничные случаи и битый XML (EDGE_CASES, BROKEN) гоняются и в pytest:
+# tests/test_parsers.py, по бэкенду и документу на тест; lxml без установки — skip с причиной.
+
+from __future__ import annotations
+import argparse, io, sys, time
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from train_delays import parse, synth
+from train_delays.archive import RawArchive, LEGACY_RE, LEGACY_KIND
+
+PARSERS: Dict[str, Tuple[Callable[..., pd.DataFrame], Callable[..., pd.DataFrame]]] = {
+    "plan": (parse.parse_timetable_xml, parse.parse_timetable_file),
+    "changes": (parse.parse_changes_xml, parse.parse_changes_file),
+}
+KIND_OF = {"plan": "plan", "fchg": "changes", "rchg": "changes"}
+
+# Пограничные случаи: (имя, plan|changes, XML); эталон — результат etree.
+EDGE_CASES: List[Tuple[str, str, str]] = [
+    ("plan_entities_unicode", "plan",
+     '<timetable station="K&#246;ln &amp; Deutz" eva="8000207"><s id="1-2510161200-1">'
+     '<tl f="F" t="p" o="80" c="ICE" n="1"/><ar pt="2510161200" pp="4 &lt;A&gt;" l="" ppth="Bonn|D&#252;ren"/>'
+     '</s></timetable>'),
+    ("plan_eva_only_root_tl_after_events", "plan",
+     '<timetable station="X" eva="1"><s id="a-2510161200-2"><dp pt="2510161201" pp="1"/>'
+     '<ar pt="2510161200" pp="1"/><tl c="RE" n="7"/><tl c="IGNORED" n="0"/></s>'
+     '<s id="b-2510161200-1" eva="2"><ar pt="2510161200"/><ar pt="2510161205"/></s></timetable>'),
+    ("plan_nested_and_foreign_tags", "plan",
+     '<?xml version="1.0" encoding="UTF-8"?><!-- comment --><timetable station="X">'
+     '<wrap><s id="a-2510161200-1"><x><ar pt="2510161159"/></x><dp pt="2510161210"><![CDATA[text]]></dp>'
+     '<?pi data?></s></wrap><s id="no-ts-1"><ar/></s></timetable>'),
+    ("plan_empty", "plan", '<timetable station="X" eva="1"></timetable>'),
+    ("plan_namespace", "plan",
+     '<timetable xmlns="urn:x" station="X"><s id="a-1"><ar pt="2510161200"/></s></timetable>'),
+    ("changes_levels", "changes",
+     '<timetable station="X" eva="1"><s id="a-2510161200-1" eva="1">'
+     '<m id="r1" t="f" c="13" ts="2510161150"/>'
+     '<ar ct="2510161205" cp="3" l="7" cpth="A|B"><m id="r2" t="d" c="43" ts="2510161151" ts-tts="25-10-16 11:51:00.123"/>'
+     '<m id="r3" t="h" from="2510161100" to="2510161300" cat="Info" pr="2" ts="2510161140"/></ar>'
+     '<dp ct="2510161206"><m id="r4" t="d" c="80" ts="2510161151"/><x><m id="deep" ts="2510161151"/></x></dp>'
+     '<m id="r5" t="f" c="70" ts="2510161149"/></s>'
+     '<s id="b-2510161200-2"><ar ct="2510161300"/><dp><m id="r6" ts="bad"/></dp></s></timetable>'),
+    ("changes_dst_ts", "changes",
+     '<timetable station="X" eva="1"><s id="a-1"><m id="r1" ts="2510260230"/><m id="r2" ts="2503300230"/></s></timetable>'),
+    ("changes_empty", "changes", '<timetable station="X" eva="1"/>'),
+]
+# Битый XML: любой бэкенд обязан поднять RuntimeError
+BROKEN: List[Tuple[str, str, str]] = [
+    ("broken_unclosed", "changes", '<timetable station="X"><s id="1"><m id="r1" ts="2510161200"></s>'),
+    ("broken_empty", "plan", ""),
+    ("broken_garbage", "plan", "not xml at all"),
+]
+
+
+def synthetic_fixtures() -> Iterator[Tuple[str, str, bytes]]:
+    """Синтетика обоих режимов synth: отдельные станции и сеть линий; fchg и rchg."""
+    now = datetime(2025, 10, 16, 9, 30, tzinfo=synth.BERLIN)
+    net = synth.SynthNetwork([8000100 + i for i in range(6)], seed=1)
+    for eva, network in (("8000105", None), ("8000101", net), ("8000104", net)):
+        for hour in (8, 9):
+            yield f"synth_plan_{eva}_{hour}", "plan", synth.plan_xml(eva, "251016", hour, network=network).encode("utf-8")
+        yield f"synth_fchg_{eva}", "changes", synth.changes_xml(eva, now=now, network=network, msgs_per_stop=4).encode("utf-8")
+        yield f"synth_rchg_{eva}", "changes", synth.changes_xml(eva, now=now, recent=True, network=network).encode("utf-8")
+    for name, kind, text in EDGE_CASES:
+        yield name, kind, text.encode("utf-8")
+    # не-UTF-8 поток с объявленной кодировкой — только файловый режим (строку декодирует вызывающий)
+    latin = '<?xml version="1.0" encoding="ISO-8859-1"?><timetable station="Köln" eva="1"><s id="a-1"><ar pt="2510161200" pp="Gleis ä"/></s></timetable>'
+    yield "file_only_latin1", "plan", latin.encode("latin-1")
+
+
+def archive_fixtures(raw_root: str, limit: Optional[int]) -> Iterator[Tuple[str, str, bytes]]:
+    """Снимки архива сырья (index.jsonl) и старые timetable_*.xml."""
+    archive = RawArchive(raw_root)
+    n = 0
+    for e in archive.iter_entries():
+        if e["kind"] not in KIND_OF:
+            continue
+        if limit is not None and n >= limit:
+            return
+        with archive.open(e) as f:
+            yield f"{e['kind']}:{e['sha256'][:12]}", KIND_OF[e["kind"]], f.read()
+        n += 1
+    for path in sorted(archive.root.rglob("timetable_*.xml")):
+        m = LEGACY_RE.match(path.name)
+        if not m or (limit is not None and n >= limit):
+            continue
+        yield path.name, KIND_OF[LEGACY_KIND[m.group(1)]], path.read_bytes()
+        n += 1
+
+
+def _run(fn: Callable[..., pd.DataFrame], arg: Any, backend: str) -> Tuple[Any, float]:
+    t0 = time.perf_counter()
+    try:
+        return fn(arg, backend=backend), time.perf_counter() - t0
+    except RuntimeError as e:
+        return e, time.perf_counter() - t0
+
+
+def check(fixtures: Iterator[Tuple[str, str, bytes]], backends: List[str],
+          timings: Dict[str, float]) -> Tuple[int, List[str]]:
+    """Сравнивает бэкенды с etree на каждом документе; возвращает (число документов, расхождения)."""
+    n, failures = 0, []
+    for name, kind, data in fixtures:
+        n += 1
+        from_text, from_file = PARSERS[kind]
+        try:
+            text: Optional[str] = data.decode("utf-8")
+        except UnicodeDecodeError:
+            text = None
+        results: Dict[str, Any] = {}
+        for backend in backends:
+            if text is not None:
+                results[f"{backend}/xml"], dt = _run(from_text, text, backend)
+                timings[backend] = timings.get(backend, 0.0) + dt
+            results[f"{backend}/file"], _ = _run(from_file, io.BytesIO(data), backend)
+
+        ref_key = "etree/xml" if text is not None else "etree/file"
+        ref = results[ref_key]
+        for key, res in results.items():
+            if isinstance(ref, Exception) or isinstance(res, Exception):
+                if not (isinstance(ref, Exception) and isinstance(res, Exception)):
+                    failures.append(f"{name} [{key}]: {res!r} vs {ref_key}: {ref!r}")
+                continue
+            try:
+                pd.testing.assert_frame_equal(res, ref)
+            except AssertionError as e:
+                failures.append(f"{name} [{key}] != {ref_key}: {str(e).splitlines()[0]}")
+    return n, failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Дифференциальная проверка XML-бэкендов parse.py")
+    parser.add_argument("--raw", nargs="*", default=[], help="Корни архивов сырья (data/raw)")
+    parser.add_argument("--limit", type=int, default=None, help="Не больше N снимков из каждого архива")
+    parser.add_argument("--bench", action="store_true", help="Показать время разбора по бэкендам")
+    args = parser.parse_args()
+
+    backends = ["etree", "expat"]
+    try:
+        parse.xml_backend("lxml")
+        backends.append("lxml")
+    except ImportError:
+        print("lxml не установлен — проверяются etree и expat")
+
+    timings: Dict[str, float] = {}
+    total, failures = check(synthetic_fixtures(), backends, timings)
+    for name, kind, text in BROKEN:
+        for backend in backends:
+            for fn, arg in ((PARSERS[kind][0], text), (PARSERS[kind][1], io.BytesIO(text.encode("utf-8")))):
+                res, _ = _run(fn, arg, backend)
+                if not isinstance(res, RuntimeError):
+                    failures.append(f"{name} [{backend}/{fn.__name__}]: ожидали RuntimeError, получили {type(res).__name__}")
+        total += 1
+    if args.bench:
+        timings.clear()   # синтетика мала — время показываем по архивам
+    for raw in args.raw:
+        n, bad = check(archive_fixtures(raw, args.limit), backends, timings)
+        total += n
+        failures += bad
+
+    print(f"Документов: {total}, бэкенды: {', '.join(backends)}, расхождений: {len(failures)}")
+    for f in failures[:50]:
+        print("  ", f)
+    if args.bench and timings:
+        base = timings.get("etree") or 0.0
+        for backend, sec in timings.items():
+            speedup = f" (×{base / sec:.1f} к etree)" if base and sec else ""
+            print(f"  {backend:6s} {sec:7.2f} с{speedup}")
+    sys.exit(1 if failures else 0)
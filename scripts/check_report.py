@@ -0,0 +1,116 @@
+# scripts/check_report.py
+# Сверка train_delays.report с прямым расчётом pandas (как в ноутбуке: groupby + mean/quantile).
+# Запуск из корня репо:
+#   python -m scripts.check_report                              # merged из data/processed
+#   python -m scripts.check_report --store data/processed --last 28D
+#   python -m scripts.check_report --input data/processed/plan_parsed.csv
+#   python -m scripts.check_report --repeat 10 --bench          # × 10 строк: время на больших объёмах
+#
+# Для каждого среза (и для топов — состав и порядок групп) сравниваются events, n, mean,
+# share_over_<T>, n_pos, mean_pos и перцентили с groupby(...).agg/quantile по тем же ключам.
+# Код выхода 1 — есть расхождения.
+
+from __future__ import annotations
+import argparse, sys, time
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from train_delays import report
+from train_delays.features import time_features, line_key
+from train_delays.store import STORE_ROOT
+
+
+def reference(df: pd.DataFrame, threshold_min: int) -> pd.DataFrame:
+    """Ключи и задержка для прямого расчёта — теми же функциями, что ноутбук."""
+    tf = time_features(df, threshold_min=threshold_min)
+    station = df["station"].fillna(df["eva"]) if "station" in df.columns else df["eva"]
+    platform = pd.Series(pd.NA, index=df.index, dtype="string")
+    for col in ("platform_actual", "platform_planned", "platform"):
+        if col in df.columns:
+            platform = platform.fillna(df[col].astype("string"))
+    out = pd.DataFrame({
+        "delay": df["delay_min"].astype("Float64").astype("float64"),
+        "event": df["event"].astype("string"),
+        "station": station.astype("string"),
+        "platform": platform,
+        "weekday": tf["weekday"], "hour": tf["hour"],
+        "is_peak": tf["is_peak"], "is_weekend": tf["is_weekend"],
+    })
+    if "line" in df.columns and "tl_category" in df.columns:
+        out["line"] = line_key(df)
+    out["all"] = "all"
+    return out
+
+
+def expected(ref: pd.DataFrame, keys: List[str], threshold_min: int, qs) -> pd.DataFrame:
+    g = ref.groupby(keys or ["all"], observed=True, sort=True)["delay"]
+    res = pd.DataFrame({
+        "events": g.size(),
+        "n": g.count(),
+        "mean": g.mean(),
+        f"share_over_{threshold_min}": g.apply(lambda s: (s.dropna() > threshold_min).mean()),
+        "n_pos": g.apply(lambda s: int((s > 0).sum())),
+        "mean_pos": g.apply(lambda s: s[s > 0].mean()),
+    })
+    for q in qs:
+        res[f"p{int(round(q * 100))}"] = g.quantile(q)
+    return res
+
+
+def check(df: pd.DataFrame, got: Dict[str, pd.DataFrame], threshold_min: int, top_k: int = report.TOP_K,
+          min_events: int = report.MIN_EVENTS, rank_by: str = "mean_pos") -> List[str]:
+    ref = reference(df, threshold_min)
+    failures = []
+    for name, keys in {**report.SLICES, **report.TOPS}.items():
+        if name not in got:
+            continue
+        exp = expected(ref, keys, threshold_min, report.QUANTILES)
+        res = got[name]
+        if name in report.TOPS:
+            top = exp[exp["n"] >= min_events].sort_values(rank_by, ascending=False, kind="stable").head(top_k)
+            if not top.index.equals(res.index):
+                failures.append(f"{name}: состав топа {list(res.index)} != {list(top.index)}")
+            exp = exp.loc[res.index]
+        elif not keys:
+            exp = exp.set_axis(["all"])
+        try:
+            pd.testing.assert_frame_equal(res, exp[res.columns], check_dtype=False, check_names=False,
+                                          check_index_type=False, rtol=1e-9)
+        except (AssertionError, KeyError) as e:
+            failures.append(f"{name}: {str(e).splitlines()[0]}")
+    hist = ref["delay"].dropna().value_counts()
+    got_hist = got["delay_hist"]["events"]
+    if not hist.equals(got_hist[got_hist > 0].reindex(hist.index)):
+        failures.append("delay_hist: расхождение частот")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сверка train_delays.report с прямым расчётом pandas")
+    parser.add_argument("--input", default=None)
+    parser.add_argument("--store", default=str(STORE_ROOT))
+    parser.add_argument("--last", default=None)
+    parser.add_argument("--threshold-min", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=1, help="Повторить строки N раз (только --bench)")
+    parser.add_argument("--bench", action="store_true", help="Только время, без сверки")
+    args = parser.parse_args()
+
+    df = report.load_events(args.input) if args.input else report.load_events(last=args.last, root=args.store)
+    if df.empty:
+        print("Нет событий — сверять нечего")
+        sys.exit(0)
+    if args.repeat > 1:
+        df = pd.concat([df] * args.repeat, ignore_index=True)
+    t0 = time.perf_counter()
+    got = report.compute_report(df, threshold_min=args.threshold_min)
+    dt = time.perf_counter() - t0
+    print(f"Строк: {len(df)}, расчёт отчёта {dt:.2f} с ({len(df) / dt / 1e6:.1f} млн строк/с)")
+    if args.bench:
+        sys.exit(0)
+    failures = check(df, got, args.threshold_min)
+    print(f"Срезов: {len(got)}, расхождений: {len(failures)}")
+    for f in failures:
+        print("  ", f)
+    sys.exit(1 if failures else 0)
@@ -1,25 +1,23 @@
-from pathlib import Path
-import pandas as pd
-from train_delays.parse import parse_changes_xml  # функция из src/train_delays/parse.py
+from train_delays.archive import open_latest
+from train_delays.merge import stamp_snapshot
+from train_delays.parse_cache import parse_changes_file  # parse.py + кэш по хэшу снимка
+from train_delays.store import STORE_ROOT, write_partitions
 
 def main():
-    # Ищем последний файл изменений
-    change_files = sorted(Path("data/raw").rglob("timetable_changes_*.xml"))
-    if not change_files:
-        raise FileNotFoundError("Нет файлов timetable_changes_*.xml в data/raw/. Сначала запусти fetch.")
-    changes_file = change_files[-1]
+    # Ищем последний снимок изменений (по индексу архива data/raw/index.jsonl)
+    latest = open_latest("fchg")
+    if latest is None:
+        raise FileNotFoundError("Нет FCHG-снимков в архиве data/raw/ (и старых timetable_changes_*.xml). Сначала запусти fetch.")
+    label, source_key, fetched_at, stream = latest
 
-    print(f"Читаем файл: {changes_file}")
-    xml_text = Path(changes_file).read_text(encoding="utf-8")
+    print(f"Читаем: {label}")
 
-    # Парсим XML → tidy DataFrame
-    df = parse_changes_xml(xml_text)
+    # Парсим XML → tidy DataFrame (повторно тот же снимок — из кэша)
+    with stream:
+        df = parse_changes_file(stream)
 
     if df.empty:
-        print("Парсер вернул пустой DataFrame. Сохраняю пустой CSV со схемой.")
-        out_path = Path("data/processed/changes_parsed.csv")
-        df.to_csv(out_path, index=False)
-        print(f"Сохранено: {out_path}")
+        print("Парсер вернул пустой DataFrame — в снимке нет сообщений, сохранять нечего.")
         return
 
     # Превью — самые полезные столбцы для обзора
@@ -41,10 +39,9 @@ def main():
         print("\nТоп категорий (category):")
         print(df["category"].value_counts(dropna=False).head(10))
 
-    # Сохранение CSV (как и для плана — в data/)
-    out_path = Path("data/processed/changes_parsed.csv")
-    df.to_csv(out_path, index=False)
-    print(f"\nСохранено: {out_path}")
+    # Сохранение в партиционированный Parquet (eva × день события); fetched_at — порядок снимков для merge
+    written = write_partitions(stamp_snapshot(df, fetched_at), "changes", key=source_key[:16])
+    print(f"\nСохранено: {STORE_ROOT / 'changes'} ({len(written)} партиций)")
 
 if __name__ == "__main__":
     main()
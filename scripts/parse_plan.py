@@ -1,19 +1,19 @@
 # scripts/parse_plan.py
-from pathlib import Path
-import pandas as pd
-from train_delays.parse import parse_timetable_xml
+from train_delays.archive import open_latest
+from train_delays.merge import stamp_snapshot
+from train_delays.parse_cache import parse_timetable_file  # parse.py + кэш по хэшу снимка
+from train_delays.store import STORE_ROOT, write_partitions
 
-# Находим последний выгруженный план (по имени файла)
-plan_files = sorted(Path("data/raw").rglob("timetable_plan_*.xml"))
-if not plan_files:
-    raise FileNotFoundError("Нет файлов timetable_plan_*.xml в data/raw/")
-plan_file = plan_files[-1]
+# Находим последний выгруженный план (по индексу архива data/raw/index.jsonl)
+latest = open_latest("plan")
+if latest is None:
+    raise FileNotFoundError("Нет планов в архиве data/raw/ (и старых timetable_plan_*.xml). Сначала запусти fetch.")
+label, source_key, fetched_at, stream = latest
 
-print(f"Читаем файл: {plan_file}")
-xml_text = Path(plan_file).read_text(encoding="utf-8")
-
-# Парсим XML в DataFrame
-df = parse_timetable_xml(xml_text)
+print(f"Читаем: {label}")
+# Парсим XML в DataFrame (повторный запуск по тому же снимку берёт результат из кэша)
+with stream:
+    df = parse_timetable_file(stream)
 
 # Быстрая витрина для консоли
 preview_cols = [
@@ -27,7 +27,7 @@ print(df[preview_cols].head(10).to_string(index=False))
 print(f"\nВсего строк: {len(df)}")
 print("По типам событий:\n", df["event"].value_counts(dropna=False))
 
-# Сохраняем результат в CSV
-out_path = Path("data/processed/plan_parsed.csv")
-df.to_csv(out_path, index=False)
-print(f"\nСохранено: {out_path}")
+# Сохраняем в партиционированный Parquet (eva × день); повторный запуск по тому же снимку перезапишет его же файлы,
+# fetched_at — какой из снимков плана победит в merge
+written = write_partitions(stamp_snapshot(df, fetched_at), "plan", key=source_key[:16])
+print(f"\nСохранено: {STORE_ROOT / 'plan'} ({len(written)} партиций)")
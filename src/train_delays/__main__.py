@@ -0,0 +1,4 @@
+"""python -m train_delays <команда> — см. train_delays.cli."""
+from train_delays.cli import main
+
+main()
@@ -0,0 +1,198 @@
+"""
+Контентно-адресуемый архив сырых XML-ответов API.
+
+Раскладка (корень по умолчанию — data/raw):
+  data/raw/blobs/<ab>/<sha256>.xml.gz   # каждый уникальный payload хранится один раз, сжатым
+  data/raw/index.jsonl                  # (eva, kind, fetched_at[, slot]) → sha256, по строке на загрузку
+
+kind: "plan" | "fchg" | "rchg". Для plan в slot лежит запрошенный час "YYMMDD/HH".
+FCHG-снимки, снятые с разницей в минуты, обычно совпадают байт-в-байт — в индекс
+добавляется строка, а blob не пишется повторно.
+
+Старые папки data/raw/<YYYYMMDD_HHMM>/timetable_*.xml можно перенести командой:
+  python -m train_delays.archive --import-legacy
+"""
+from __future__ import annotations
+import argparse, gzip, hashlib, json, os, pathlib, re, threading
+from datetime import datetime
+from typing import IO, Any, Dict, Iterator, List, Optional, Tuple, Union
+from zoneinfo import ZoneInfo
+
+BERLIN = ZoneInfo("Europe/Berlin")
+
+ARCHIVE_ROOT = pathlib.Path("data/raw")
+INDEX_NAME = "index.jsonl"
+KINDS = ("plan", "fchg", "rchg")
+GZIP_LEVEL = 6
+
+# legacy: data/raw/<YYYYMMDD_HHMM>/timetable_plan_<EVA>_<STAMP>.xml и т.п.
+LEGACY_RE = re.compile(r"timetable_(plan|changes|rchg)_(\d+)_")
+LEGACY_KIND = {"plan": "plan", "changes": "fchg", "rchg": "rchg"}
+
+
+def sha256_text(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def legacy_fetched_at(path: Union[str, pathlib.Path]) -> datetime:
+    """Время загрузки старого файла: из имени папки <YYYYMMDD_HHMM>, иначе mtime."""
+    path = pathlib.Path(path)
+    try:
+        return datetime.strptime(path.parent.name, "%Y%m%d_%H%M").replace(tzinfo=BERLIN)
+    except ValueError:
+        return datetime.fromtimestamp(path.stat().st_mtime, BERLIN)
+
+
+class RawArchive:
+    """
+    Запись и чтение архива. Потокобезопасно внутри процесса; строки индекса дописываются
+    одной операцией write в режиме append, так что параллельные процессы не рвут записи.
+    """
+
+    def __init__(self, root: Union[str, pathlib.Path] = ARCHIVE_ROOT):
+        self.root = pathlib.Path(root)
+        self.index_path = self.root / INDEX_NAME
+        self._lock = threading.Lock()
+
+    # ----------------- запись -----------------
+    def blob_path(self, sha: str) -> pathlib.Path:
+        return self.root / "blobs" / sha[:2] / f"{sha}.xml.gz"
+
+    def put(
+        self,
+        content: str,
+        eva: Union[int, str],
+        kind: str,
+        fetched_at: Optional[datetime] = None,
+        slot: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """Сохраняет payload (если такого ещё нет) и добавляет строку в индекс. Возвращает запись индекса."""
+        if kind not in KINDS:
+            raise ValueError(f"kind must be one of {KINDS}")
+        data = content.encode("utf-8")
+        sha = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(sha)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0))
+            os.replace(tmp, path)  # атомарно: читатель никогда не увидит недописанный blob
+
+        entry: Dict[str, Any] = {
+            "eva": str(eva),
+            "kind": kind,
+            "fetched_at": (fetched_at or datetime.now(BERLIN)).isoformat(timespec="seconds"),
+            "sha256": sha,
+            "size": len(data),
+        }
+        if slot is not None:
+            entry["slot"] = slot
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            with self.index_path.open("a", encoding="utf-8") as f:
+                f.write(line)
+        return entry
+
+    # ----------------- чтение -----------------
+    def entries(
+        self,
+        kind: Optional[str] = None,
+        eva: Optional[Union[int, str]] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> List[Dict[str, Any]]:
+        """Записи индекса (в порядке fetched_at) с фильтрами по kind/eva/интервалу загрузки."""
+        return sorted(self.iter_entries(kind=kind, eva=eva, since=since, until=until),
+                      key=lambda e: e["fetched_at"])
+
+    def iter_entries(
+        self,
+        kind: Optional[str] = None,
+        eva: Optional[Union[int, str]] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        if not self.index_path.exists():
+            return
+        eva_s = str(eva) if eva is not None else None
+        with self.index_path.open(encoding="utf-8") as f:
+            for line in f:
+                try:
+                    e = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # оборванная последняя строка
+                if kind is not None and e["kind"] != kind:
+                    continue
+                if eva_s is not None and e["eva"] != eva_s:
+                    continue
+                if since is not None or until is not None:
+                    ts = datetime.fromisoformat(e["fetched_at"])
+                    if (since is not None and ts < since) or (until is not None and ts >= until):
+                        continue
+                yield e
+
+    def latest(self, kind: str, eva: Optional[Union[int, str]] = None) -> Optional[Dict[str, Any]]:
+        items = self.entries(kind=kind, eva=eva)
+        return items[-1] if items else None
+
+    def open(self, entry: Union[Dict[str, Any], str]) -> IO[bytes]:
+        """Бинарный поток с распакованным XML — годится для parse_*_file (потоковый разбор)."""
+        sha = entry if isinstance(entry, str) else entry["sha256"]
+        return gzip.open(self.blob_path(sha), "rb")
+
+    def read_text(self, entry: Union[Dict[str, Any], str]) -> str:
+        with self.open(entry) as f:
+            return f.read().decode("utf-8")
+
+    # ----------------- миграция -----------------
+    def import_legacy(self, legacy_root: Optional[Union[str, pathlib.Path]] = None) -> int:
+        """Переносит старые timetable_*.xml из data/raw/<YYYYMMDD_HHMM>/ в архив. Возвращает число файлов."""
+        legacy_root = pathlib.Path(legacy_root) if legacy_root else self.root
+        known = {(e["eva"], e["kind"], e["sha256"]) for e in self.iter_entries()}
+        n = 0
+        for path in sorted(legacy_root.rglob("timetable_*.xml")):
+            m = LEGACY_RE.match(path.name)
+            if not m:
+                continue
+            kind, eva = LEGACY_KIND[m.group(1)], m.group(2)
+            content = path.read_text(encoding="utf-8")
+            if (eva, kind, sha256_text(content)) in known:
+                continue
+            self.put(content, eva=eva, kind=kind, fetched_at=legacy_fetched_at(path))
+            n += 1
+        return n
+
+
+def open_latest(kind: str, root: Union[str, pathlib.Path] = ARCHIVE_ROOT
+                ) -> Optional[Tuple[str, str, datetime, IO[bytes]]]:
+    """
+    Самый свежий payload данного kind: (метка для логов, ключ источника, время загрузки, бинарный поток).
+    Ключ — sha256 payload'а (для старых файлов — имя файла без расширения).
+    Если индекс пуст — fallback на старые data/raw/**/timetable_*.xml (последний по имени).
+    """
+    archive = RawArchive(root)
+    entry = archive.latest(kind)
+    if entry is not None:
+        label = f"{entry['kind']}/{entry['eva']} @ {entry['fetched_at']} ({entry['sha256'][:12]})"
+        return label, entry["sha256"], datetime.fromisoformat(entry["fetched_at"]), archive.open(entry)
+    legacy_name = {v: k for k, v in LEGACY_KIND.items()}[kind]
+    files = sorted(pathlib.Path(root).rglob(f"timetable_{legacy_name}_*.xml"))
+    if not files:
+        return None
+    return str(files[-1]), files[-1].stem, legacy_fetched_at(files[-1]), files[-1].open("rb")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Архив сырых XML: статистика и импорт старых папок")
+    parser.add_argument("--root", default=str(ARCHIVE_ROOT))
+    parser.add_argument("--import-legacy", action="store_true",
+                        help="Перенести data/raw/<YYYYMMDD_HHMM>/timetable_*.xml в архив")
+    args = parser.parse_args()
+
+    archive = RawArchive(args.root)
+    if args.import_legacy:
+        print("Импортировано файлов:", archive.import_legacy())
+    items = archive.entries()
+    blobs = {e["sha256"] for e in items}
+    raw_bytes = sum(e["size"] for e in items)
+    print(f"Записей в индексе: {len(items)}, уникальных blob'ов: {len(blobs)}, исходный объём: {raw_bytes} байт")
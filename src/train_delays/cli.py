@@ -0,0 +1,86 @@
+"""
+Единая точка входа: python -m train_delays <команда> [аргументы].
+
+  run       — fetch → parse → merge → features в одном процессе (см. train_delays.pipeline)
+  fetch, crawl, poll, ingest, features, rollup, trips, query, report, db, stations, archive, parse-cache, stub-api
+            — то же, что python -m train_delays.<модуль> (аргументы передаются как есть)
+
+Тяжёлые модули (pandas, pyarrow, requests) импортируются только внутри выбранной команды:
+разбор аргументов и --help их не трогают — это важно для запуска из cron раз в несколько минут.
+"""
+from __future__ import annotations
+import argparse, os, runpy, sys, time
+from typing import List, Optional
+
+# команда → модуль с собственным CLI (if __name__ == "__main__")
+MODULE_COMMANDS = {
+    "fetch": "train_delays.fetch",
+    "crawl": "train_delays.crawl",
+    "poll": "train_delays.poll",
+    "ingest": "train_delays.ingest",
+    "features": "train_delays.features",
+    "rollup": "train_delays.rollup",
+    "trips": "train_delays.trips",
+    "query": "train_delays.query",
+    "report": "train_delays.report",
+    "db": "train_delays.db",
+    "stations": "train_delays.stations",
+    "archive": "train_delays.archive",
+    "parse-cache": "train_delays.parse_cache",
+    "stub-api": "train_delays.stub_api",
+}
+
+
+def _run(args: argparse.Namespace) -> None:
+    import pandas as pd
+    from train_delays.pipeline import run_pipeline
+
+    stations = args.stations or [s for s in [os.getenv("DEFAULT_STATION")] if s]
+    if not stations:
+        raise SystemExit("Не заданы станции: --stations или DEFAULT_STATION в .env")
+    t0 = time.perf_counter()
+    result = run_pipeline(
+        stations,
+        raw_root=args.raw,
+        store_root=args.store,
+        hours_ahead=args.hours_ahead,
+        recent=args.recent,
+        tol=pd.Timedelta(minutes=args.tolerance_min),
+        features=not args.no_features,
+        window_min=args.window_min,
+        threshold_min=args.threshold_min,
+    )
+    print("Run:", result, f"за {time.perf_counter() - t0:.1f} с")
+    from train_delays import fetch
+    if fetch.HTTP_CACHE is not None:
+        print("HTTP-кэш plan/station:", dict(fetch.HTTP_CACHE.stats))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in MODULE_COMMANDS:
+        module = MODULE_COMMANDS[argv[0]]
+        sys.argv = [f"python -m {module}", *argv[1:]]
+        runpy.run_module(module, run_name="__main__", alter_sys=True)
+        return
+
+    parser = argparse.ArgumentParser(prog="python -m train_delays",
+                                     description="Train delays: сбор и обработка данных DB Timetables")
+    sub = parser.add_subparsers(dest="cmd", required=True,
+                                metavar="{run," + ",".join(MODULE_COMMANDS) + "}")
+    p_run = sub.add_parser("run", help="fetch → parse → merge → features в одном процессе")
+    # значения по умолчанию — как в модулях (без импорта самих модулей)
+    p_run.add_argument("--stations", nargs="+", default=None, help="Имена станций или EVA (иначе DEFAULT_STATION)")
+    p_run.add_argument("--hours-ahead", type=int, default=0, help="Сколько следующих часов плана догрузить")
+    p_run.add_argument("--recent", action="store_true", help="RCHG (изменения за ~2 мин) вместо полного FCHG")
+    p_run.add_argument("--raw", default="data/raw", help="Корень архива сырья")
+    p_run.add_argument("--store", default="data/processed", help="Корень processed-хранилища")
+    p_run.add_argument("--tolerance-min", type=int, default=2, help="Допуск fallback-мерджа по времени, мин")
+    p_run.add_argument("--no-features", action="store_true", help="Не пересчитывать признаки")
+    p_run.add_argument("--window-min", type=int, default=60, help="Окно скользящих статистик, мин")
+    p_run.add_argument("--threshold-min", type=int, default=5, help="Порог «опоздал», мин")
+    for name, module in MODULE_COMMANDS.items():
+        sub.add_parser(name, help=f"= python -m {module}")
+    args = parser.parse_args(argv)
+    if args.cmd == "run":
+        _run(args)
@@ -0,0 +1,251 @@
+"""
+Параллельный бэкфилл: много станций × диапазон дат/часов.
+
+Запуск из корня репо:
+  python -m train_delays.crawl --stations "Hannover Hbf" 8000105 --date-from 2025-09-16 --hours 6-22
+
+- PLAN-запросы (/plan/{eva}/{YYMMDD}/{HH}) и один FCHG на станцию идут через
+  ограниченный пул потоков поверх общего fetch.SESSION (его пул соединений);
+- все запросы проходят через token bucket с квотой DB API (fetch.API_RATE_PER_MIN);
+  PLAN, свежий в HTTP-кэше fetch (fetch.HTTP_CACHE), отдаётся без запроса и квоты не тратит;
+- ретраи 429/5xx — здесь, а не в urllib3 (fetch.QUOTA_SESSION): каждая попытка берёт токен;
+- ответы кладутся в архив сырья (train_delays.archive: blobs/ + index.jsonl);
+- результат каждой задачи пишется в манифест (JSONL, append-only), поэтому повторный
+  запуск с тем же манифестом догружает только то, что ещё не скачано или упало.
+"""
+from __future__ import annotations
+import argparse, pathlib, threading, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date as date_cls, datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+import requests
+
+from train_delays import fetch
+from train_delays.archive import RawArchive
+from train_delays.manifest import ManifestWriter, load_manifest
+from train_delays.stations import get_registry
+
+DEFAULT_WORKERS = 4
+MANIFEST_NAME = "crawl_manifest.jsonl"
+
+
+# ----------------- rate limiting -----------------
+class TokenBucket:
+    """
+    Потокобезопасный token bucket: rate_per_min токенов в минуту, не более burst в запасе.
+    acquire() блокирует поток, пока не появится токен.
+    """
+
+    def __init__(self, rate_per_min: float, burst: Optional[int] = None):
+        self.rate = float(rate_per_min) / 60.0
+        self.capacity = float(burst if burst is not None else max(1, int(rate_per_min // 10)))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    return
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def retry_after_s(resp: Optional[requests.Response]) -> Optional[float]:
+    """Retry-After в секундах (только числовая форма), иначе None."""
+    if resp is None:
+        return None
+    value = resp.headers.get("Retry-After")
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def with_retries(
+    bucket: TokenBucket,
+    fn: Callable[..., Any],
+    *args: Any,
+    statuses: Iterable[int] = fetch.RETRY_STATUSES,
+    attempts: int = fetch.RETRY_TOTAL + 1,
+    **kwargs: Any,
+) -> Any:
+    """
+    fn(*args, **kwargs) с ретраями на уровне token bucket: каждая попытка берёт токен.
+    fn должна ходить через fetch.QUOTA_SESSION — ретраи urllib3 по статусу квоту обходят.
+    Повторяются HTTPError со статусом из statuses и ошибки соединения/таймауты; пауза —
+    Retry-After, если сервер его прислал, иначе экспоненциальная (как у fetch.SESSION).
+    """
+    statuses = set(statuses)
+    for attempt in range(attempts - 1):
+        bucket.acquire()
+        try:
+            return fn(*args, **kwargs)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code not in statuses:
+                raise
+            pause = retry_after_s(e.response)
+        except (requests.ConnectionError, requests.Timeout):
+            pause = None
+        time.sleep(pause if pause is not None else fetch.RETRY_BACKOFF * 2 ** attempt)
+    bucket.acquire()
+    return fn(*args, **kwargs)
+
+
+# ----------------- tasks -----------------
+def _parse_hours(spec: str) -> List[int]:
+    """'6-22' | '7,8,17' | 'all' → список часов 0..23."""
+    if spec == "all":
+        return list(range(24))
+    hours: List[int] = []
+    for part in spec.split(","):
+        if "-" in part:
+            a, b = part.split("-")
+            hours.extend(range(int(a), int(b) + 1))
+        else:
+            hours.append(int(part))
+    if any(h < 0 or h > 23 for h in hours):
+        raise ValueError("hours must be within 0..23")
+    return sorted(set(hours))
+
+
+def _date_range(date_from: str, date_to: Optional[str]) -> List[str]:
+    """Включительный диапазон дат (гибкие форматы как в fetch._to_yymmdd) → список YYMMDD."""
+    def _to_date(s: str) -> date_cls:
+        return datetime.strptime(fetch._to_yymmdd(s), "%y%m%d").date()
+
+    start = _to_date(date_from)
+    end = _to_date(date_to) if date_to else start
+    if end < start:
+        raise ValueError("date_to must not be earlier than date_from")
+    return [(start + timedelta(days=i)).strftime("%y%m%d") for i in range((end - start).days + 1)]
+
+
+def resolve_eva(station: Union[int, str]) -> str:
+    """Число → это уже EVA; имя → EVA через локальный реестр станций (API — только при промахе)."""
+    return get_registry().resolve(station)
+
+
+def _build_tasks(evas: Iterable[str], days: List[str], hours: List[int], with_changes: bool) -> List[Tuple[str, ...]]:
+    tasks: List[Tuple[str, ...]] = []
+    for eva in evas:
+        for yymmdd in days:
+            for hh in hours:
+                tasks.append(("plan", eva, yymmdd, f"{hh:02d}"))
+        if with_changes:
+            # FCHG — снимок «сейчас», а не слот: в ключе диапазон дат запуска, иначе отметка ok
+            # в манифесте отключила бы FCHG станции во всех следующих бэкфиллах
+            tasks.append(("fchg", eva, f"{days[0]}-{days[-1]}"))
+    return tasks
+
+
+def _task_key(task: Tuple[str, ...]) -> str:
+    return "/".join(task)
+
+
+def _run_task(task: Tuple[str, ...], bucket: TokenBucket, archive: RawArchive) -> Dict[str, Any]:
+    if task[0] == "plan":
+        _, eva, yymmdd, hh = task
+        cache = fetch.HTTP_CACHE
+        if cache is not None and cache.is_fresh(fetch.plan_url(eva, yymmdd, int(hh)), "plan"):
+            # свежий ответ из HTTP-кэша квоту не тратит
+            xml = fetch.get_planned_timetable(eva=eva, date=yymmdd, hour=int(hh))
+        else:
+            xml = with_retries(bucket, fetch.get_planned_timetable, eva=eva, date=yymmdd, hour=int(hh),
+                               session=fetch.QUOTA_SESSION)
+        return archive.put(xml, eva=eva, kind="plan", slot=f"{yymmdd}/{hh}")
+    _, eva, _ = task
+    xml = with_retries(bucket, fetch.get_changes, eva=eva, session=fetch.QUOTA_SESSION)
+    return archive.put(xml, eva=eva, kind="fchg")
+
+
+# ----------------- публичный API -----------------
+def crawl(
+    stations: Iterable[Union[int, str]],
+    date_from: str,
+    date_to: Optional[str] = None,
+    hours: Union[str, Iterable[int]] = "all",
+    outdir: Union[str, pathlib.Path] = "data/raw",
+    manifest: Optional[Union[str, pathlib.Path]] = None,
+    workers: int = DEFAULT_WORKERS,
+    rate_per_min: float = fetch.API_RATE_PER_MIN,
+    with_changes: bool = True,
+) -> Dict[str, int]:
+    """
+    Скачивает PLAN для всех (станция, дата, час) и по одному FCHG-снимку на станцию.
+    Ответы кладёт в архив <outdir> (blobs/ + index.jsonl), статус задач — в манифест
+    (по умолчанию <outdir>/crawl_manifest.jsonl). Задачи, уже отмеченные в манифесте как ok,
+    пропускаются. Возвращает счётчики {"total", "skipped", "ok", "failed"}.
+    """
+    if workers > fetch.HTTP_POOL_SIZE:
+        raise ValueError(f"workers must be <= HTTP_POOL_SIZE ({fetch.HTTP_POOL_SIZE})")
+    outdir = pathlib.Path(outdir)
+    manifest_path = pathlib.Path(manifest) if manifest else outdir / MANIFEST_NAME
+    done = {k for k, rec in load_manifest(manifest_path).items() if rec.get("status") == "ok"}
+
+    archive = RawArchive(outdir)
+    bucket = TokenBucket(rate_per_min)
+    hour_list = _parse_hours(hours) if isinstance(hours, str) else sorted(set(int(h) for h in hours))
+    days = _date_range(date_from, date_to)
+
+    # Промах реестра станций тоже тратит квоту — идём через тот же bucket, но последовательно
+    registry = get_registry()
+    evas: List[str] = []
+    for st in stations:
+        if not str(st).strip().isdigit() and registry.lookup(str(st)) is None:
+            bucket.acquire()
+        evas.append(resolve_eva(st))
+
+    tasks = _build_tasks(evas, days, hour_list, with_changes)
+    todo = [t for t in tasks if _task_key(t) not in done]
+    counts = {"total": len(tasks), "skipped": len(tasks) - len(todo), "ok": 0, "failed": 0}
+
+    writer = ManifestWriter(manifest_path)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_run_task, t, bucket, archive): t for t in todo}
+            for fut in as_completed(futures):
+                task = futures[fut]
+                rec: Dict[str, Any] = {"key": _task_key(task), "fetched_at": datetime.now(fetch.BERLIN).isoformat()}
+                try:
+                    rec.update(status="ok", sha256=fut.result()["sha256"])
+                    counts["ok"] += 1
+                except (requests.RequestException, RuntimeError, ValueError, OSError) as e:
+                    # OSError — запись в архив (диск полон и т.п.): задача упала, остальные дописываются
+                    rec.update(status="error", error=f"{type(e).__name__}: {e}")
+                    counts["failed"] += 1
+                writer.write(rec)
+    finally:
+        writer.close()
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Параллельный бэкфилл PLAN/FCHG по станциям и часам")
+    parser.add_argument("--stations", nargs="+", required=True,
+                        help="Названия станций или EVA-номера")
+    parser.add_argument("--date-from", required=True, help="YYMMDD | YYYYMMDD | YYYY-MM-DD")
+    parser.add_argument("--date-to", default=None, help="Включительно; по умолчанию = --date-from")
+    parser.add_argument("--hours", default="all", help="'all' | '6-22' | '7,8,17' (по умолчанию all)")
+    parser.add_argument("--outdir", default="data/raw")
+    parser.add_argument("--manifest", default=None,
+                        help=f"JSONL-манифест для докачки (по умолчанию <outdir>/{MANIFEST_NAME})")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--rate-per-min", type=float, default=fetch.API_RATE_PER_MIN)
+    parser.add_argument("--no-changes", action="store_true", help="Не качать FCHG-снимки")
+    args = parser.parse_args()
+
+    result = crawl(
+        stations=args.stations, date_from=args.date_from, date_to=args.date_to, hours=args.hours,
+        outdir=args.outdir, manifest=args.manifest, workers=args.workers,
+        rate_per_min=args.rate_per_min, with_changes=not args.no_changes,
+    )
+    print("Crawl:", result)
+    if fetch.HTTP_CACHE is not None:
+        print("HTTP-кэш plan/station:", dict(fetch.HTTP_CACHE.stats))
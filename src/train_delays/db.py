@@ -0,0 +1,316 @@
+"""
+Встроенное SQL-хранилище (SQLite) для таблиц plan / changes / merged.
+
+Схема описана один раз (колонки и их логические типы) и рендерится в DDL под диалект:
+сейчас подключение только к SQLite, но тот же DDL/UPSERT (ON CONFLICT ... DO UPDATE)
+годится для Postgres (Sprint 4). Время хранится целым числом — секунды Unix-эпохи (UTC):
+индексируемо, сортируется, одинаково в обоих движках; при чтении возвращается tz-aware Europe/Berlin.
+
+Ключи (UPSERT — повторная загрузка того же снимка ничего не дублирует, свежая строка побеждает):
+  plan, merged : (stop_id, event)
+  changes      : (msg_id, stop_id, scope) — id сообщения в пределах остановки и уровня s/ar/dp
+                 (HIM-сообщения с одним id приходят сразу на многие остановки)
+«Свежая» — как в merge: для changes по (ts, fetched_at, event_ct), для plan по fetched_at снимка.
+UPDATE с условием WHERE, поэтому порядок загрузки part-файлов (имена — хэши) не важен и старый
+снимок не затирает новый. NULL проигрывает любому значению.
+Индексы: (eva, planned_ts) и (train_run_id) для plan/merged, (eva, ts) для changes.
+
+Запуск из корня репо:
+  python -m train_delays.db load                        # processed-хранилище → data/train_delays.sqlite
+  python -m train_delays.db delays --eva 8000152 --start "2025-09-16 06:00" --end "2025-09-16 10:00"
+
+Из Python (например, сразу после parse.py):
+  conn = connect(); ingest_frame(conn, "plan", parse_timetable_file(path))
+"""
+from __future__ import annotations
+import argparse, os, pathlib, sqlite3, time
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from train_delays.merge import SNAPSHOT_COLUMN
+from train_delays.parse import CHANGES_COLUMNS, CHANGES_TS_COLUMNS, PLAN_COLUMNS
+from train_delays.store import STORE_ROOT, list_partitions, partition_signature, read_partition
+
+DB_PATH = pathlib.Path(os.getenv("TRAIN_DELAYS_DB", "data/train_delays.sqlite"))
+TZ = "Europe/Berlin"
+BATCH_ROWS = 50_000
+
+# логический тип → тип колонки в диалекте
+TYPES = {
+    "sqlite":   {"text": "TEXT", "ts": "INTEGER", "int": "INTEGER"},
+    "postgres": {"text": "TEXT", "ts": "BIGINT",  "int": "INTEGER"},
+}
+PARAM = {"sqlite": "?", "postgres": "%s"}
+
+MERGED_COLUMNS = PLAN_COLUMNS + [
+    "event_ct", "ts", "change_time", "platform_chg", "line_chg", "path_chg", "msg_id",
+    "msg_type_chg", "msg_code_chg", "category_chg", "priority_chg", "match",
+    "changed_ts", "delay_min", "platform_actual",
+]
+MERGED_TS_COLUMNS = ["planned_ts", "event_ct", "ts", "change_time", "changed_ts"]
+
+
+def _columns(names: Sequence[str], ts: Sequence[str], ints: Sequence[str] = ()) -> Dict[str, str]:
+    return {c: "ts" if c in ts else "int" if c in ints else "text" for c in names}
+
+
+TABLES: Dict[str, Dict[str, Any]] = {
+    "plan": {
+        "columns": _columns(PLAN_COLUMNS + [SNAPSHOT_COLUMN], ["planned_ts", SNAPSHOT_COLUMN]),
+        "key": ["stop_id", "event"],
+        "order": [SNAPSHOT_COLUMN],
+        "indexes": [["eva", "planned_ts"], ["train_run_id"]],
+    },
+    "changes": {
+        "columns": _columns(CHANGES_COLUMNS + [SNAPSHOT_COLUMN], CHANGES_TS_COLUMNS + [SNAPSHOT_COLUMN]),
+        "key": ["msg_id", "stop_id", "scope"],
+        "order": ["ts", SNAPSHOT_COLUMN, "event_ct"],   # строка обновляется, только если не старее
+        "indexes": [["eva", "ts"], ["stop_id", "event"]],
+    },
+    "merged": {
+        "columns": _columns(MERGED_COLUMNS, MERGED_TS_COLUMNS, ["delay_min"]),
+        "key": ["stop_id", "event"],
+        "indexes": [["eva", "planned_ts"], ["train_run_id"]],
+    },
+}
+# что уже загружено из processed-хранилища: (датасет, eva, день) → отпечаток партиции
+LOADED_TABLE = "_loaded_partitions"
+
+
+# ----------------- схема -----------------
+def schema_sql(dialect: str = "sqlite") -> List[str]:
+    """DDL всех таблиц и индексов (идемпотентный: IF NOT EXISTS)."""
+    types = TYPES[dialect]
+    stmts: List[str] = []
+    for name, spec in TABLES.items():
+        cols = ",\n  ".join(f"{c} {types[t]}" for c, t in spec["columns"].items())
+        key = ", ".join(spec["key"])
+        stmts.append(f"CREATE TABLE IF NOT EXISTS {name} (\n  {cols},\n  PRIMARY KEY ({key})\n)")
+        for idx in spec["indexes"]:
+            stmts.append(f"CREATE INDEX IF NOT EXISTS ix_{name}_{'_'.join(idx)} ON {name} ({', '.join(idx)})")
+    stmts.append(f"CREATE TABLE IF NOT EXISTS {LOADED_TABLE} (\n  dataset TEXT, eva TEXT, day TEXT, "
+                 f"signature TEXT, loaded_at TEXT,\n  PRIMARY KEY (dataset, eva, day)\n)")
+    return stmts
+
+
+def upsert_sql(table: str, dialect: str = "sqlite") -> str:
+    """INSERT ... ON CONFLICT (ключ) DO UPDATE — одинаково в SQLite ≥ 3.24 и Postgres."""
+    spec = TABLES[table]
+    cols = list(spec["columns"])
+    rest = [c for c in cols if c not in spec["key"]]
+    params = ", ".join([PARAM[dialect]] * len(cols))
+    updates = ", ".join(f"{c} = excluded.{c}" for c in rest)
+    sql = (f"INSERT INTO {table} ({', '.join(cols)}) VALUES ({params}) "
+           f"ON CONFLICT ({', '.join(spec['key'])}) DO UPDATE SET {updates}")
+    if spec.get("order"):
+        sql += f" WHERE {_not_older(table, spec['order'])}"
+    return sql
+
+
+def _not_older(table: str, order: Sequence[str]) -> str:
+    """Условие «excluded не старше строки таблицы» — лексикографически по order, NULL → -1."""
+    new, old = (f"COALESCE(excluded.{order[0]}, -1)", f"COALESCE({table}.{order[0]}, -1)")
+    if len(order) == 1:
+        return f"{new} >= {old}"
+    return f"({new} > {old} OR ({new} = {old} AND {_not_older(table, order[1:])}))"
+
+
+def connect(path: Union[str, pathlib.Path] = DB_PATH) -> sqlite3.Connection:
+    """Подключение к SQLite (WAL, synchronous=NORMAL) со схемой."""
+    path = pathlib.Path(path)
+    if str(path) != ":memory:":
+        path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path))
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")   # 64 МБ
+    with conn:
+        for stmt in schema_sql("sqlite"):
+            conn.execute(stmt)
+        _add_missing_columns(conn)
+    return conn
+
+
+def _add_missing_columns(conn: sqlite3.Connection) -> None:
+    """БД, созданная до появления колонки в схеме (например, changes.fetched_at): ALTER TABLE ADD COLUMN."""
+    types = TYPES["sqlite"]
+    for name, spec in TABLES.items():
+        have = {row[1] for row in conn.execute(f"PRAGMA table_info({name})")}
+        for c, t in spec["columns"].items():
+            if c not in have:
+                conn.execute(f"ALTER TABLE {name} ADD COLUMN {c} {types[t]}")
+
+
+# ----------------- загрузка -----------------
+def _to_epoch(s: pd.Series) -> List[Optional[int]]:
+    """Время (tz-aware или naive Europe/Berlin) → секунды эпохи, NaT → None."""
+    ts = pd.to_datetime(s)
+    if ts.dt.tz is None:
+        ts = ts.dt.tz_localize(TZ, ambiguous="NaT", nonexistent="NaT")
+    sec = ts.dt.tz_convert("UTC").dt.tz_localize(None).to_numpy("datetime64[s]")
+    return pa.array(sec.astype(np.int64), mask=np.isnat(sec)).to_pylist()
+
+
+def _rows(df: pd.DataFrame, table: str) -> Iterator[Tuple[Any, ...]]:
+    """DataFrame → кортежи в порядке колонок таблицы (нет колонки — NULL); списки — через pyarrow."""
+    cols: List[List[Any]] = []
+    for c, t in TABLES[table]["columns"].items():
+        if c not in df.columns:
+            cols.append([None] * len(df))
+        elif t == "ts":
+            cols.append(_to_epoch(df[c]))
+        elif t == "int":
+            cols.append(pa.array(df[c].astype("Int64")).to_pylist())
+        else:
+            cols.append(pa.array(df[c].astype("string")).to_pylist())
+    return zip(*cols)
+
+
+def ingest_frame(
+    conn: sqlite3.Connection,
+    table: str,
+    df: pd.DataFrame,
+    batch_size: int = BATCH_ROWS,
+) -> Dict[str, int]:
+    """
+    Пакетный UPSERT DataFrame'а (вывод parse_* / merge) в таблицу одной транзакцией.
+    Строки без ключа (например, stop_id = NULL) пропускаются. Возвращает {"rows", "skipped"}.
+    """
+    key = TABLES[table]["key"]
+    has_key = df[key].notna().all(axis=1) if set(key) <= set(df.columns) else pd.Series(False, index=df.index)
+    good = df[has_key.to_numpy()]
+    sql = upsert_sql(table)
+    with conn:
+        for i in range(0, len(good), batch_size):
+            conn.executemany(sql, _rows(good.iloc[i:i + batch_size], table))
+    return {"rows": int(len(good)), "skipped": int(len(df) - len(good))}
+
+
+def load_store(
+    conn: sqlite3.Connection,
+    root: Union[str, pathlib.Path] = STORE_ROOT,
+    datasets: Sequence[str] = ("plan", "changes", "merged"),
+    eva: Optional[Union[str, Iterable[str]]] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    full: bool = False,
+) -> Dict[str, Dict[str, int]]:
+    """
+    processed-хранилище (parquet-партиции) → БД. Партиции, не изменившиеся с прошлой
+    загрузки (по отпечатку part-файлов), пропускаются; full=True — перезалить всё.
+    """
+    loaded = {} if full else {
+        (d, e, day): sig for d, e, day, sig in conn.execute(
+            f"SELECT dataset, eva, day, signature FROM {LOADED_TABLE}")
+    }
+    stats: Dict[str, Dict[str, int]] = {}
+    for dataset in datasets:
+        st = stats.setdefault(dataset, {"partitions": 0, "loaded": 0, "rows": 0, "skipped": 0})
+        for e, day, part_dir in list_partitions(dataset, root, eva=eva, start=start, end=end):
+            st["partitions"] += 1
+            sig = partition_signature(part_dir)
+            if loaded.get((dataset, e, day)) == sig:
+                continue
+            res = ingest_frame(conn, dataset, read_partition(dataset, e, day, root))
+            with conn:
+                conn.execute(f"INSERT OR REPLACE INTO {LOADED_TABLE} VALUES (?, ?, ?, ?, ?)",
+                             (dataset, e, day, sig, datetime.now().isoformat(timespec="seconds")))
+            st["loaded"] += 1
+            st["rows"] += res["rows"]
+            st["skipped"] += res["skipped"]
+    return stats
+
+
+# ----------------- запросы -----------------
+def _epoch(value: Union[str, datetime, pd.Timestamp]) -> int:
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize(TZ)
+    return int(ts.tz_convert("UTC").timestamp())
+
+
+def read_sql(conn: sqlite3.Connection, sql: str, params: Sequence[Any] = (), table: str = "merged") -> pd.DataFrame:
+    """SELECT → DataFrame с типами как в processed-хранилище (время tz-aware, StringDtype, Int64)."""
+    df = pd.read_sql_query(sql, conn, params=list(params))
+    types = TABLES[table]["columns"]
+    for c in df.columns:
+        t = types.get(c)
+        if t == "ts":
+            df[c] = pd.to_datetime(df[c], unit="s", utc=True).dt.tz_convert(TZ)
+        elif t == "int":
+            df[c] = df[c].astype("Int64")
+        elif t == "text":
+            df[c] = df[c].astype("string")
+    return df
+
+
+def delays_at(
+    conn: sqlite3.Connection,
+    eva: Union[str, int],
+    start: Union[str, datetime, pd.Timestamp],
+    end: Union[str, datetime, pd.Timestamp],
+    event: Optional[str] = None,
+    columns: Sequence[str] = ("stop_id", "event", "planned_ts", "changed_ts", "delay_min",
+                              "line", "tl_category", "tl_number", "platform_actual"),
+) -> pd.DataFrame:
+    """Задержки на станции в [start, end) — поиск по индексу (eva, planned_ts) таблицы merged."""
+    sql = (f"SELECT {', '.join(columns)} FROM merged "
+           f"WHERE eva = ? AND planned_ts >= ? AND planned_ts < ?")
+    params: List[Any] = [str(eva), _epoch(start), _epoch(end)]
+    if event:
+        sql += " AND event = ?"
+        params.append(event)
+    return read_sql(conn, sql + " ORDER BY planned_ts", params)
+
+
+def run_events(conn: sqlite3.Connection, train_run_id: str, table: str = "merged") -> pd.DataFrame:
+    """Все события одного прогона поезда (@tra) — поиск по индексу (train_run_id)."""
+    return read_sql(conn, f"SELECT * FROM {table} WHERE train_run_id = ? ORDER BY planned_ts",
+                    [train_run_id], table=table)
+
+
+def explain(conn: sqlite3.Connection, sql: str, params: Sequence[Any] = ()) -> List[str]:
+    """План выполнения запроса (проверить, что используется индекс, а не полный скан)."""
+    return [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, list(params))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SQLite-хранилище plan/changes/merged")
+    parser.add_argument("--db", default=str(DB_PATH), help="Файл БД")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_load = sub.add_parser("load", help="Загрузить processed-хранилище в БД (инкрементально)")
+    p_load.add_argument("--store", default=str(STORE_ROOT))
+    p_load.add_argument("--datasets", nargs="+", default=["plan", "changes", "merged"], choices=list(TABLES))
+    p_load.add_argument("--eva", nargs="*", default=None)
+    p_load.add_argument("--start", default=None, help="YYYY-MM-DD")
+    p_load.add_argument("--end", default=None, help="YYYY-MM-DD")
+    p_load.add_argument("--full", action="store_true", help="Перезалить все партиции")
+    p_del = sub.add_parser("delays", help="Задержки на станции за интервал")
+    p_del.add_argument("--eva", required=True)
+    p_del.add_argument("--start", required=True, help="'YYYY-MM-DD HH:MM' (Europe/Berlin)")
+    p_del.add_argument("--end", required=True)
+    p_del.add_argument("--event", choices=["ar", "dp"], default=None)
+    p_sch = sub.add_parser("schema", help="Напечатать DDL")
+    p_sch.add_argument("--dialect", choices=list(TYPES), default="sqlite")
+    args = parser.parse_args()
+
+    if args.cmd == "schema":
+        print(";\n\n".join(schema_sql(args.dialect)) + ";")
+    else:
+        conn = connect(args.db)
+        t0 = time.perf_counter()
+        if args.cmd == "load":
+            for name, st in load_store(conn, args.store, args.datasets, args.eva, args.start, args.end,
+                                       full=args.full).items():
+                print(f"{name}: {st}")
+            print(f"Готово за {time.perf_counter() - t0:.1f} с → {args.db}")
+        else:
+            df = delays_at(conn, args.eva, args.start, args.end, args.event)
+            print(df.to_string(index=False))
+            print(f"\n{len(df)} строк за {(time.perf_counter() - t0) * 1000:.0f} мс")
+        conn.close()
@@ -0,0 +1,204 @@
+"""
+Дедупликация сообщений изменений между снимками.
+
+Каждый fchg-снимок повторяет все ещё действующие <m>, поэтому без фильтра датасет changes
+копит одно и то же сообщение десятки раз. Здесь по каждой станции хранится индекс сообщений
+(stop_id, scope, msg_id) → последнее выпущенное состояние (ts, event_ct, platform):
+  data/processed/_dedup/eva=<EVA>.npz   # хэши сообщений + хэши их состояний + когда сообщение последний раз было в снимке
+
+- в датасет проходит новое сообщение и сообщение, состояние которого отличается от последнего
+  выпущенного: новый ts или сдвинутые атрибуты события (ct/cp) — fchg может перенести ct, не
+  меняя <m>. Возврат к прежнему состоянию (ct 08:05 → 08:15 → 08:05) — тоже изменение, строка
+  выпускается, и последнее состояние в merge совпадает с прогоном без дедупликации;
+- id берётся в пределах остановки и уровня s/ar/dp: HIM-сообщения с одним id приходят
+  сразу на многие остановки, и это разные строки;
+- сообщение, которого не было в снимках дольше окна валидности (DEDUP_WINDOW; «сейчас» снимка —
+  самый свежий ts его сообщений), вытесняется: индекс станции ограничен окном, а не историей,
+  в памяти — индекс одной станции.
+
+Сообщение, вытесненное и затем снова увиденное (поздний бэкфилл старых снимков), выпускается
+повторно: лишний дубль безвреден для merge (там всё равно берётся последнее состояние),
+потерянное сообщение — нет.
+"""
+from __future__ import annotations
+import os, pathlib
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from train_delays import metrics
+from train_delays.store import STORE_ROOT, UNKNOWN
+
+DEDUP_DIR = "_dedup"
+DEDUP_WINDOW = pd.Timedelta(hours=36)
+ID_COLUMNS = ["stop_id", "scope", "msg_id"]            # какое это сообщение
+STATE_COLUMNS = ["ts", "event_ct", "platform"]         # его состояние в снимке
+KEY_TS_COLUMNS = ("ts", "event_ct")
+INDEX_VERSION = 3
+
+
+def _key_part(s: pd.Series, is_ts: bool) -> pd.Series:
+    if not is_ts:
+        return s.astype("string").fillna("")
+    ts = pd.to_datetime(s)
+    if ts.dt.tz is not None:
+        ts = ts.dt.tz_convert("UTC")
+    return ts.dt.strftime("%Y%m%d%H%M").astype("string").fillna("")
+
+
+def _hash(df: pd.DataFrame, columns: List[str]) -> np.ndarray:
+    parts = [_key_part(df[c], c in KEY_TS_COLUMNS) for c in columns]
+    joined = parts[0].str.cat(parts[1:], sep="|")
+    return pd.util.hash_array(joined.to_numpy(dtype=object))
+
+
+def message_keys(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """uint64-хэши (сообщение, состояние) по строкам df (не зависят от dtype колонок и процесса)."""
+    return _hash(df, ID_COLUMNS), _hash(df, STATE_COLUMNS)
+
+
+def _epoch_s(df: pd.DataFrame) -> np.ndarray:
+    """Время сообщения, сек UTC; NaT → -1."""
+    ts = pd.to_datetime(df["ts"])
+    if ts.dt.tz is not None:
+        ts = ts.dt.tz_convert("UTC").dt.tz_localize(None)
+    sec = ts.to_numpy("datetime64[s]")
+    out = sec.astype(np.int64)
+    out[np.isnat(sec)] = -1
+    return out
+
+
+def _last_per_key(keys: np.ndarray) -> np.ndarray:
+    """Позиции последнего вхождения каждого ключа (по возрастанию позиции)."""
+    _, rev = np.unique(keys[::-1], return_index=True)
+    return np.sort(len(keys) - 1 - rev)
+
+
+class MessageIndex:
+    """
+    Индекс сообщений одной станции: отсортированный массив хэшей сообщений, хэш последнего
+    выпущенного состояния каждого и когда сообщение видели последним.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self.keys = np.empty(0, dtype=np.uint64)
+        self.states = np.empty(0, dtype=np.uint64)
+        self.last_seen = np.empty(0, dtype=np.int64)
+        self.dirty = False
+        if path.exists():
+            with np.load(path) as z:
+                if int(z["version"]) == INDEX_VERSION:
+                    self.keys, self.states, self.last_seen = z["keys"], z["states"], z["last_seen"]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def lookup(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """(найден ли ключ, позиция в индексе)."""
+        if not len(self.keys):
+            return np.zeros(len(keys), dtype=bool), np.zeros(len(keys), dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return self.keys[pos] == keys, pos
+
+    def touch(self, pos: np.ndarray, when_s: int) -> None:
+        if len(pos):
+            self.last_seen[pos] = np.maximum(self.last_seen[pos], when_s)
+            self.dirty = True
+
+    def set_states(self, pos: np.ndarray, states: np.ndarray) -> None:
+        if len(pos):
+            self.states[pos] = states
+            self.dirty = True
+
+    def add(self, keys: np.ndarray, states: np.ndarray, when_s: int) -> None:
+        """Новые сообщения (keys уникальны и не в индексе) с их состояниями."""
+        if not len(keys):
+            return
+        n_new = len(keys)
+        keys = np.concatenate([self.keys, keys])
+        states = np.concatenate([self.states, states])
+        seen = np.concatenate([self.last_seen, np.full(n_new, when_s, dtype=np.int64)])
+        order = np.argsort(keys, kind="stable")
+        self.keys, self.states, self.last_seen = keys[order], states[order], seen[order]
+        self.dirty = True
+
+    def evict(self, horizon_s: int) -> int:
+        """Убирает сообщения, не встречавшиеся в снимках с horizon_s; возвращает, сколько убрано."""
+        keep = self.last_seen >= horizon_s
+        dropped = int((~keep).sum())
+        if dropped:
+            self.keys, self.states, self.last_seen = self.keys[keep], self.states[keep], self.last_seen[keep]
+            self.dirty = True
+        return dropped
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        with tmp.open("wb") as f:
+            np.savez(f, version=np.array(INDEX_VERSION), keys=self.keys, states=self.states,
+                     last_seen=self.last_seen)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+
+class ChangeDeduper:
+    """
+    Фильтр потока changes по персистентным индексам станций.
+    filter() обновляет индексы в памяти; save() пишет их — после того как отфильтрованные
+    строки записаны в хранилище (иначе при сбое сообщения потерялись бы).
+    """
+
+    def __init__(self, root: Union[str, pathlib.Path] = STORE_ROOT, window: pd.Timedelta = DEDUP_WINDOW):
+        self.dir = pathlib.Path(root) / DEDUP_DIR
+        self.window_s = int(window.total_seconds())
+        self._indexes: Dict[str, MessageIndex] = {}
+
+    def index(self, eva: str) -> MessageIndex:
+        if eva not in self._indexes:
+            self._indexes[eva] = MessageIndex(self.dir / f"eva={eva}.npz")
+        return self._indexes[eva]
+
+    def filter(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Только новые/обновлённые сообщения df (порядок строк сохраняется)."""
+        if df.empty:
+            return df
+        with metrics.stage("dedup") as st:
+            keys, states = message_keys(df)
+            ts = _epoch_s(df)
+            evas = df["eva"].astype("string").fillna(UNKNOWN).to_numpy(dtype=object)
+            keep = np.zeros(len(df), dtype=bool)
+            for eva in pd.unique(evas):
+                rows = np.flatnonzero(evas == eva)
+                # «сейчас» снимка — самый свежий ts его сообщений (воспроизводимо при перепарсинге)
+                now_s = int(ts[rows].max())
+                # повторы внутри снимка (одно сообщение в том же состоянии в нескольких местах XML) —
+                # первое вхождение
+                _, first = np.unique(np.stack([keys[rows], states[rows]], axis=1), axis=0, return_index=True)
+                cand = rows[np.sort(first)]
+                idx = self.index(eva)
+                found, pos = idx.lookup(keys[cand])
+                idx.touch(pos[found], now_s)
+                # выпускается новое сообщение и сообщение в состоянии, отличном от последнего выпущенного
+                emit = ~found
+                emit[found] = idx.states[pos[found]] != states[cand[found]]
+                keep[cand[emit]] = True
+                # запоминаем состояние последнего вхождения каждого сообщения в снимке
+                last = _last_per_key(keys[cand])
+                cand, found, pos = cand[last], found[last], pos[last]
+                idx.set_states(pos[found], states[cand[found]])
+                idx.add(keys[cand[~found]], states[cand[~found]], now_s)
+                if now_s >= 0:
+                    idx.evict(now_s - self.window_s)
+            st.set(rows=len(df), emitted=int(keep.sum()))
+        return df[keep].reset_index(drop=True)
+
+    def save(self) -> None:
+        for idx in self._indexes.values():
+            idx.save()
+
+    def sizes(self) -> Dict[str, int]:
+        return {eva: len(idx) for eva, idx in self._indexes.items()}
@@ -0,0 +1,300 @@
+"""
+Признаки поверх merged (план + изменения): всё векторно, без groupby.apply и циклов по строкам.
+
+- time_features: hour, weekday, minute_of_day, is_peak, is_weekend, delayed_5m
+  (то же, что считал ноутбук, от planned_ts с fallback на changed_ts);
+- trip_key / stop_seq: stop_id = "<trip>-<YYMMDDHHMM старта>-<номер остановки>", ключ рейса —
+  всё до последнего "-", так что один рейс узнаётся на всех собранных станциях;
+- prev_stop_delay: задержка того же рейса на предыдущей остановке (из собранных, с известной
+  задержкой; dp, если есть, иначе ar), prev_stop_eva — где это было;
+- скользящая статистика задержек по станции и по линии за последние ROLL_WINDOW_MIN минут
+  (окно [t − N, t), строки той же минуты не входят — без утечки текущего значения):
+  roll_<eva|line>_n, roll_<eva|line>_mean, roll_<eva|line>_share5;
+- platform_changed: фактическая платформа отличается от плановой.
+
+build_features() пересчитывает датасет features (партиции eva × день, как merged) только для
+дней, где merged-партиции изменились с прошлого запуска (+ следующий день, чьё окно/рейсы
+захватывают изменённый). Каждый день считается по всем станциям с контекстом предыдущего дня.
+
+Запуск из корня репо:
+  python -m train_delays.features --workers 8
+"""
+from __future__ import annotations
+import argparse, os, pathlib, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from train_delays.manifest import ManifestWriter, load_manifest
+from train_delays.store import (PARTITION_TS, STORE_ROOT, TZ, UNKNOWN, list_partitions, partition_date,
+                                partition_signature, read_dataset, read_partition, write_partitions)
+
+PEAK_HOURS = ((7, 9), (16, 19))     # включительно, как в ноутбуке
+DELAY_THRESHOLD_MIN = 5
+ROLL_WINDOW_MIN = 60
+FEATURES_KEY = "features"
+MANIFEST_NAME = "_features_manifest.jsonl"
+
+# колонки merged, которые нужны для признаков (и остаются в датасете features)
+INPUT_COLUMNS = ["station", "eva", "stop_id", "event", "planned_ts", "changed_ts", "delay_min",
+                 "line", "tl_category", "platform_planned", "platform_actual"]
+
+_MINUTE_NS = 60 * 10**9
+
+
+# ----------------- отдельные признаки -----------------
+def event_time(df: pd.DataFrame) -> pd.Series:
+    """Локальное время события: planned_ts, иначе changed_ts."""
+    ts = df["planned_ts"].fillna(df["changed_ts"]) if "changed_ts" in df.columns else df["planned_ts"]
+    ts = pd.to_datetime(ts)
+    return ts.dt.tz_convert(TZ) if ts.dt.tz is not None else ts
+
+
+def time_features(df: pd.DataFrame, threshold_min: int = DELAY_THRESHOLD_MIN) -> pd.DataFrame:
+    ts = event_time(df)
+    hour = ts.dt.hour
+    peak = np.zeros(len(df), dtype=bool)
+    for a, b in PEAK_HOURS:
+        peak |= hour.between(a, b).to_numpy(dtype=bool, na_value=False)
+    weekday = ts.dt.dayofweek  # 0=Пн … 6=Вс
+    return pd.DataFrame({
+        "hour": hour.astype("Int8"),
+        "weekday": weekday.astype("Int8"),
+        "minute_of_day": (hour * 60 + ts.dt.minute).astype("Int16"),
+        "is_peak": peak,
+        "is_weekend": (weekday >= 5).to_numpy(dtype=bool, na_value=False),
+        f"delayed_{threshold_min}m": (df["delay_min"].fillna(0) > threshold_min).astype("int8").to_numpy(),
+    }, index=df.index)
+
+
+def trip_parts(stop_id: pd.Series) -> pd.DataFrame:
+    """
+    stop_id → trip_key (всё до последнего '-') и stop_seq (номер остановки в рейсе).
+    Строковые операции — в pyarrow.compute (str.rpartition в pandas идёт по строкам в Python).
+    """
+    arr = pa.array(stop_id.astype("string"), type=pa.large_string())
+    parts = pc.split_pattern(arr, "-", max_splits=1, reverse=True)
+    ok = pc.equal(pc.list_value_length(parts), 2)
+    parts = pc.if_else(ok, parts, pa.scalar(["", ""], parts.type))
+    head, tail = pc.list_element(parts, 0), pc.list_element(parts, 1)
+    ok = pc.and_(ok, pc.utf8_is_digit(tail))
+    trip = pc.if_else(ok, head, pa.scalar(None, head.type))
+    seq = pc.cast(pc.if_else(ok, tail, pa.scalar(None, tail.type)), pa.int16())
+    return pd.DataFrame({
+        "trip_key": pd.Series(trip, dtype="string", index=stop_id.index),
+        "stop_seq": pd.Series(seq.to_pandas(), index=stop_id.index).astype("Int16"),
+    }, index=stop_id.index)
+
+
+def prev_stop_delay(df: pd.DataFrame, trips: pd.DataFrame) -> pd.DataFrame:
+    """
+    Задержка рейса на предыдущей собранной остановке. Одна сортировка по (trip_key, stop_seq)
+    и сдвиг на одну строку внутри рейса; обратно к событиям — hash join по (trip_key, stop_seq).
+    """
+    ev = pd.DataFrame({
+        "trip_key": trips["trip_key"], "stop_seq": trips["stop_seq"], "eva": df["eva"],
+        "is_dp": df["event"].eq("dp").fillna(False).to_numpy(dtype=bool), "delay": df["delay_min"],
+    })
+    ev = ev[ev["trip_key"].notna() & ev["stop_seq"].notna() & ev["delay"].notna()]
+    # одна строка на остановку: dp (если есть) сортируется после ar и побеждает
+    stops = (ev.sort_values(["trip_key", "stop_seq", "is_dp"], kind="stable")
+               .drop_duplicates(["trip_key", "stop_seq"], keep="last")
+               .reset_index(drop=True))
+    same_trip = stops["trip_key"].eq(stops["trip_key"].shift(1)).fillna(False)
+    stops["prev_stop_delay"] = stops["delay"].shift(1).where(same_trip).astype("Int64")
+    stops["prev_stop_eva"] = stops["eva"].shift(1).where(same_trip).astype("string")
+
+    keys = trips[["trip_key", "stop_seq"]].reset_index()
+    out = keys.merge(stops[["trip_key", "stop_seq", "prev_stop_delay", "prev_stop_eva"]],
+                     on=["trip_key", "stop_seq"], how="left", sort=False)
+    return out.set_index("index")[["prev_stop_delay", "prev_stop_eva"]].reindex(df.index)
+
+
+def rolling_delay_stats(
+    group: pd.Series,
+    ts: pd.Series,
+    delay: pd.Series,
+    window_min: int = ROLL_WINDOW_MIN,
+    threshold_min: int = DELAY_THRESHOLD_MIN,
+    prefix: str = "roll",
+) -> pd.DataFrame:
+    """
+    Для каждой строки — число событий с известной задержкой, средняя задержка и доля > threshold
+    среди событий той же группы в окне [ts − window, ts). Без groupby.rolling: группы и минуты
+    упакованы в один int64-ключ, границы окна — searchsorted, суммы — разности cumsum.
+    """
+    n = len(ts)
+    codes = pd.factorize(group, use_na_sentinel=True)[0].astype(np.int64)
+    ts_ns = pd.to_datetime(ts).to_numpy(dtype="datetime64[ns]").view("i8")
+    valid = (codes >= 0) & (ts_ns != np.iinfo(np.int64).min)
+
+    count = np.full(n, np.nan)
+    mean = np.full(n, np.nan)
+    share = np.full(n, np.nan)
+    if valid.any():
+        idx = np.flatnonzero(valid)
+        minutes = ts_ns[idx] // _MINUTE_NS
+        key = codes[idx] * (1 << 32) + (minutes - minutes.min())
+        order = np.argsort(key, kind="stable")
+        k = key[order]
+        v = delay.to_numpy(dtype="float64", na_value=np.nan)[idx][order]
+        has = ~np.isnan(v)
+        csum = np.concatenate(([0.0], np.cumsum(np.where(has, v, 0.0))))
+        ccnt = np.concatenate(([0], np.cumsum(has)))
+        cthr = np.concatenate(([0], np.cumsum(has & (v > threshold_min))))
+        lo = np.searchsorted(k, k - window_min, side="left")
+        hi = np.searchsorted(k, k, side="left")
+        cnt = ccnt[hi] - ccnt[lo]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            m = np.where(cnt > 0, (csum[hi] - csum[lo]) / cnt, np.nan)
+            sh = np.where(cnt > 0, (cthr[hi] - cthr[lo]) / cnt, np.nan)
+        target = idx[order]
+        count[target], mean[target], share[target] = cnt, m, sh
+
+    return pd.DataFrame({
+        f"{prefix}_n": pd.array(np.where(np.isnan(count), 0, count).astype(np.int32)),
+        f"{prefix}_mean": mean.astype(np.float32),
+        f"{prefix}_share{threshold_min}": share.astype(np.float32),
+    }, index=ts.index)
+
+
+def line_key(df: pd.DataFrame) -> pd.Series:
+    """Линия для группировки: '<категория> <линия>' (например, 'RE 2'), иначе только категория."""
+    cat = pa.array(df["tl_category"].astype("string"), type=pa.large_string())
+    line = pa.array(df["line"].astype("string"), type=pa.large_string())
+    key = pc.coalesce(pc.binary_join_element_wise(cat, line, pa.scalar(" ", pa.large_string())), cat, line)
+    return pd.Series(key, dtype="string", index=df.index)
+
+
+def platform_changed(df: pd.DataFrame) -> np.ndarray:
+    both = df["platform_actual"].notna() & df["platform_planned"].notna()
+    return (both & df["platform_actual"].ne(df["platform_planned"])).to_numpy(dtype=bool, na_value=False)
+
+
+# ----------------- всё разом -----------------
+def compute_features(
+    df: pd.DataFrame,
+    window_min: int = ROLL_WINDOW_MIN,
+    threshold_min: int = DELAY_THRESHOLD_MIN,
+) -> pd.DataFrame:
+    """merged (любая выборка: партиция, день, месяц) → те же строки + признаки."""
+    base = df[[c for c in INPUT_COLUMNS if c in df.columns]].copy()
+    if base.empty:
+        return base
+    ts = event_time(base)
+    trips = trip_parts(base["stop_id"])
+    parts = [
+        base,
+        time_features(base, threshold_min),
+        trips,
+        prev_stop_delay(base, trips),
+        rolling_delay_stats(base["eva"], ts, base["delay_min"], window_min, threshold_min, prefix="roll_eva"),
+        rolling_delay_stats(line_key(base), ts, base["delay_min"], window_min, threshold_min, prefix="roll_line"),
+    ]
+    out = pd.concat(parts, axis=1)
+    out["platform_changed"] = platform_changed(base)
+    return out
+
+
+# ----------------- инкрементальный пересчёт датасета -----------------
+def params_tag(window_min: int, threshold_min: int) -> str:
+    """Параметры расчёта в манифесте: другие окно/порог — пересчитать всё."""
+    return f"w{window_min}/t{threshold_min}"
+
+
+def features_for_day(merged: pd.DataFrame, day: str, window_min: int, threshold_min: int) -> pd.DataFrame:
+    """Признаки строк дня day; merged — все станции за day и предыдущий день (контекст окон и рейсов)."""
+    feats = compute_features(merged, window_min, threshold_min)
+    feats = feats[(partition_date(feats, PARTITION_TS["features"]) == day).to_numpy()]
+    return feats.reset_index(drop=True)
+
+
+def _build_day(day: str, root: str, evas: Optional[List[str]], window_min: int, threshold_min: int) -> Dict[str, Any]:
+    """Воркер: признаки за день по всем станциям (контекст — предыдущий день) → датасет features."""
+    t0 = time.perf_counter()
+    if day == UNKNOWN:
+        frames = [read_partition("merged", e, UNKNOWN, root, columns=INPUT_COLUMNS) for e in evas or []]
+        merged = pd.concat([f for f in frames if not f.empty] or [pd.DataFrame(columns=INPUT_COLUMNS)],
+                           ignore_index=True)
+    else:
+        d = datetime.strptime(day, "%Y-%m-%d").date()
+        merged = read_dataset("merged", root, start=d - timedelta(days=1), end=d, columns=INPUT_COLUMNS)
+    if merged.empty:
+        return {"day": day, "rows": 0, "partitions": 0}
+
+    feats = features_for_day(merged, day, window_min, threshold_min)
+    written = write_partitions(feats, "features", key=FEATURES_KEY, root=root)
+    return {"day": day, "rows": int(len(feats)), "partitions": len(written),
+            "seconds": round(time.perf_counter() - t0, 3)}
+
+
+def build_features(
+    root: Union[str, pathlib.Path] = STORE_ROOT,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    workers: Optional[int] = None,
+    full: bool = False,
+    window_min: int = ROLL_WINDOW_MIN,
+    threshold_min: int = DELAY_THRESHOLD_MIN,
+) -> Dict[str, int]:
+    """
+    Пересчитывает features для изменившихся дней merged (full=True — для всех).
+    Возвращает {"partitions", "days", "skipped_days", "rows"}.
+    """
+    root = pathlib.Path(root)
+    manifest_path = root / MANIFEST_NAME
+    seen = load_manifest(manifest_path)
+    params = params_tag(window_min, threshold_min)
+
+    parts = list_partitions("merged", root, start=start, end=end)
+    sigs = {f"{e}/{d}": partition_signature(p) for e, d, p in parts}
+    days_all = sorted({d for _, d, _ in parts})
+    dirty = {key.split("/", 1)[1] for key, sig in sigs.items()
+             if full or seen.get(key, {}).get("signature") != sig or seen[key].get("params") != params}
+    # изменённый день сдвигает окно и рейсы через полночь следующего дня
+    for day in list(dirty):
+        if day != UNKNOWN:
+            nxt = (datetime.strptime(day, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+            if nxt in days_all:
+                dirty.add(nxt)
+    todo = sorted(dirty)
+    unknown_evas = [e for e, d, _ in parts if d == UNKNOWN]
+    counts = {"partitions": len(parts), "days": len(todo), "skipped_days": len(days_all) - len(todo), "rows": 0}
+    if not todo:
+        return counts
+
+    workers = workers or os.cpu_count() or 1
+    with ManifestWriter(manifest_path) as writer, ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_build_day, d, str(root), unknown_evas if d == UNKNOWN else None,
+                               window_min, threshold_min): d for d in todo}
+        for fut in as_completed(futures):
+            day = futures[fut]
+            res = fut.result()
+            counts["rows"] += res["rows"]
+            for key, sig in sigs.items():
+                if key.split("/", 1)[1] == day:
+                    writer.write({"key": key, "signature": sig, "params": params, "rows": res["rows"],
+                                  "built_at": datetime.now().isoformat(timespec="seconds")})
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Признаки по merged → data/processed/features (инкрементально)")
+    parser.add_argument("--store", default=str(STORE_ROOT), help="Корень processed-хранилища")
+    parser.add_argument("--start", default=None, help="Дата начала (YYYY-MM-DD), включительно")
+    parser.add_argument("--end", default=None, help="Дата конца (YYYY-MM-DD), включительно")
+    parser.add_argument("--workers", type=int, default=None, help="Процессов (по умолчанию = CPU)")
+    parser.add_argument("--full", action="store_true", help="Пересчитать всё, а не только изменившиеся дни")
+    parser.add_argument("--window-min", type=int, default=ROLL_WINDOW_MIN, help="Окно скользящих статистик, мин")
+    parser.add_argument("--threshold-min", type=int, default=DELAY_THRESHOLD_MIN, help="Порог «опоздал», мин")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    result = build_features(args.store, args.start, args.end, workers=args.workers, full=args.full,
+                            window_min=args.window_min, threshold_min=args.threshold_min)
+    print("Features:", result, f"за {time.perf_counter() - t0:.1f} с")
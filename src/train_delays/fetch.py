@@ -1,6 +1,7 @@
 from __future__ import annotations
-import os, time, json, pathlib
-from typing import Any, Dict, List, Optional, Union
+import os, time, json, hashlib, pathlib, threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple, Union
 from zoneinfo import ZoneInfo
 from datetime import datetime
 
@@ -9,37 +10,61 @@ from requests.adapters import HTTPAdapter, Retry
 from dotenv import load_dotenv
 import xml.etree.ElementTree as ET
 
+from train_delays import metrics
+from train_delays.archive import RawArchive
+from train_delays.stations import get_registry
+
+load_dotenv()  # подтягиваем DB_CLIENT_ID и DB_API_KEY из .env
 
 # --- Константы/настройки ---
 BERLIN = ZoneInfo("Europe/Berlin") # локальная TZ (для меток времени и дефолтов)
-BASE = "https://apis.deutschebahn.com/db-api-marketplace/apis"
+# DB_API_BASE в .env позволяет направить загрузку на локальную заглушку API (тесты/бенчмарки)
+BASE = os.getenv("DB_API_BASE", "https://apis.deutschebahn.com/db-api-marketplace/apis").rstrip("/")
 USER_AGENT = "train-delays-analysis/0.1 (+github.com/yourname)"
-HTTP_TIMEOUT_S = 30
+HTTP_TIMEOUT_S = float(os.getenv("DB_HTTP_TIMEOUT_S", "30"))  # короткий таймаут удобен против заглушки со сбоями
 RETRY_TOTAL = 5
 RETRY_BACKOFF = 0.5
 RETRY_STATUSES = (429, 500, 502, 503, 504)
 RAW_SAVE_PAUSE_S = 0.2
-
-load_dotenv()  # подтягиваем DB_CLIENT_ID и DB_API_KEY из .env
+HTTP_POOL_SIZE = 16       # соединений на хост в SESSION (≥ числа воркеров краулера)
+API_RATE_PER_MIN = 60     # квота DB Timetables API (запросов в минуту)
+# HTTP-кэш plan/station (см. HttpCache): DB_HTTP_CACHE=0 — выключить
+HTTP_CACHE_ENABLED = os.getenv("DB_HTTP_CACHE", "1") != "0"
+HTTP_CACHE_DIR = pathlib.Path(os.getenv("DB_HTTP_CACHE_DIR", "data/raw/_http_cache"))
+# окно свежести, с: внутри него запрос не отправляется вовсе, после — условный запрос (ETag/Last-Modified)
+HTTP_CACHE_FRESH_S = {
+    "plan": float(os.getenv("DB_HTTP_CACHE_PLAN_FRESH_S", "3600")),
+    "station": float(os.getenv("DB_HTTP_CACHE_STATION_FRESH_S", str(7 * 24 * 3600))),
+}
 
 
 # ----------------- утилиты -----------------
-def _make_session() -> requests.Session:
-    """HTTP-сессия с ретраями и UA."""
+def _make_session(status_retries: bool = True) -> requests.Session:
+    """
+    HTTP-сессия с ретраями и UA. status_retries=False — повторяются только ошибки соединения
+    (запрос не дошёл до API); ответы 429/5xx сразу возвращаются вызывающему.
+    """
     s = requests.Session()
     retries = Retry(
         total=RETRY_TOTAL,
+        read=None if status_retries else 0,
         backoff_factor=RETRY_BACKOFF,
-        status_forcelist=RETRY_STATUSES,
+        status_forcelist=RETRY_STATUSES if status_retries else (),
+        respect_retry_after_header=status_retries,   # иначе 429/503 с Retry-After всё равно повторяются
         allowed_methods=("GET", "POST"),
         raise_on_status=False,
     )
-    s.mount("https://", HTTPAdapter(max_retries=retries))
+    adapter = HTTPAdapter(max_retries=retries, pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)  # локальная заглушка API
     s.headers.update({"User-Agent": USER_AGENT})
     return s
 
 
 SESSION = _make_session()
+# для вызывающих со своим token bucket (crawl, poll): ретраи по статусу обошли бы квоту,
+# поэтому они повторяют запрос сами и берут токен на каждую попытку (crawl.with_retries)
+QUOTA_SESSION = _make_session(status_retries=False)
 
 
 def _headers() -> Dict[str, str]:
@@ -56,6 +81,110 @@ def _headers() -> Dict[str, str]:
     }
 
 
+def _get(url: str, headers: Dict[str, str], endpoint: str,
+         session: Optional[requests.Session] = None) -> requests.Response:
+    """GET через session (по умолчанию SESSION) с замером: латентность (вместе с ретраями), статус, число ретраев, байты."""
+    with metrics.stage("http_request", endpoint=endpoint) as st:
+        r = (session or SESSION).get(url, headers=headers, timeout=HTTP_TIMEOUT_S)
+        retries = getattr(r.raw, "retries", None)
+        st.set(status=str(r.status_code), bytes=len(r.content),
+               retries=len(retries.history) if retries is not None else 0)
+    return r
+
+
+class HttpCache:
+    """
+    Дисковый HTTP-кэш для эндпоинтов, которые меняются редко (plan, station).
+
+    На URL — один JSON: тело, Content-Type, ETag, Last-Modified, время загрузки/проверки:
+      data/raw/_http_cache/<endpoint>/<ab>/<sha256(url)>.json
+    - запись моложе окна свежести (HTTP_CACHE_FRESH_S[endpoint]) отдаётся без запроса — ни
+      латентности, ни расхода квоты;
+    - старше — условный GET (If-None-Match / If-Modified-Since): 304 → тело из кэша, окно
+      свежести отсчитывается заново; 200 → запись обновляется;
+    - ошибки (4xx/5xx после ретраев) не кэшируются и не портят имеющуюся запись.
+    Счётчики: stats (fresh / revalidated / miss) и метрика http_cache{endpoint,result}.
+    """
+
+    def __init__(self, root: Union[str, pathlib.Path] = HTTP_CACHE_DIR,
+                 fresh_s: Optional[Dict[str, float]] = None):
+        self.root = pathlib.Path(root)
+        self.fresh_s = dict(HTTP_CACHE_FRESH_S if fresh_s is None else fresh_s)
+        self.stats: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def path(self, url: str, endpoint: str) -> pathlib.Path:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return self.root / endpoint / key[:2] / f"{key}.json"
+
+    def load(self, url: str, endpoint: str) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads(self.path(url, endpoint).read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _store(self, url: str, endpoint: str, entry: Dict[str, Any]) -> None:
+        path = self.path(url, endpoint)
+        _ensure_dir(path.parent)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(entry, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def is_fresh(self, url: str, endpoint: str, entry: Optional[Dict[str, Any]] = None) -> bool:
+        """Есть ли запись моложе окна свежести (тогда get() обойдётся без запроса)."""
+        entry = entry if entry is not None else self.load(url, endpoint)
+        return entry is not None and time.time() - entry["checked_at"] < self.fresh_s.get(endpoint, 0.0)
+
+    def _count(self, endpoint: str, result: str) -> None:
+        with self._lock:
+            self.stats[result] += 1
+        metrics.inc("http_cache", endpoint=endpoint, result=result)
+
+    def get(self, url: str, headers: Dict[str, str], endpoint: str,
+            session: Optional[requests.Session] = None) -> Tuple[str, str]:
+        """(тело, Content-Type) ответа на GET url: из кэша, после 304 или после полной загрузки."""
+        entry = self.load(url, endpoint)
+        if entry is not None and self.is_fresh(url, endpoint, entry):
+            self._count(endpoint, "fresh")
+            return entry["body"], entry["content_type"]
+        headers = dict(headers)
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        r = _get(url, headers, endpoint, session)
+        now = time.time()
+        if r.status_code == 304 and entry is not None:
+            entry["checked_at"] = now
+            entry["etag"] = r.headers.get("ETag") or entry.get("etag")
+            self._store(url, endpoint, entry)
+            self._count(endpoint, "revalidated")
+            return entry["body"], entry["content_type"]
+        r.raise_for_status()
+        entry = {
+            "url": url, "body": r.text, "content_type": r.headers.get("Content-Type") or "",
+            "etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified"),
+            "fetched_at": now, "checked_at": now,
+        }
+        self._store(url, endpoint, entry)
+        self._count(endpoint, "miss")
+        return entry["body"], entry["content_type"]
+
+
+HTTP_CACHE: Optional[HttpCache] = HttpCache() if HTTP_CACHE_ENABLED else None
+
+
+def _cached_get(url: str, headers: Dict[str, str], endpoint: str,
+                session: Optional[requests.Session] = None) -> Tuple[str, str]:
+    """GET через HTTP_CACHE (если включён); без кэша — обычный запрос с raise_for_status."""
+    if HTTP_CACHE is not None:
+        return HTTP_CACHE.get(url, headers, endpoint, session)
+    r = _get(url, headers, endpoint, session)
+    r.raise_for_status()
+    return r.text, r.headers.get("Content-Type") or ""
+
+
 def _ensure_dir(path: Union[str, pathlib.Path]) -> pathlib.Path:
     p = pathlib.Path(path)
     p.mkdir(parents=True, exist_ok=True)
@@ -117,34 +246,48 @@ def find_station(name: str, limit: int = 5) -> List[Dict[str, Any]]:
     """
     headers = _headers()
     url_xml = f"{BASE}/timetables/v1/station/{requests.utils.quote(name)}"
-    r = SESSION.get(url_xml, headers=headers, timeout=HTTP_TIMEOUT_S)
-    r.raise_for_status()
-    ct = (r.headers.get("Content-Type") or "").lower()
+    text, ct = _cached_get(url_xml, headers, "station")
+    ct = ct.lower()
     if "xml" in ct:
-        return _parse_stations_xml(r.text)[:limit]
-    snippet = (r.text or "")[:300].replace("\n", " ")
-    raise RuntimeError(f"Station search failed: {r.status_code} {ct}. Body: {snippet}")
+        return _parse_stations_xml(text)[:limit]
+    snippet = (text or "")[:300].replace("\n", " ")
+    raise RuntimeError(f"Station search failed: {ct}. Body: {snippet}")
 
 
-def get_planned_timetable(eva: Union[int, str], date: str, hour: int) -> str:
+def plan_url(eva: Union[int, str], date: str, hour: int) -> str:
+    return f"{BASE}/timetables/v1/plan/{eva}/{date}/{int(hour):02d}"  # HH всегда две цифры
+
+
+def get_planned_timetable(eva: Union[int, str], date: str, hour: int,
+                          session: Optional[requests.Session] = None) -> str:
     """
     План по станции за конкретный час (официальная форма):
       /timetables/v1/plan/{eva}/{YYMMDD}/{HH}
+    Через HTTP_CACHE: повтор в окне свежести — без запроса, позже — условный запрос.
+    session — как в _get (QUOTA_SESSION для вызывающих со своим token bucket).
     """
-    url = f"{BASE}/timetables/v1/plan/{eva}/{date}/{int(hour):02d}"  # HH всегда две цифры
     headers = _headers()
     headers["Accept"] = "application/xml"  # план возвращается в XML
-    r = SESSION.get(url, headers=headers, timeout=HTTP_TIMEOUT_S)
-    r.raise_for_status()
-    return r.text
+    text, _ = _cached_get(plan_url(eva, date, hour), headers, "plan", session)
+    return text
 
 
-def get_changes(eva: Union[int, str]) -> str:
+def get_changes(eva: Union[int, str], session: Optional[requests.Session] = None) -> str:
     """Изменения (XML) по станции: /timetables/v1/fchg/{eva} (без даты/часа)."""
     headers = _headers()
     headers["Accept"] = "application/xml"
     url = f"{BASE}/timetables/v1/fchg/{eva}"
-    r = SESSION.get(url, headers=headers, timeout=HTTP_TIMEOUT_S)
+    r = _get(url, headers, "fchg", session)
+    r.raise_for_status()
+    return r.text
+
+
+def get_recent_changes(eva: Union[int, str], session: Optional[requests.Session] = None) -> str:
+    """Недавние изменения (XML): /timetables/v1/rchg/{eva} — только то, что изменилось за ~2 минуты."""
+    headers = _headers()
+    headers["Accept"] = "application/xml"
+    url = f"{BASE}/timetables/v1/rchg/{eva}"
+    r = _get(url, headers, "rchg", session)
     r.raise_for_status()
     return r.text
 
@@ -156,19 +299,18 @@ def fetch_and_save_raw(
     hour: Optional[int] = None    # 0..23; если None — возьмём текущий локальный час
 ) -> Dict[str, pathlib.Path]:
     """
-    1) Находим станцию → берём eva.
+    1) Находим станцию → берём eva (из локального реестра data/stations.json; в API — только если
+       станции там нет или запись устарела).
     2) Грузим PLAN строго по форме {YYMMDD}/{HH}.
     3) Грузим FCHG (без даты/часа).
-    4) Сохраняем в data/raw/<YYYYMMDD_HHMM>/.
+    4) Кладём оба ответа в архив data/raw (blobs/ + index.jsonl, см. train_delays.archive).
+    Возвращает пути к JSON со станцией и к blob'ам плана/изменений.
     """
-    stations = find_station(station_name, limit=1)
-    if not stations:
-        raise ValueError(f"No station found for name='{station_name}'")
-    eva = stations[0].get("evaNr") or stations[0].get("evaNo") or stations[0].get("number")
-    if not eva:
-        raise ValueError("EVA number not found in station payload.")
-
-    # Локальное «сейчас» (для метки папки и дефолтов даты/часа)
+    registry = get_registry()
+    eva = registry.resolve(station_name)
+    stations = [registry.by_eva(eva) or {"evaNr": eva}]
+
+    # Локальное «сейчас» (для метки загрузки и дефолтов даты/часа)
     now_local = datetime.now(BERLIN)
 
     # Приводим входную дату к YYMMDD (или берём текущую)
@@ -176,29 +318,28 @@ def fetch_and_save_raw(
     # Выбираем час: если не передали — используем текущий
     hh = now_local.hour if hour is None else int(hour)
 
-    # Метка времени папки (для удобства)
-    stamp = now_local.strftime("%Y%m%d_%H%M")
-    base = _ensure_dir(pathlib.Path(outdir) / stamp)
+    archive = RawArchive(outdir)
 
     # Сохраняем метаданные поиска станции (для воспроизводимости)
-    stations_path = base / f"stations_{station_name}.json"
+    stations_path = pathlib.Path(outdir) / "stations" / f"stations_{station_name}.json"
     _save_json(stations, stations_path)
 
     # PLAN: официальный эндпоинт с YYMMDD/HH
     plan_xml = get_planned_timetable(eva=eva, date=yymmdd, hour=hh)
-    plan_path = base / f"timetable_plan_{eva}_{stamp}.xml"
-    _save_text(plan_xml, plan_path)
+    plan_entry = archive.put(plan_xml, eva=eva, kind="plan", fetched_at=now_local, slot=f"{yymmdd}/{hh:02d}")
 
     # Небольшая пауза — бережём лимиты
     time.sleep(RAW_SAVE_PAUSE_S)
 
     # FCHG: текущее окно изменений (без даты/часа)
     changes_xml = get_changes(eva=eva)
-    changes_path = base / f"timetable_changes_{eva}_{stamp}.xml"
-    _save_text(changes_xml, changes_path)
-
-    return {"stations": stations_path, "plan_xml": plan_path, "changes_xml": changes_path}
+    changes_entry = archive.put(changes_xml, eva=eva, kind="fchg", fetched_at=now_local)
 
+    return {
+        "stations": stations_path,
+        "plan_xml": archive.blob_path(plan_entry["sha256"]),
+        "changes_xml": archive.blob_path(changes_entry["sha256"]),
+    }
 
 if __name__ == "__main__":
     # Можно задать DEFAULT_STATION/DEFAULT_DATE/DEFAULT_HOUR в .env
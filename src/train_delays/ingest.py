@@ -0,0 +1,219 @@
+"""
+Пакетный инкрементальный парсинг всего архива сырья в processed-хранилище.
+
+Запуск из корня репо:
+  python -m train_delays.ingest --workers 8
+
+- источники: все записи индекса data/raw/index.jsonl (каждый уникальный payload — один раз;
+  вернувшийся в поток станции после другого payload'а — ещё раз, со своим fetched_at)
+  плюс старые data/raw/<YYYYMMDD_HHMM>/timetable_*.xml;
+- разбор идёт в пуле процессов (parse_*_file, потоково), результат дописывается
+  в data/processed/{plan,changes}/ новыми part-файлами (ключ — sha256 payload'а);
+- манифест data/processed/_parse_manifest.jsonl хранит (источник → партиции),
+  поэтому повторный запуск парсит только новые снимки;
+- снимки изменений одной станции разбираются одной задачей по порядку загрузки и проходят
+  через дедупликацию (train_delays.dedup): в changes попадают только новые/обновлённые
+  сообщения, а не каждое повторение действующего <m> в каждом снимке (--no-dedup — выключить).
+"""
+from __future__ import annotations
+import argparse, hashlib, io, os, pathlib, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from train_delays import metrics
+from train_delays.archive import ARCHIVE_ROOT, BERLIN, RawArchive, LEGACY_RE, LEGACY_KIND, legacy_fetched_at
+from train_delays.dedup import ChangeDeduper
+from train_delays.manifest import ManifestWriter, load_manifest
+from train_delays.merge import stamp_snapshot
+from train_delays.parse import parse_changes_file, parse_timetable_file
+from train_delays.store import STORE_ROOT, write_partitions
+
+MANIFEST_NAME = "_parse_manifest.jsonl"
+DATASET_BY_KIND = {"plan": "plan", "fchg": "changes", "rchg": "changes"}
+PART_KEY_LEN = 16
+
+
+def payload_stream(e: Dict[str, Any]) -> Tuple[str, str, Optional[str]]:
+    """Поток снимков записи индекса: (kind, eva, slot) — у плана каждый часовой слот свой."""
+    return e["kind"], str(e["eva"]), e.get("slot")
+
+
+def latest_payloads(archive: RawArchive, kinds: Sequence[str] = ("plan", "fchg", "rchg")) -> Dict[Tuple, str]:
+    """sha256 последнего снимка каждого потока (payload_stream) в архиве."""
+    return {payload_stream(e): e["sha256"] for e in archive.entries() if e["kind"] in kinds}
+
+
+def source_key(e: Dict[str, Any], returned: bool) -> Tuple[str, str]:
+    """
+    (ключ источника в манифесте, ключ part-файла) записи индекса. returned — payload вернулся
+    в поток после другого (A→B→A): ключи с fetched_at, чтобы A разобрался ещё раз со свежей меткой.
+    """
+    key = f"{e['kind']}:{e['sha256']}"
+    if not returned:
+        return key, e["sha256"][:PART_KEY_LEN]
+    key = f"{key}@{e['fetched_at']}"
+    return key, hashlib.sha256(key.encode("utf-8")).hexdigest()[:PART_KEY_LEN]
+
+
+def discover_sources(
+    raw_root: Union[str, pathlib.Path] = ARCHIVE_ROOT,
+    kinds: Sequence[str] = ("plan", "fchg", "rchg"),
+) -> List[Dict[str, Any]]:
+    """
+    Все сырые источники: уникальные (kind, sha256) из индекса архива и старые XML-файлы.
+    Payload, вернувшийся в поток после другого (A→B→A), — ещё один источник со своим
+    fetched_at (иначе merge оставил бы B); подряд идущие повторы разбираются один раз.
+    Ключ старого файла включает mtime — изменённый файл будет разобран заново.
+    """
+    raw_root = pathlib.Path(raw_root)
+    sources: Dict[str, Dict[str, Any]] = {}
+    last: Dict[Tuple, str] = {}
+    for e in RawArchive(raw_root).entries():
+        if e["kind"] not in kinds:
+            continue
+        stream = payload_stream(e)
+        if last.get(stream) == e["sha256"]:
+            continue
+        last[stream] = e["sha256"]
+        key, part_key = source_key(e, returned=f"{e['kind']}:{e['sha256']}" in sources)
+        sources[key] = {"key": key, "kind": e["kind"], "sha256": e["sha256"], "part_key": part_key,
+                        "eva": e["eva"], "order": e["fetched_at"], "fetched_at": e["fetched_at"]}
+
+    for path in sorted(raw_root.rglob("timetable_*.xml")):
+        m = LEGACY_RE.match(path.name)
+        if not m or LEGACY_KIND[m.group(1)] not in kinds:
+            continue
+        rel = path.relative_to(raw_root).as_posix()
+        key = f"file:{rel}:{path.stat().st_mtime_ns}"
+        # старые файлы старше архива: в порядке станции идут первыми
+        sources[key] = {"key": key, "kind": LEGACY_KIND[m.group(1)], "path": str(path),
+                        "eva": m.group(2), "order": f"0 {rel}",
+                        "fetched_at": legacy_fetched_at(path).isoformat(timespec="seconds")}
+    return list(sources.values())
+
+
+def _parse_source(src: Dict[str, Any], raw_root: str, store_root: str,
+                  dedup: Optional[ChangeDeduper] = None) -> Dict[str, Any]:
+    """Воркер: разбирает один источник и пишет его партиции. Выполняется в отдельном процессе."""
+    t0 = time.perf_counter()
+    if "sha256" in src:
+        part_key = src.get("part_key") or src["sha256"][:PART_KEY_LEN]
+        stream = RawArchive(raw_root).open(src["sha256"])
+    else:
+        data = pathlib.Path(src["path"]).read_bytes()
+        part_key = hashlib.sha256(data).hexdigest()[:PART_KEY_LEN]  # тот же ключ, что дал бы архив
+        stream = io.BytesIO(data)
+
+    parse_fn = parse_timetable_file if src["kind"] == "plan" else parse_changes_file
+    with stream:
+        df = parse_fn(stream)
+    dataset = DATASET_BY_KIND[src["kind"]]
+    rows = len(df)
+    df = stamp_snapshot(df, src["fetched_at"])   # порядок снимков плана и изменений в merge
+    if dataset == "changes" and dedup is not None:
+        df = dedup.filter(df)
+    written = write_partitions(df, dataset, key=part_key, root=store_root)
+    return {
+        "dataset": dataset,
+        "rows": int(rows),
+        "written": int(len(df)),
+        "partitions": [p.relative_to(store_root).as_posix() for p in written],
+        "seconds": round(time.perf_counter() - t0, 3),
+        "metrics": metrics.drain(),   # не в манифест: родитель забирает через absorb()
+    }
+
+
+def _parse_station_changes(srcs: List[Dict[str, Any]], raw_root: str, store_root: str) -> List[Dict[str, Any]]:
+    """
+    Воркер: снимки изменений одной станции по порядку загрузки через общий индекс дедупликации.
+    Индекс сохраняется после записи партиций: при сбое снимки просто разберутся заново.
+    """
+    dedup = ChangeDeduper(store_root)
+    out: List[Dict[str, Any]] = []
+    for src in srcs:
+        try:
+            out.append({"status": "ok", **_parse_source(src, raw_root, store_root, dedup=dedup)})
+        except (RuntimeError, OSError, ValueError) as e:
+            out.append({"status": "error", "error": f"{type(e).__name__}: {e}"})
+            # индекс мог запомнить ключи незаписанных строк: откатываемся к версии на диске
+            # (худшее, что будет, — повторно выпущенные сообщения, но не потерянные)
+            dedup = ChangeDeduper(store_root)
+    dedup.save()
+    return out
+
+
+def ingest_all(
+    raw_root: Union[str, pathlib.Path] = ARCHIVE_ROOT,
+    store_root: Union[str, pathlib.Path] = STORE_ROOT,
+    workers: Optional[int] = None,
+    kinds: Sequence[str] = ("plan", "fchg", "rchg"),
+    dedup: bool = True,
+) -> Dict[str, int]:
+    """
+    Разбирает все ещё не обработанные источники в пуле процессов.
+    Возвращает счётчики {"sources", "skipped", "parsed", "failed", "rows", "written"}.
+    """
+    raw_root, store_root = pathlib.Path(raw_root), pathlib.Path(store_root)
+    manifest_path = store_root / MANIFEST_NAME
+    done = {k for k, rec in load_manifest(manifest_path).items() if rec.get("status") == "ok"}
+
+    sources = discover_sources(raw_root, kinds)
+    todo = [s for s in sources if s["key"] not in done]
+    counts = {"sources": len(sources), "skipped": len(sources) - len(todo), "parsed": 0, "failed": 0,
+              "rows": 0, "written": 0}
+    if not todo:
+        return counts
+
+    # задачи: план — по снимку; изменения (с дедупликацией) — все снимки станции одной задачей,
+    # чтобы индекс станции читал и писал один процесс
+    tasks: List[Tuple[Any, List[Dict[str, Any]]]] = []
+    by_station: Dict[str, List[Dict[str, Any]]] = {}
+    for s in todo:
+        if dedup and DATASET_BY_KIND[s["kind"]] == "changes":
+            by_station.setdefault(s["eva"], []).append(s)
+        else:
+            tasks.append((_parse_source, [s]))
+    tasks += [(_parse_station_changes, sorted(group, key=lambda s: s["order"])) for group in by_station.values()]
+
+    def _record(src: Dict[str, Any], res: Dict[str, Any]) -> Dict[str, Any]:
+        metrics.absorb(res.pop("metrics", None))
+        rec: Dict[str, Any] = {"key": src["key"], "parsed_at": datetime.now(BERLIN).isoformat(timespec="seconds")}
+        rec.update(res)
+        if res["status"] == "ok":
+            counts["parsed"] += 1
+            counts["rows"] += res["rows"]
+            counts["written"] += res["written"]
+        else:
+            counts["failed"] += 1
+        return rec
+
+    workers = workers or os.cpu_count() or 1
+    with ManifestWriter(manifest_path) as writer, ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fn, group if fn is _parse_station_changes else group[0], str(raw_root),
+                               str(store_root)): group for fn, group in tasks}
+        for fut in as_completed(futures):
+            group = futures[fut]
+            try:
+                res = fut.result()
+                results = res if isinstance(res, list) else [{"status": "ok", **res}]
+            except (RuntimeError, OSError, ValueError) as e:
+                results = [{"status": "error", "error": f"{type(e).__name__}: {e}"}] * len(group)
+            for src, r in zip(group, results):
+                writer.write(_record(src, dict(r)))
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Пакетный инкрементальный парсинг архива сырья")
+    parser.add_argument("--raw", default=str(ARCHIVE_ROOT), help="Корень архива сырья")
+    parser.add_argument("--store", default=str(STORE_ROOT), help="Корень processed-хранилища")
+    parser.add_argument("--workers", type=int, default=None, help="Процессов (по умолчанию = CPU)")
+    parser.add_argument("--kinds", nargs="+", default=["plan", "fchg", "rchg"], choices=["plan", "fchg", "rchg"])
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="Писать все сообщения каждого снимка (без индекса train_delays.dedup)")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    result = ingest_all(args.raw, args.store, workers=args.workers, kinds=args.kinds, dedup=not args.no_dedup)
+    print("Ingest:", result, f"за {time.perf_counter() - t0:.1f} с")
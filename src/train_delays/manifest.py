@@ -0,0 +1,48 @@
+"""
+Append-only JSONL-манифесты для возобновляемых пакетных задач (краулер, пакетный парсинг).
+Одна строка — одна запись {"key": ..., ...}; при чтении побеждает последняя запись по ключу.
+"""
+from __future__ import annotations
+import json, pathlib, threading
+from typing import Any, Dict, Union
+
+
+def load_manifest(path: Union[str, pathlib.Path]) -> Dict[str, Dict[str, Any]]:
+    """Читает JSONL-манифест → {key: последняя запись}. Битые строки (обрыв записи) пропускаем."""
+    path = pathlib.Path(path)
+    state: Dict[str, Dict[str, Any]] = {}
+    if not path.exists():
+        return state
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            state[rec["key"]] = rec
+    return state
+
+
+class ManifestWriter:
+    """Append-only запись результатов задач из нескольких потоков."""
+
+    def __init__(self, path: Union[str, pathlib.Path]):
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = path.open("a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, rec: Dict[str, Any]) -> None:
+        line = json.dumps(rec, ensure_ascii=False)
+        with self._lock:
+            self._f.write(line + "\n")
+            self._f.flush()
+
+    def close(self) -> None:
+        self._f.close()
+
+    def __enter__(self) -> "ManifestWriter":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
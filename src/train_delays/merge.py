@@ -0,0 +1,242 @@
+"""
+Сопоставление плана и изменений: ключевой hash join вместо merge_asof "nearest".
+
+1) Поток изменений сворачивается до последнего состояния на (stop_id, event):
+   из всех сообщений по событию берётся строка с максимальным ts сообщения, при равенстве —
+   из более свежего снимка (fetched_at), затем с более поздним ct. Порядок строк (а он
+   зависит от имён part-файлов) на выбор не влияет.
+2) План (без дублей по (stop_id, event)) соединяется с этим состоянием hash join'ом.
+3) Только строки плана без stop_id сопоставляются по времени (merge_asof в пределах tol).
+
+merge_partitions() делает то же самое по партициям (eva × день плана) и сразу пишет
+каждую в датасет merged, так что пиковая память ограничена самой крупной партицией.
+
+changed_ts — фактическое время события (ct) из <ar>/<dp>. Таймштамп сообщения (ts) —
+это время публикации сообщения, а не события, поэтому для задержки он не используется.
+"""
+from __future__ import annotations
+import os, pathlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from train_delays import metrics
+from train_delays.stations import attach_station_names
+from train_delays.store import STORE_ROOT, TZ, UNKNOWN, list_partitions, read_dataset, read_partition, write_partitions
+
+KEYS = ["stop_id", "event"]
+EVENTS = ("ar", "dp")
+MERGED_KEY = "merge"  # пересчёт партиции перезаписывает её part-merge.parquet
+STATE_TS_COLUMNS = ("event_ct", "ts", "change_time")
+SNAPSHOT_COLUMN = "fetched_at"  # время загрузки снимка в plan и changes (пишут ingest и pipeline)
+
+# колонки состояния изменений, которые попадают в результат (с переименованием, как раньше)
+STATE_COLUMNS = ["event_ct", "ts", "change_time", "platform", "line", "path",
+                 "msg_id", "msg_type", "msg_code", "category", "priority"]
+STATE_RENAME = {
+    "platform": "platform_chg",
+    "line":     "line_chg",
+    "path":     "path_chg",
+    "msg_type": "msg_type_chg",
+    "msg_code": "msg_code_chg",
+    "category": "category_chg",
+    "priority": "priority_chg",
+}
+
+
+def _ts_rank(s: pd.Series) -> np.ndarray:
+    """datetime → int64 для сравнения; NaT становится минимальным значением (проигрывает всем)."""
+    return s.to_numpy(dtype="datetime64[ns]").view("i8")
+
+
+def delay_minutes(planned: pd.Series, changed: pd.Series) -> pd.Series:
+    """Задержка в минутах: (changed − planned) / 60 с, округление до целого, <NA> если времени нет."""
+    return ((changed - planned).dt.total_seconds() / 60).round().astype("Int64")
+
+
+def stamp_snapshot(df: pd.DataFrame, fetched_at: Union[str, datetime]) -> pd.DataFrame:
+    """Добавляет к строкам снимка (плана или изменений) колонку fetched_at (tz-aware, Europe/Berlin)."""
+    ts = pd.Timestamp(fetched_at)
+    ts = (ts.tz_localize(TZ) if ts.tzinfo is None else ts.tz_convert(TZ)).as_unit("us")
+    return df.assign(**{SNAPSHOT_COLUMN: pd.Series(ts, index=df.index)})
+
+
+def _snapshot_rank(df: pd.DataFrame) -> np.ndarray:
+    """fetched_at строк для сравнения; нет колонки или значения (старые part-файлы) — самый старый снимок."""
+    if SNAPSHOT_COLUMN not in df.columns:
+        return np.full(len(df), np.iinfo(np.int64).min)
+    # в старых part-файлах колонки нет — после concat она object с None
+    return _ts_rank(pd.to_datetime(df[SNAPSHOT_COLUMN], utc=True))
+
+
+def latest_change_state(df_chg: pd.DataFrame) -> pd.DataFrame:
+    """
+    Одна строка на (stop_id, event) — последнее сообщение: максимум по (ts, fetched_at, event_ct),
+    NaT проигрывает любому времени. Строки без fetched_at (changes, записанные до этой колонки)
+    считаются самыми старыми снимками. Сообщения уровня <s> (event = <NA>) и строки без stop_id
+    сюда не попадают. Устойчивая сортировка по трём ключам + последняя строка группы.
+    """
+    df = df_chg[df_chg["event"].isin(EVENTS) & df_chg["stop_id"].notna()]
+    if df.empty:
+        # типизированная пустышка: дальше из неё вычитаются даты плана
+        return pd.DataFrame({
+            c: pd.Series(dtype=pd.DatetimeTZDtype(tz="Europe/Berlin") if c in STATE_TS_COLUMNS else "string")
+            for c in KEYS + ["eva"] + STATE_COLUMNS
+        })
+
+    order = np.lexsort((_ts_rank(df["event_ct"]), _snapshot_rank(df), _ts_rank(df["ts"])))
+    state = df.iloc[order].drop_duplicates(KEYS, keep="last").copy()
+    state["change_time"] = state["event_ct"].where(state["event_ct"].notna(), state["ts"])
+    return state[KEYS + ["eva"] + STATE_COLUMNS].reset_index(drop=True)
+
+
+def _time_fallback(left: pd.DataFrame, state: pd.DataFrame, tol: pd.Timedelta) -> pd.DataFrame:
+    """Строки плана без stop_id: ближайшее состояние той же станции и события в пределах tol."""
+    right = state[state["change_time"].notna()].drop(columns=["stop_id"])
+    # merge_asof требует одинаковый dtype ключей, вплоть до единицы: парсер даёт datetime64[us],
+    # пустое состояние и Parquet от старого pandas — [ns]
+    right = right.assign(change_time=right["change_time"].astype(left["planned_ts"].dtype))
+    left = left.assign(_eva=left["eva"].fillna(""))
+    right = right.assign(_eva=right["eva"].fillna("")).drop(columns=["eva"])
+    has_ts = left["planned_ts"].notna()
+    matched = pd.merge_asof(
+        left[has_ts].sort_values("planned_ts"),
+        right.sort_values("change_time"),
+        left_on="planned_ts",
+        right_on="change_time",
+        by=["_eva", "event"],
+        direction="nearest",
+        tolerance=tol,
+    )
+    out = pd.concat([matched, left[~has_ts]], ignore_index=True)
+    out["match"] = pd.Series(np.where(out["change_time"].notna(), "time", None), dtype="string")
+    return out.drop(columns=["_eva"])
+
+
+def join_plan_changes(df_plan: pd.DataFrame, df_chg: pd.DataFrame, tol: pd.Timedelta) -> pd.DataFrame:
+    """
+    План + последнее состояние изменений → таблица с changed_ts, delay_min, platform_actual.
+    Из нескольких снимков плана на одно (stop_id, event) берётся последний загруженный (fetched_at;
+    part-файлы читаются в порядке хэшей, так что порядок строк ничего не значит).
+    Колонка match: 'key' (по stop_id+event), 'time' (fallback по времени) или <NA>.
+    """
+    # переименовываем до join'а: line есть и в плане, и в изменениях (иначе line_x/line_y)
+    with metrics.stage("merge_step", step="state") as st:
+        state = latest_change_state(df_chg).rename(columns=STATE_RENAME)
+        st.set(rows=len(df_chg))
+
+    with metrics.stage("merge_step", step="key_join") as st:
+        plan = df_plan[df_plan["event"].isin(EVENTS)]
+        plan = plan.iloc[np.argsort(_snapshot_rank(plan), kind="stable")].drop(columns=[SNAPSHOT_COLUMN],
+                                                                                errors="ignore")
+        keyed = plan[plan["stop_id"].notna()].drop_duplicates(KEYS, keep="last")
+        orphan = plan[plan["stop_id"].isna()]
+
+        merged = keyed.merge(state.drop(columns=["eva"]), on=KEYS, how="left", sort=False)
+        merged["match"] = pd.Series(np.where(merged["change_time"].notna(), "key", None),
+                                    dtype="string", index=merged.index)
+        st.set(rows=len(merged))
+    parts: List[pd.DataFrame] = [merged]
+    if not orphan.empty:
+        with metrics.stage("merge_step", step="time_fallback") as st:   # merge_asof
+            parts.append(_time_fallback(orphan, state, tol))
+            st.set(rows=len(orphan))
+    with metrics.stage("merge_step", step="delay") as st:
+        out = pd.concat(parts, ignore_index=True)
+
+        out["changed_ts"] = out["event_ct"]
+        out["delay_min"] = delay_minutes(out["planned_ts"], out["changed_ts"])
+
+        # Актуальная платформа: если из changes пришла platform_chg — используем её, иначе плановую
+        out["platform_actual"] = out["platform_chg"].where(out["platform_chg"].notna(), out["platform_planned"])
+        st.set(rows=len(out))
+    return out
+
+
+# ----------------- out-of-core: по партициям -----------------
+# колонки changes, нужные для join'а (остальное не читаем с диска)
+CHANGE_READ_COLUMNS = KEYS + ["eva", "event_ct", "ts", SNAPSHOT_COLUMN, "platform", "line", "path",
+                              "msg_id", "msg_type", "msg_code", "category", "priority"]
+
+
+def read_partition_inputs(
+    eva: str,
+    day: str,
+    root: Union[str, pathlib.Path] = STORE_ROOT,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Вход мерджа партиции плана (eva, day): сама партиция и изменения станции за day−1 … day+1.
+    Поезд после полуночи получает ct в следующем дне, а сообщения о нём могут быть опубликованы
+    накануне. Для плана без времени (day == 'unknown') сопоставлять по дням нечего.
+    """
+    with metrics.stage("merge_step", step="read") as st:
+        plan = read_partition("plan", eva, day, root)
+        if day == UNKNOWN:
+            chg = pd.DataFrame(columns=CHANGE_READ_COLUMNS)
+        else:
+            d = pd.Timestamp(day)
+            chg = read_dataset("changes", root, eva=eva,
+                               start=(d - timedelta(days=1)).date(), end=(d + timedelta(days=1)).date(),
+                               columns=CHANGE_READ_COLUMNS, filters=[("event", "in", list(EVENTS))])
+            if chg.empty:
+                chg = pd.DataFrame(columns=CHANGE_READ_COLUMNS)
+        st.set(rows=len(plan) + len(chg))
+    return plan, chg
+
+
+def merge_partition(
+    eva: str,
+    day: str,
+    root: Union[str, pathlib.Path] = STORE_ROOT,
+    tol: pd.Timedelta = pd.Timedelta(minutes=2),
+) -> Dict[str, Any]:
+    """
+    Мердж одной партиции плана (eva, day) и запись результата в merged
+    (вход — read_partition_inputs: изменения за day−1 … day+1).
+    """
+    with metrics.stage("merge_partition") as part:
+        plan, chg = read_partition_inputs(eva, day, root)
+        if plan.empty:
+            return {"eva": eva, "day": day, "rows": 0}
+
+        merged = attach_station_names(join_plan_changes(plan, chg, tol=tol))
+        with metrics.stage("merge_step", step="write") as st:
+            write_partitions(merged, "merged", key=MERGED_KEY, root=root)
+            st.set(rows=len(merged))
+        part.set(rows=len(merged), eva=eva, day=day)
+    return {"eva": eva, "day": day, "rows": int(len(merged))}
+
+
+def merge_partitions(
+    root: Union[str, pathlib.Path] = STORE_ROOT,
+    tol: pd.Timedelta = pd.Timedelta(minutes=2),
+    eva: Optional[Union[str, Iterable[str]]] = None,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    workers: Optional[int] = None,
+) -> Dict[str, int]:
+    """Мерджит все партиции плана (с отсечением по eva/датам) в пуле процессов."""
+    parts = [(e, d) for e, d, _ in list_partitions("plan", root, eva=eva, start=start, end=end)]
+    counts = {"partitions": len(parts), "rows": 0}
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for e, d in parts:
+            counts["rows"] += merge_partition(e, d, root, tol)["rows"]
+        return counts
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_merge_partition_worker, e, d, str(root), tol) for e, d in parts]
+        for fut in as_completed(futures):
+            res = fut.result()
+            metrics.absorb(res.pop("metrics"))
+            counts["rows"] += res["rows"]
+    return counts
+
+
+def _merge_partition_worker(eva: str, day: str, root: str, tol: pd.Timedelta) -> Dict[str, Any]:
+    """merge_partition в процессе пула: метрики воркера уходят родителю вместе с результатом."""
+    res = merge_partition(eva, day, root, tol)
+    res["metrics"] = metrics.drain()
+    return res
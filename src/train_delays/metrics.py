@@ -0,0 +1,273 @@
+"""
+Встроенные метрики горячих путей (fetch / parse / merge) и опциональный профайлер.
+
+Использование в коде:
+  with metrics.stage("parse_file", kind="plan") as st:   # время + счётчики; метки — низкой кардинальности
+      ...
+      st.set(rows=len(df), file=name)                     # rows/bytes/retries суммируются, прочее — в JSON-лог
+
+Метрики копятся в памяти процесса (пара словарей под замком, на файл/запрос/шаг — не на строку)
+и уходят в приёмники, заданные переменными окружения:
+  TRAIN_DELAYS_METRICS_LOG=reports/metrics/metrics.jsonl    # JSON-строка на каждую стадию (из всех процессов)
+  TRAIN_DELAYS_METRICS_PROM=reports/metrics/train_delays.prom  # textfile для node_exporter, пишется при выходе
+  TRAIN_DELAYS_METRICS=0                                   # выключить совсем (stage() — пустышка)
+Профайлер (одна стадия за раз; без переменной стадия стоит одну проверку флага):
+  TRAIN_DELAYS_PROFILE=cprofile|tracemalloc
+  TRAIN_DELAYS_PROFILE_STAGES=merge_partition,parse_file   # какие стадии (по умолчанию — любые)
+  TRAIN_DELAYS_PROFILE_DIR=reports/profiles                # куда класть .prof
+
+Воркеры пулов процессов возвращают drain() вместе с результатом, родитель делает absorb(),
+поэтому Prometheus-файл родителя покрывает весь прогон.
+"""
+from __future__ import annotations
+import atexit, itertools, json, os, pathlib, threading, time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+ENABLED = os.getenv("TRAIN_DELAYS_METRICS", "1") != "0"
+LOG_PATH = os.getenv("TRAIN_DELAYS_METRICS_LOG") or None
+PROM_PATH = os.getenv("TRAIN_DELAYS_METRICS_PROM") or None
+PROFILE = (os.getenv("TRAIN_DELAYS_PROFILE") or "").lower() or None
+PROFILE_STAGES = {s for s in (os.getenv("TRAIN_DELAYS_PROFILE_STAGES") or "").split(",") if s}
+PROFILE_DIR = pathlib.Path(os.getenv("TRAIN_DELAYS_PROFILE_DIR", "reports/profiles"))
+PREFIX = "train_delays_"
+# поля стадии, которые суммируются в счётчики <name>_<field>_total
+COUNTED_FIELDS = ("rows", "bytes", "retries")
+TRACEMALLOC_TOP = 10
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+_LOCK = threading.Lock()
+_COUNTERS: Dict[Key, float] = {}
+_SUMMARIES: Dict[Key, List[float]] = {}   # [count, sum, max]
+
+
+def _key(name: str, labels: Dict[str, Any]) -> Key:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name: str, value: float = 1, **labels: Any) -> None:
+    """Счётчик <name>_total."""
+    if not ENABLED:
+        return
+    k = _key(name, labels)
+    with _LOCK:
+        _COUNTERS[k] = _COUNTERS.get(k, 0) + value
+
+
+def observe(name: str, value: float, **labels: Any) -> None:
+    """Наблюдение для сводки <name>_count/_sum/_max (латентности, длительности)."""
+    if not ENABLED:
+        return
+    k = _key(name, labels)
+    with _LOCK:
+        s = _SUMMARIES.get(k)
+        if s is None:
+            _SUMMARIES[k] = [1, value, value]
+        else:
+            s[0] += 1
+            s[1] += value
+            s[2] = max(s[2], value)
+
+
+# ----------------- JSON-лог -----------------
+_log_file: Optional[Any] = None
+_log_pid: Optional[int] = None
+
+
+def log_event(event: str, **fields: Any) -> None:
+    """Одна JSON-строка в TRAIN_DELAYS_METRICS_LOG (O_APPEND: строки процессов не перемешиваются)."""
+    global _log_file, _log_pid
+    if not LOG_PATH:
+        return
+    line = json.dumps({"ts": datetime.now().isoformat(timespec="milliseconds"), "pid": os.getpid(),
+                       "event": event, **fields}, ensure_ascii=False, default=str)
+    with _LOCK:
+        if _log_file is None or _log_pid != os.getpid():   # после fork — свой дескриптор
+            path = pathlib.Path(LOG_PATH)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            _log_file, _log_pid = path.open("a", encoding="utf-8"), os.getpid()
+        _log_file.write(line + "\n")
+        _log_file.flush()
+
+
+# ----------------- профайлер -----------------
+_profile_active = False
+_profile_seq = itertools.count()
+
+
+class _Profiler:
+    """cProfile/tracemalloc вокруг одной стадии; вложенные и параллельные стадии не профилируются."""
+
+    def __init__(self, name: str):
+        self.name, self.prof = name, None
+
+    def start(self) -> bool:
+        global _profile_active
+        with _LOCK:
+            if _profile_active:
+                return False
+            _profile_active = True
+        if PROFILE == "cprofile":
+            import cProfile
+            self.prof = cProfile.Profile()
+            self.prof.enable()
+        else:
+            import tracemalloc
+            tracemalloc.start()
+        return True
+
+    def stop(self) -> Dict[str, Any]:
+        global _profile_active
+        out: Dict[str, Any] = {}
+        try:
+            if PROFILE == "cprofile":
+                self.prof.disable()
+                PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+                path = PROFILE_DIR / f"{self.name}_{os.getpid()}_{next(_profile_seq)}.prof"
+                self.prof.dump_stats(str(path))
+                out["profile"] = str(path)
+            else:
+                import tracemalloc
+                snap = tracemalloc.take_snapshot()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                out["tracemalloc_peak_bytes"] = peak
+                out["tracemalloc_top"] = [f"{s.traceback[0].filename}:{s.traceback[0].lineno} {s.size}"
+                                          for s in snap.statistics("lineno")[:TRACEMALLOC_TOP]]
+        finally:
+            with _LOCK:
+                _profile_active = False
+        return out
+
+
+# ----------------- стадии -----------------
+class Stage:
+    """Контекст стадии: длительность → <name>_seconds, статус → <name>_total, поля — в JSON-лог."""
+    __slots__ = ("name", "labels", "fields", "t0", "profiler")
+
+    def __init__(self, name: str, labels: Dict[str, Any]):
+        self.name, self.labels, self.fields = name, labels, {}
+        self.profiler: Optional[_Profiler] = None
+
+    def set(self, **fields: Any) -> None:
+        self.fields.update(fields)
+
+    def __enter__(self) -> "Stage":
+        if PROFILE and (not PROFILE_STAGES or self.name in PROFILE_STAGES):
+            prof = _Profiler(self.name)
+            self.profiler = prof if prof.start() else None
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        dt = time.perf_counter() - self.t0
+        extra = self.profiler.stop() if self.profiler is not None else {}
+        status = self.fields.pop("status", None) or (exc_type.__name__ if exc_type else "ok")
+        observe(f"{self.name}_seconds", dt, **self.labels)
+        inc(self.name, 1, status=status, **self.labels)
+        for f in COUNTED_FIELDS:
+            if self.fields.get(f):
+                inc(f"{self.name}_{f}", self.fields[f], **self.labels)
+        if LOG_PATH:
+            rec = {"seconds": round(dt, 6), "status": status, **self.labels, **self.fields, **extra}
+            if self.fields.get("rows") and dt > 0:
+                rec["rows_per_s"] = round(self.fields["rows"] / dt, 1)
+            log_event(self.name, **rec)
+
+
+class _NoStage:
+    """Пустышка при TRAIN_DELAYS_METRICS=0."""
+    __slots__ = ()
+
+    def set(self, **fields: Any) -> None:
+        pass
+
+    def __enter__(self) -> "_NoStage":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        pass
+
+
+_NO_STAGE = _NoStage()
+
+
+def stage(name: str, **labels: Any) -> Any:
+    """Замер стадии: with stage("merge_step", step="read") as st: ...; st.set(rows=n)."""
+    return Stage(name, labels) if ENABLED else _NO_STAGE
+
+
+# ----------------- межпроцессный сбор и экспорт -----------------
+def drain() -> Dict[str, Any]:
+    """Снимок метрик процесса с обнулением (воркер → родитель)."""
+    with _LOCK:
+        snap = {"counters": list(_COUNTERS.items()), "summaries": list(_SUMMARIES.items())}
+        _COUNTERS.clear()
+        _SUMMARIES.clear()
+    return snap
+
+
+def absorb(snap: Optional[Dict[str, Any]]) -> None:
+    """Добавляет снимок drain() другого процесса к своим метрикам."""
+    if not snap or not ENABLED:
+        return
+    with _LOCK:
+        for (name, labels), v in snap["counters"]:
+            k = (name, tuple(tuple(p) for p in labels))
+            _COUNTERS[k] = _COUNTERS.get(k, 0) + v
+        for (name, labels), (cnt, total, mx) in snap["summaries"]:
+            k = (name, tuple(tuple(p) for p in labels))
+            s = _SUMMARIES.setdefault(k, [0, 0.0, mx])
+            s[0] += cnt
+            s[1] += total
+            s[2] = max(s[2], mx)
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    esc = lambda v: v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels) + "}"
+
+
+def render_prometheus() -> str:
+    """Метрики процесса в текстовом формате Prometheus (counter / summary + gauge _max)."""
+    with _LOCK:
+        counters, summaries = dict(_COUNTERS), {k: list(v) for k, v in _SUMMARIES.items()}
+    lines: List[str] = []
+    for name in sorted({n for n, _ in counters}):
+        lines.append(f"# TYPE {PREFIX}{name}_total counter")
+        lines += [f"{PREFIX}{name}_total{_labels(lb)} {v:g}" for (n, lb), v in sorted(counters.items()) if n == name]
+    for name in sorted({n for n, _ in summaries}):
+        rows = [(lb, s) for (n, lb), s in sorted(summaries.items()) if n == name]
+        lines.append(f"# TYPE {PREFIX}{name} summary")
+        for lb, (cnt, total, _) in rows:
+            lines.append(f"{PREFIX}{name}_count{_labels(lb)} {cnt:g}")
+            lines.append(f"{PREFIX}{name}_sum{_labels(lb)} {total:.6f}")
+        lines.append(f"# TYPE {PREFIX}{name}_max gauge")
+        lines += [f"{PREFIX}{name}_max{_labels(lb)} {s[2]:.6f}" for lb, s in rows]
+    return "\n".join(lines) + "\n"
+
+
+def flush(path: Optional[str] = None) -> Optional[pathlib.Path]:
+    """Атомарно пишет Prometheus-textfile (по умолчанию — TRAIN_DELAYS_METRICS_PROM)."""
+    path = path or PROM_PATH
+    if not path or not ENABLED:
+        return None
+    out = pathlib.Path(path)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(f".{out.name}.{os.getpid()}.tmp")
+    tmp.write_text(render_prometheus(), encoding="utf-8")
+    os.replace(tmp, out)
+    return out
+
+
+def _flush_at_exit() -> None:
+    # воркеры пулов (дочерние процессы multiprocessing) отдают метрики через drain(), файл пишет родитель
+    import multiprocessing
+    if multiprocessing.parent_process() is None:
+        flush()
+
+
+if PROM_PATH and ENABLED:
+    atexit.register(_flush_at_exit)
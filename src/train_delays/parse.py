@@ -1,33 +1,501 @@
+"""
+Разбор XML DB Timetables (plan / fchg / rchg) в колоночные таблицы.
+
+Бэкенды XML (аргумент backend или TRAIN_DELAYS_XML_BACKEND, по умолчанию expat):
+  - etree — ElementTree: дерево документа (или одной <s> в потоковом режиме) + findall;
+  - expat — обработчик событий pyexpat: дерево не строится, читаются только атрибуты
+    <s>/<tl>/<ar>/<dp>/<m> на нужной глубине (в несколько раз быстрее на больших fchg);
+  - lxml  — дерево lxml (C), если пакет установлен.
+Бэкенд только находит остановки и отдаёт их атрибуты (_Stop); строки таблиц строит общий
+код, поэтому результат от бэкенда не зависит (проверка: python -m scripts.check_parsers).
+"""
 from __future__ import annotations
+import json, os, threading
 import xml.etree.ElementTree as ET
-from datetime import datetime
-from typing import Optional, List, Dict, Any
-from zoneinfo import ZoneInfo
+from pyexpat import ExpatError, ParserCreate
+from typing import Optional, List, Dict, Any, IO, Iterator, Sequence, Tuple, Union
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+from pandas.api.types import union_categoricals
+
+from train_delays import metrics
+
+# Источник для потокового режима: путь к файлу или бинарный file-like объект
+XmlSource = Union[str, "os.PathLike[str]", IO[bytes]]
+
+XML_BACKENDS = ("etree", "expat", "lxml")
+DEFAULT_XML_BACKEND = os.getenv("TRAIN_DELAYS_XML_BACKEND", "expat")
+EXPAT_CHUNK = 1 << 16   # потоковый expat: байт за одно Parse()
+_STRING = pd.StringDtype()
+
+PLAN_COLUMNS = [
+    "station","eva","stop_id","event","planned_ts",
+    "platform_planned","platform_current","line",
+    "path_pp","train_run_id","wings",
+    "tl_class","tl_type","tl_operator","tl_category","tl_number",
+]
+PLAN_STRING_COLUMNS = [c for c in PLAN_COLUMNS if c != "planned_ts"]
+
+CHANGES_COLUMNS = [
+    "station","eva","stop_id","scope","event","event_ct","platform","line","path",
+    "msg_id","msg_type","msg_code","category","priority","ts","from_ts","to_ts","ts_tts",
+]
+CHANGES_TS_COLUMNS = ["event_ct","ts","from_ts","to_ts"]
+CHANGES_STRING_COLUMNS = [c for c in CHANGES_COLUMNS if c not in CHANGES_TS_COLUMNS]
 
 # =============== helpers ===============
 
-def _parse_ts_yyMMddHHmm(s: Optional[str], tz: str = "Europe/Berlin") -> Optional[datetime]:
+# Политика для локальных времён на переходах DST (YYMMDDHHMM в API — локальное время без смещения):
+#  - неоднозначные (осенью 02:00–02:59 встречается дважды) → первое вхождение, летнее время;
+#  - несуществующие (весной 02:00–02:59 пропускается) → сдвиг вперёд на величину перехода (1 ч).
+# Это повторяет поведение datetime(..., tzinfo=ZoneInfo(tz)) с fold=0, которым парсили раньше.
+TS_AMBIGUOUS_AS_DST = True
+TS_NONEXISTENT_SHIFT = pd.Timedelta(hours=1)
+
+
+def _parse_ts_series(values: Any, tz: Optional[str] = "Europe/Berlin") -> pd.Series:
     """
-    Унифицированный парсер таймштампа YYMMDDHHMM → TZ-aware datetime.
-    Возвращает None для пустых/битых значений.
+    Векторный парсер колонки YYMMDDHHMM → datetime64[tz] за один проход.
+    Пустые/битые значения (не 10 цифр, несуществующая дата) → NaT.
+    tz=None → наивные локальные времена.
+    Разбираются только различные значения (в снимке их в разы меньше строк: одни и те же
+    минуты повторяются), результат раскладывается по строкам через take.
     """
-    if not s or len(s) != 10 or not s.isdigit():
-        return None
-    yy = int(s[0:2]); year = 2000 + yy
-    month = int(s[2:4]); day = int(s[4:6])
-    hour = int(s[6:8]); minute = int(s[8:10])
-    return datetime(year, month, day, hour, minute, tzinfo=ZoneInfo(tz))
+    raw = pd.Series(values, dtype="string")
+    codes, uniques = pd.factorize(raw)
+    uniq = pd.Series(uniques, dtype="string")
+    valid = uniq.str.fullmatch(r"\d{10}").fillna(False).astype(bool)
+    ts = pd.to_datetime("20" + uniq.where(valid), format="%Y%m%d%H%M", errors="coerce")
+    if tz is not None:
+        ts = ts.dt.tz_localize(
+            tz,
+            ambiguous=np.full(len(ts), TS_AMBIGUOUS_AS_DST),
+            nonexistent=TS_NONEXISTENT_SHIFT,
+        )
+    return pd.Series(ts.array.take(codes, allow_fill=True), index=raw.index)
+
+
+def xml_backend(name: Optional[str] = None) -> str:
+    """Проверяет имя бэкенда (None → DEFAULT_XML_BACKEND); lxml — только если установлен."""
+    name = (name or DEFAULT_XML_BACKEND).lower()
+    if name not in XML_BACKENDS:
+        raise ValueError(f"Unknown XML backend {name!r}, expected one of {XML_BACKENDS}")
+    if name == "lxml":
+        try:
+            import lxml.etree  # noqa: F401
+        except ImportError as e:
+            raise ImportError("XML backend 'lxml' requires lxml (pip install lxml)") from e
+    return name
+
+
+def _source_name(source: XmlSource) -> str:
+    """Имя источника для сообщений об ошибках (путь или repr file-like)."""
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source)
+    return getattr(source, "name", None) or repr(source)
+
+
+def _snippet(xml_text: str) -> str:
+    return (xml_text or "")[:300].replace("\n", " ")
 
 
-def _first_or_none(node: ET.Element, tag: str) -> Optional[ET.Element]:
+# =============== остановки: общий формат бэкендов ===============
+# Атрибуты одной <s> и нужных прямых потомков (в порядке документа):
+#   (атрибуты <s>, атрибуты первого <tl> или {}, [(атрибуты <ar>, [атрибуты его <m>])],
+#    [(атрибуты <dp>, [атрибуты его <m>])], [атрибуты <m> прямо под <s>])
+Attrs = Dict[str, str]
+_Stop = Tuple[Attrs, Attrs, List[Tuple[Attrs, List[Attrs]]], List[Tuple[Attrs, List[Attrs]]], List[Attrs]]
+_EMPTY: Attrs = {}
+
+
+def _first_or_none(node: Any, tag: str) -> Any:
     """Возвращает первый прямой дочерний узел <tag> или None (НЕ рекурсивно)."""
     return next(iter(node.findall(tag)), None)
 
 
+def _element_stop(s: Any, detach: bool = False) -> _Stop:
+    """
+    <s> из дерева (ElementTree или lxml) → _Stop. detach=True копирует атрибуты в dict:
+    в потоковом режиме узел очищается сразу после обработки (у lxml attrib — живое представление).
+    """
+    at = (lambda e: dict(e.attrib)) if detach else (lambda e: e.attrib)
+    tl = _first_or_none(s, "tl")
+    return (
+        at(s),
+        at(tl) if tl is not None else _EMPTY,
+        [(at(n), [at(m) for m in n.findall("m")]) for n in s.findall("ar")],
+        [(at(n), [at(m) for m in n.findall("m")]) for n in s.findall("dp")],
+        [at(m) for m in s.findall("m")],
+    )
+
+
+def _iterparse_stops(source: XmlSource, kind: str) -> Iterator[Tuple[ET.Element, ET.Element]]:
+    """
+    Потоково отдаёт пары (корень, <s>) через ET.iterparse.
+    Каждый <s> после обработки удаляется из родителя и очищается, поэтому
+    в памяти одновременно живёт только текущая остановка, а не всё дерево.
+    """
+    stack: List[ET.Element] = []
+    try:
+        for event, elem in ET.iterparse(source, events=("start", "end")):
+            if event == "start":
+                stack.append(elem)
+                continue
+            stack.pop()
+            if elem.tag != "s":
+                continue
+            yield stack[0] if stack else elem, elem
+            if stack:
+                stack[-1].remove(elem)
+            elem.clear()
+    except ET.ParseError as e:
+        raise RuntimeError(f"Invalid {kind} XML: {e}. Source: {_source_name(source)}")
+
+
+def _expat_parser(out: List[Tuple[Attrs, _Stop]]) -> Any:
+    """
+    Парсер pyexpat, который складывает в out пары (атрибуты корня, _Stop) по мере закрытия <s>.
+    Узлы не создаются: на каждое событие — сравнение имени и глубины. Разделитель пространств
+    имён — как у ElementTree, чтобы теги с namespace так же не совпадали с "s".
+    """
+    parser = ParserCreate(namespace_separator="}")
+    depth = 0
+    root: Attrs = _EMPTY
+    # открытые <s>: [глубина, атрибуты, tl, ar, dp, m уровня s, текущий прямой потомок ar/dp]
+    open_stops: List[List[Any]] = []
+
+    def start(name: str, attrs: Attrs) -> None:
+        nonlocal depth, root
+        if depth == 0:
+            root = attrs
+        elif name == "s":
+            open_stops.append([depth, attrs, None, [], [], [], None])
+        elif open_stops:
+            top = open_stops[-1]
+            rel = depth - top[0]
+            if rel == 1:
+                if name == "ar" or name == "dp":
+                    node = (attrs, [])
+                    (top[3] if name == "ar" else top[4]).append(node)
+                    top[6] = node
+                else:
+                    top[6] = None
+                    if name == "m":
+                        top[5].append(attrs)
+                    elif name == "tl" and top[2] is None:
+                        top[2] = attrs
+            elif rel == 2 and name == "m" and top[6] is not None:
+                top[6][1].append(attrs)
+        depth += 1
+
+    def end(name: str) -> None:
+        nonlocal depth
+        depth -= 1
+        if open_stops and open_stops[-1][0] == depth:
+            _, attrs, tl, ar, dp, msgs, _ = open_stops.pop()
+            out.append((root, (attrs, tl or _EMPTY, ar, dp, msgs)))
+
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    return parser
+
+
+def _lxml_iterparse_stops(source: XmlSource, kind: str) -> Iterator[Tuple[Any, Any]]:
+    """Как _iterparse_stops, но на lxml: обработанные <s> и их предшественники удаляются."""
+    from lxml import etree as LET
+
+    root = None
+    try:
+        for event, elem in LET.iterparse(source, events=("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = elem
+                continue
+            if elem.tag != "s" or elem is root:
+                continue
+            yield root, elem
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    except LET.XMLSyntaxError as e:
+        raise RuntimeError(f"Invalid {kind} XML: {e}. Source: {_source_name(source)}")
+
+
+def _stops_from_text(xml_text: str, kind: str, backend: str) -> Iterator[Tuple[Attrs, _Stop]]:
+    """(атрибуты корня, _Stop) для каждой <s> документа-строки."""
+    if backend == "expat":
+        out: List[Tuple[Attrs, _Stop]] = []
+        try:
+            _expat_parser(out).Parse(xml_text or "", True)
+        except ExpatError as e:
+            raise RuntimeError(f"Invalid {kind} XML: {e}. Snippet: {_snippet(xml_text)}")
+        yield from out
+        return
+    if backend == "lxml":
+        from lxml import etree as LET
+        try:
+            # строка уже декодирована: объявленную в прологе кодировку lxml для str не принимает
+            root = LET.fromstring((xml_text or "").encode("utf-8"), LET.XMLParser(encoding="utf-8"))
+        except LET.XMLSyntaxError as e:
+            raise RuntimeError(f"Invalid {kind} XML: {e}. Snippet: {_snippet(xml_text)}")
+    else:
+        try:
+            root = ET.fromstring(xml_text)
+        except ET.ParseError as e:
+            raise RuntimeError(f"Invalid {kind} XML: {e}. Snippet: {_snippet(xml_text)}")
+    for s in root.iterfind(".//s"):
+        yield root.attrib, _element_stop(s)
+
+
+def _stops_from_source(source: XmlSource, kind: str, backend: str) -> Iterator[Tuple[Attrs, _Stop]]:
+    """(атрибуты корня, _Stop) потоково: в памяти — текущая остановка (и кусок входа для expat)."""
+    if backend == "etree":
+        for root, s in _iterparse_stops(source, kind):
+            yield root.attrib, _element_stop(s, detach=True)
+        return
+    if backend == "lxml":
+        for root, s in _lxml_iterparse_stops(source, kind):
+            yield root.attrib, _element_stop(s, detach=True)
+        return
+
+    out: List[Tuple[Attrs, _Stop]] = []
+    parser = _expat_parser(out)
+    own = isinstance(source, (str, os.PathLike))
+    f = open(source, "rb") if own else source
+    try:
+        while True:
+            chunk = f.read(EXPAT_CHUNK)
+            parser.Parse(chunk, not chunk)
+            yield from out
+            out.clear()
+            if not chunk:
+                break
+    except ExpatError as e:
+        raise RuntimeError(f"Invalid {kind} XML: {e}. Source: {_source_name(source)}")
+    finally:
+        if own:
+            f.close()
+
+
+def _typed_frame(cols: Dict[str, List[Any]], columns: List[str], ts_cols: List[str], sort_by: List[str],
+                 tz: Optional[str], kind: str, vocab: Optional["Vocabulary"] = None,
+                 compact_cols: Sequence[str] = ()) -> pd.DataFrame:
+    """
+    Колонки-списки → DataFrame, отсортированный по sort_by (NaT в конце). Промежуточного
+    object-DataFrame нет: сортируются только колонки времени, строковые колонки переставляются
+    и типизируются (StringDtype) одним проходом через Arrow.
+    С vocab колонки compact_cols сразу кодируются в category по словарю (компактный режим).
+    """
+    if not cols[columns[0]]:
+        return pd.DataFrame(columns=columns)
+
+    with metrics.stage("parse_phase", kind=kind, phase="ts"):
+        ts = {c: _parse_ts_series(cols[c], tz=tz) for c in ts_cols}
+
+    with metrics.stage("parse_phase", kind=kind, phase="frame"):
+        order = pd.DataFrame({c: ts[c] for c in sort_by}).sort_values(sort_by, na_position="last").index.to_numpy()
+        take = pa.array(order)
+        compact = set(compact_cols) if vocab is not None else set()
+        data = {c: ts[c].array.take(order) if c in ts
+                else vocab.categorical(c, cols[c], order) if c in compact
+                else _STRING.__from_arrow__(pa.array(cols[c], type=pa.large_string()).take(take))
+                for c in columns}
+        return pd.DataFrame(data, columns=columns)
+
+
+# =============== compact mode ===============
+
+# Колонки с малым числом различных значений: в компактном режиме — category со словарём
+# Vocabulary (остальные — как обычно, string / datetime)
+PLAN_COMPACT_COLUMNS = ["station", "eva", "event", "platform_planned", "platform_current", "line",
+                        "tl_class", "tl_type", "tl_operator", "tl_category"]
+CHANGES_COMPACT_COLUMNS = ["station", "eva", "scope", "event", "platform", "line",
+                           "msg_type", "msg_code", "category", "priority"]
+# Закрытые множества — категории в фиксированном порядке с самого начала
+VOCABULARY_SEED = {"event": ["ar", "dp"], "scope": ["s", "ar", "dp"]}
+
+
+class Vocabulary:
+    """
+    Append-only словарь значений по колонкам для компактного режима.
+
+    Код значения, раз выданный, не меняется, новые значения дописываются в конец: категории
+    любого ранее разобранного файла — префикс текущих. Поэтому склейка снимков (concat_compact)
+    только переупаковывает коды под общий dtype, без перекодирования строк. Пока словарь колонки
+    не растёт, все файлы получают один и тот же объект CategoricalDtype — тогда и обычный pd.concat
+    сохраняет category.
+
+    Словарь живёт в процессе (DEFAULT_VOCABULARY); чтобы категории совпадали между
+    процессами/запусками — save()/load() в JSON.
+    """
+
+    def __init__(self, seed: Optional[Dict[str, List[str]]] = None):
+        self._values: Dict[str, List[str]] = {}
+        self._index: Dict[str, Dict[str, int]] = {}
+        self._dtypes: Dict[str, pd.CategoricalDtype] = {}
+        self._lock = threading.Lock()
+        for col, values in (VOCABULARY_SEED if seed is None else seed).items():
+            self.codes(col, values)
+
+    def __len__(self) -> int:
+        return sum(len(v) for v in self._values.values())
+
+    def codes(self, col: str, values: Any) -> np.ndarray:
+        """Коды значений (NA → -1); новые значения добавляются в словарь колонки."""
+        local, uniques = pd.factorize(np.asarray(values, dtype=object) if isinstance(values, list) else values)
+        with self._lock:
+            index = self._index.setdefault(col, {})
+            known = self._values.setdefault(col, [])
+            lookup = np.empty(len(uniques) + 1, dtype=np.int32)
+            lookup[-1] = -1   # local == -1 (NA) попадает сюда
+            for i, value in enumerate(uniques):
+                code = index.get(value)
+                if code is None:
+                    code = index[value] = len(known)
+                    known.append(value)
+                    self._dtypes.pop(col, None)
+                lookup[i] = code
+        return lookup[local]
+
+    def dtype(self, col: str) -> pd.CategoricalDtype:
+        """Текущий CategoricalDtype колонки (тот же объект, пока словарь не вырос)."""
+        with self._lock:
+            if col not in self._dtypes:
+                self._dtypes[col] = pd.CategoricalDtype(pd.Index(list(self._values.get(col, [])), dtype=object))
+            return self._dtypes[col]
+
+    def categorical(self, col: str, values: Any, order: Optional[np.ndarray] = None) -> pd.Categorical:
+        """values (в порядке order, если задан) → Categorical; новые значения — в порядке строк результата."""
+        if order is not None:
+            values = np.asarray(values, dtype=object)[order]
+        return pd.Categorical.from_codes(self.codes(col, values), dtype=self.dtype(col))
+
+    def save(self, path: Union[str, "os.PathLike[str]"]) -> None:
+        with self._lock:
+            data = {col: list(values) for col, values in self._values.items()}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: Union[str, "os.PathLike[str]"]) -> "Vocabulary":
+        """Словарь из save(); файла нет — пустой (с VOCABULARY_SEED)."""
+        if not os.path.exists(path):
+            return cls()
+        with open(path, encoding="utf-8") as f:
+            return cls(seed=json.load(f))
+
+
+DEFAULT_VOCABULARY = Vocabulary()
+
+
+def compact_frame(df: pd.DataFrame, vocab: Optional[Vocabulary] = None,
+                  columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Переводит уже разобранную таблицу (plan / changes / прочитанную из store) в компактный вид:
+    колонки PLAN_/CHANGES_COMPACT_COLUMNS (или columns) → category по словарю vocab.
+    """
+    vocab = vocab or DEFAULT_VOCABULARY
+    if columns is None:
+        columns = [c for c in dict.fromkeys(PLAN_COMPACT_COLUMNS + CHANGES_COMPACT_COLUMNS) if c in df.columns]
+    if df.empty:
+        return df
+    out = df.copy(deep=False)
+    for col in columns:
+        values = df[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            values = values.astype(object)
+        out[col] = vocab.categorical(col, values)
+    return out
+
+
+def concat_compact(frames: List[pd.DataFrame], ignore_index: bool = True) -> pd.DataFrame:
+    """
+    pd.concat для компактных таблиц: category-колонки приводятся к самому длинному набору
+    категорий. Если остальные наборы — его префиксы (один Vocabulary), коды берутся как есть;
+    иначе (таблицы из разных словарей) — union_categoricals с перекодированием.
+    """
+    nonempty = [f for f in frames if not f.empty]
+    if len(nonempty) <= 1:
+        return pd.concat(nonempty or frames, ignore_index=ignore_index) if frames else pd.DataFrame()
+    frames = nonempty
+    frame_dtypes = [f.dtypes.to_dict() for f in frames]
+    cat_cols = [c for c, t in frame_dtypes[0].items() if isinstance(t, pd.CategoricalDtype)]
+    common: Dict[str, Any] = {}
+    for col in cat_cols:
+        dtypes = [d[col] for d in frame_dtypes]
+        longest = max(dtypes, key=lambda t: len(t.categories))
+        if all(t is longest or longest.categories[:len(t.categories)].equals(t.categories) for t in dtypes):
+            common[col] = longest
+        else:
+            common[col] = union_categoricals([f[col] for f in frames]).dtype
+    aligned = []
+    for f, dtypes in zip(frames, frame_dtypes):
+        stale = [col for col, dtype in common.items() if dtypes[col] is not dtype]
+        if stale:
+            # файлы, разобранные до того, как словарь дорос: переупаковка кодов (префикс) или перекодирование
+            f = f.copy(deep=False)
+            for col in stale:
+                dtype, cats = common[col], dtypes[col].categories
+                if dtype.categories[:len(cats)].equals(cats):
+                    f[col] = pd.Categorical.from_codes(f[col].cat.codes, dtype=dtype)
+                else:
+                    f[col] = f[col].cat.set_categories(dtype.categories)
+        aligned.append(f)
+    return pd.concat(aligned, ignore_index=ignore_index)
+
+
+def _vocab(compact: bool, vocab: Optional[Vocabulary]) -> Optional[Vocabulary]:
+    """compact=True или явный vocab → словарь компактного режима, иначе None (обычные string)."""
+    return vocab or (DEFAULT_VOCABULARY if compact else None)
+
+
 # =============== PLAN parser ===============
 
-def parse_timetable_xml(xml_text: str, tz: str = "Europe/Berlin") -> pd.DataFrame:
+# колонка → атрибут <ar>/<dp> и первого <tl>
+PLAN_EVENT_ATTRS = {"planned_ts": "pt", "platform_planned": "pp", "platform_current": "cp", "line": "l",
+                    "path_pp": "ppth", "train_run_id": "tra", "wings": "wings"}
+PLAN_TL_ATTRS = {"tl_class": "f", "tl_type": "t", "tl_operator": "o", "tl_category": "c", "tl_number": "n"}
+
+
+def _plan_builder() -> Dict[str, List[Any]]:
+    """
+    Построчные ссылки на атрибуты (append-only, без dict на строку): на строку — событие
+    <ar>/<dp>, его атрибуты и атрибуты <tl> остановки; значения колонок достаются разом
+    в _plan_columns (списковыми выражениями, а не 16 append на строку).
+    """
+    return {c: [] for c in ("station", "eva", "stop_id", "event", "node", "tl")}
+
+
+def _collect_plan_stop(rows: Dict[str, List[Any]], root: Attrs, stop: _Stop) -> None:
+    """Дописывает все события <ar>/<dp> одной остановки (поддерживаем несколько в одном <s>)."""
+    s, tl_attrs, ars, dps, _ = stop
+    k = len(ars) + len(dps)
+    if not k:
+        return
+    rows["station"] += [root.get("station")] * k
+    rows["eva"] += [s.get("eva") or root.get("eva")] * k   # ← fallback к корню (иногда eva только там)
+    rows["stop_id"] += [s.get("id")] * k
+    rows["tl"] += [tl_attrs] * k                            # метаданные поезда из первого <tl …>
+    rows["event"] += ["ar"] * len(ars) + ["dp"] * len(dps)  # 'ar' | 'dp'
+    rows["node"] += [a for a, _ in ars] + [a for a, _ in dps]
+
+
+def _plan_columns(rows: Dict[str, List[Any]]) -> Dict[str, List[Any]]:
+    cols = {c: rows[c] for c in ("station", "eva", "stop_id", "event")}
+    cols.update({c: [a.get(k) for a in rows["node"]] for c, k in PLAN_EVENT_ATTRS.items()})  # pt — сырой YYMMDDHHMM
+    cols.update({c: [a.get(k) for a in rows["tl"]] for c, k in PLAN_TL_ATTRS.items()})
+    return cols
+
+
+def _plan_frame(rows: Dict[str, List[Any]], tz: str, vocab: Optional[Vocabulary] = None) -> pd.DataFrame:
+    """Строки → типизированный DataFrame (плановое время декодируется разом, StringDtype / category)."""
+    return _typed_frame(_plan_columns(rows), PLAN_COLUMNS, ["planned_ts"], ["planned_ts"], tz, kind="plan",
+                        vocab=vocab, compact_cols=PLAN_COMPACT_COLUMNS)
+
+
+def parse_timetable_xml(xml_text: str, tz: str = "Europe/Berlin", backend: Optional[str] = None,
+                        compact: bool = False, vocab: Optional[Vocabulary] = None) -> pd.DataFrame:
     """
     Разбирает PLAN-XML (<timetable> ... <s> ... <ar/>, <dp/>, <tl/> ... ) в tidy-таблицу.
 
@@ -38,75 +506,85 @@ def parse_timetable_xml(xml_text: str, tz: str = "Europe/Berlin") -> pd.DataFram
       - platform_planned (= @pp), platform_current (= @cp, если вдруг есть)
       - line (@l), path_pp (@ppth), train_run_id (@tra), wings (@wings)
       - tl_*: метаданные поезда из <tl …> при данном <s> (берём первый <tl>)
+
+    compact=True (или свой vocab) — колонки PLAN_COMPACT_COLUMNS сразу как category по словарю
+    Vocabulary (стабильные категории между файлами; склейка — concat_compact).
     """
-    try:
-        root = ET.fromstring(xml_text)
-    except ET.ParseError as e:
-        snippet = (xml_text or "")[:300].replace("\n", " ")
-        raise RuntimeError(f"Invalid plan XML: {e}. Snippet: {snippet}")
-
-    station_name = root.attrib.get("station")
-    eva_from_root = root.attrib.get("eva")  # иногда eva только в корне
-    rows: List[Dict[str, Any]] = []
-
-    for s in root.findall(".//s"):
-        stop_id = s.attrib.get("id")
-        eva = s.attrib.get("eva") or eva_from_root  # ← fallback к корню
-
-        # метаданные поезда из <tl …> (часто один; берём первый)
-        tl = _first_or_none(s, "tl")
-        tl_class    = tl.attrib.get("f") if tl is not None else None
-        tl_type     = tl.attrib.get("t") if tl is not None else None
-        tl_operator = tl.attrib.get("o") if tl is not None else None
-        tl_category = tl.attrib.get("c") if tl is not None else None
-        tl_number   = tl.attrib.get("n") if tl is not None else None
-
-        # поддерживаем несколько <ar>/<dp> в одном <s>
-        for tag in ("ar", "dp"):
-            for node in s.findall(tag):
-                pt = _parse_ts_yyMMddHHmm(node.attrib.get("pt"), tz=tz)
-
-                rows.append({
-                    "station": station_name,
-                    "eva": eva,
-                    "stop_id": stop_id,
-                    "event": tag,                                # 'ar' | 'dp'
-                    "planned_ts": pt,
-                    "platform_planned": node.attrib.get("pp"),
-                    "platform_current": node.attrib.get("cp"),
-                    "line": node.attrib.get("l"),
-                    "path_pp": node.attrib.get("ppth"),
-                    "train_run_id": node.attrib.get("tra"),
-                    "wings": node.attrib.get("wings"),
-                    "tl_class": tl_class,
-                    "tl_type": tl_type,
-                    "tl_operator": tl_operator,
-                    "tl_category": tl_category,
-                    "tl_number": tl_number,
-                })
-
-    df = pd.DataFrame(rows)
-    if df.empty:
-        return pd.DataFrame(
-            columns=[
-                "station","eva","stop_id","event","planned_ts",
-                "platform_planned","platform_current","line",
-                "path_pp","train_run_id","wings",
-                "tl_class","tl_type","tl_operator","tl_category","tl_number",
-            ]
-        )
+    backend = xml_backend(backend)
+    with metrics.stage("parse_file", kind="plan", backend=backend) as st:
+        with metrics.stage("parse_phase", kind="plan", phase="xml"):
+            rows = _plan_builder()
+            for root, stop in _stops_from_text(xml_text, "plan", backend):
+                _collect_plan_stop(rows, root, stop)
+        df = _plan_frame(rows, tz, _vocab(compact, vocab))
+        st.set(rows=len(df), bytes=len(xml_text or ""))
+    return df
+
 
-    df = df.sort_values("planned_ts", na_position="last").reset_index(drop=True)
-    for col in ["station","eva","stop_id","event","platform_planned","platform_current",
-                "line","path_pp","train_run_id","wings","tl_class","tl_type","tl_operator",
-                "tl_category","tl_number"]:
-        df[col] = df[col].astype("string")
+def parse_timetable_file(source: XmlSource, tz: str = "Europe/Berlin", backend: Optional[str] = None,
+                         compact: bool = False, vocab: Optional[Vocabulary] = None) -> pd.DataFrame:
+    """
+    Потоковый вариант parse_timetable_xml: принимает путь или бинарный file-like,
+    разбирает <s> по одному и сразу пишет в колоночные массивы.
+    Результат идентичен parse_timetable_xml на том же документе.
+    """
+    backend = xml_backend(backend)
+    with metrics.stage("parse_file", kind="plan", backend=backend) as st:
+        rows = _plan_builder()
+        with metrics.stage("parse_phase", kind="plan", phase="xml"):
+            for root, stop in _stops_from_source(source, "plan", backend):
+                _collect_plan_stop(rows, root, stop)
+        df = _plan_frame(rows, tz, _vocab(compact, vocab))
+        st.set(rows=len(df), file=_source_name(source))
     return df
 
 
 # =============== CHANGES parser ===============
 
-def parse_changes_xml(xml_text: str, tz: Optional[str] = "Europe/Berlin") -> pd.DataFrame:
+# колонка → атрибут <ar>/<dp> (контекст сообщения) и самого <m>
+CHANGES_EVENT_ATTRS = {"event_ct": "ct", "platform": "cp", "line": "l", "path": "cpth"}
+CHANGES_MSG_ATTRS = {"msg_id": "id", "msg_type": "t", "msg_code": "c", "category": "cat", "priority": "pr",
+                     "ts": "ts", "from_ts": "from", "to_ts": "to", "ts_tts": "ts-tts"}
+
+
+def _changes_builder() -> Dict[str, List[Any]]:
+    """Построчные ссылки: на строку — сообщение <m>, уровень и атрибуты его <ar>/<dp> (как _plan_builder)."""
+    return {c: [] for c in ("station", "eva", "stop_id", "scope", "node", "msg")}
+
+
+def _collect_changes_stop(rows: Dict[str, List[Any]], root: Attrs, stop: _Stop) -> None:
+    """Дописывает все сообщения <m> одной остановки (уровни s/ar/dp)."""
+    s, _, ars, dps, s_msgs = stop
+    # сообщения прямо под <s> (без контекста <ar>/<dp>), затем внутри <ar> / <dp>
+    parts = [("s", _EMPTY, s_msgs)] + [("ar", n, m) for n, m in ars] + [("dp", n, m) for n, m in dps]
+    k = sum(len(msgs) for _, _, msgs in parts)
+    if not k:
+        return
+    rows["station"] += [root.get("station")] * k
+    rows["eva"] += [s.get("eva") or root.get("eva")] * k
+    rows["stop_id"] += [s.get("id")] * k
+    for scope, node, msgs in parts:
+        rows["scope"] += [scope] * len(msgs)
+        rows["node"] += [node] * len(msgs)
+        rows["msg"] += msgs
+
+
+def _changes_columns(rows: Dict[str, List[Any]]) -> Dict[str, List[Any]]:
+    cols = {c: rows[c] for c in ("station", "eva", "stop_id", "scope")}
+    cols["event"] = [None if sc == "s" else sc for sc in rows["scope"]]   # 'ar'/'dp' только на их уровне
+    cols.update({c: [a.get(k) for a in rows["node"]] for c, k in CHANGES_EVENT_ATTRS.items()})
+    cols.update({c: [a.get(k) for a in rows["msg"]] for c, k in CHANGES_MSG_ATTRS.items()})
+    return cols
+
+
+def _changes_frame(rows: Dict[str, List[Any]], tz: Optional[str], vocab: Optional[Vocabulary] = None) -> pd.DataFrame:
+    """Строки → типизированный DataFrame (все таймштампы декодируются разом, StringDtype / category)."""
+    return _typed_frame(_changes_columns(rows), CHANGES_COLUMNS, CHANGES_TS_COLUMNS, ["ts", "event_ct"], tz,
+                        kind="changes", vocab=vocab, compact_cols=CHANGES_COMPACT_COLUMNS)
+
+
+def parse_changes_xml(xml_text: str, tz: Optional[str] = "Europe/Berlin", backend: Optional[str] = None,
+                      compact: bool = False, vocab: Optional[Vocabulary] = None) -> pd.DataFrame:
     """
     Парсит XML из /timetables/v1/fchg/{eva}.
     Каждое сообщение <m ...> становится строкой с контекстом, где оно найдено.
@@ -119,80 +597,32 @@ def parse_changes_xml(xml_text: str, tz: Optional[str] = "Europe/Berlin") -> pd.
       - platform: cp из <ar>/<dp>, line: l, path: cpth
       - msg_id, msg_type (t), msg_code (c), category (cat), priority (pr)
       - ts, from_ts, to_ts (datetime), ts_tts (строка из XML)
+
+    compact / vocab — как в parse_timetable_xml (колонки CHANGES_COMPACT_COLUMNS).
     """
-    try:
-        root = ET.fromstring(xml_text)
-    except ET.ParseError as e:
-        snippet = (xml_text or "")[:300].replace("\n", " ")
-        raise RuntimeError(f"Invalid fchg XML: {e}. Snippet: {snippet}")
-
-    station = root.attrib.get("station")
-    eva_root = root.attrib.get("eva")
-
-    rows: List[Dict[str, Any]] = []
-
-    def _append_row(m: ET.Element, *, scope: str, event: Optional[str], s_node: ET.Element, ardp_node: Optional[ET.Element]):
-        # контекст уровня <s>
-        stop_id = s_node.attrib.get("id")
-        eva = s_node.attrib.get("eva") or eva_root
-
-        # контекст уровня <ar>/<dp>
-        ct   = _parse_ts_yyMMddHHmm(ardp_node.attrib.get("ct"), tz=tz) if ardp_node is not None else None
-        cp   = ardp_node.attrib.get("cp")  if ardp_node is not None else None
-        line = ardp_node.attrib.get("l")   if ardp_node is not None else None
-        cpth = ardp_node.attrib.get("cpth") if ardp_node is not None else None
-
-        # атрибуты сообщения
-        attrs   = m.attrib
-        ts      = _parse_ts_yyMMddHHmm(attrs.get("ts"), tz=tz)
-        from_ts = _parse_ts_yyMMddHHmm(attrs.get("from"), tz=tz)
-        to_ts   = _parse_ts_yyMMddHHmm(attrs.get("to"), tz=tz)
-
-        rows.append({
-            "station": station,
-            "eva": eva,
-            "stop_id": stop_id,
-            "scope": scope,
-            "event": event,
-            "event_ct": ct,
-            "platform": cp,
-            "line": line,
-            "path": cpth,
-            "msg_id": attrs.get("id"),
-            "msg_type": attrs.get("t"),
-            "msg_code": attrs.get("c"),
-            "category": attrs.get("cat"),
-            "priority": attrs.get("pr"),
-            "ts": ts,
-            "from_ts": from_ts,
-            "to_ts": to_ts,
-            "ts_tts": attrs.get("ts-tts"),
-        })
-
-    # сообщения прямо под <s>
-    for s in root.findall(".//s"):
-        for m in s.findall("m"):
-            _append_row(m, scope="s", event=None, s_node=s, ardp_node=None)
-        # сообщения внутри <ar>
-        for ar in s.findall("ar"):
-            for m in ar.findall("m"):
-                _append_row(m, scope="ar", event="ar", s_node=s, ardp_node=ar)
-        # сообщения внутри <dp>
-        for dp in s.findall("dp"):
-            for m in dp.findall("m"):
-                _append_row(m, scope="dp", event="dp", s_node=s, ardp_node=dp)
-
-    df = pd.DataFrame(rows)
-    if df.empty:
-        return pd.DataFrame(
-            columns=[
-                "station","eva","stop_id","scope","event","event_ct","platform","line","path",
-                "msg_id","msg_type","msg_code","category","priority","ts","from_ts","to_ts","ts_tts"
-            ]
-        )
+    backend = xml_backend(backend)
+    with metrics.stage("parse_file", kind="changes", backend=backend) as st:
+        with metrics.stage("parse_phase", kind="changes", phase="xml"):
+            rows = _changes_builder()
+            for root, stop in _stops_from_text(xml_text, "fchg", backend):
+                _collect_changes_stop(rows, root, stop)
+        df = _changes_frame(rows, tz, _vocab(compact, vocab))
+        st.set(rows=len(df), bytes=len(xml_text or ""))
+    return df
 
-    df = df.sort_values(["ts", "event_ct"], na_position="last").reset_index(drop=True)
-    for col in ["station","eva","stop_id","scope","event","platform","line","path",
-                "msg_id","msg_type","msg_code","category","priority","ts_tts"]:
-        df[col] = df[col].astype("string")
+
+def parse_changes_file(source: XmlSource, tz: Optional[str] = "Europe/Berlin", backend: Optional[str] = None,
+                       compact: bool = False, vocab: Optional[Vocabulary] = None) -> pd.DataFrame:
+    """
+    Потоковый вариант parse_changes_xml для больших fchg-снимков (путь или file-like).
+    <s> обрабатываются по одному и сразу освобождаются; результат идентичен parse_changes_xml.
+    """
+    backend = xml_backend(backend)
+    with metrics.stage("parse_file", kind="changes", backend=backend) as st:
+        rows = _changes_builder()
+        with metrics.stage("parse_phase", kind="changes", phase="xml"):
+            for root, stop in _stops_from_source(source, "fchg", backend):
+                _collect_changes_stop(rows, root, stop)
+        df = _changes_frame(rows, tz, _vocab(compact, vocab))
+        st.set(rows=len(df), file=_source_name(source))
     return df
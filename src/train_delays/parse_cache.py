@@ -0,0 +1,234 @@
+"""
+Кэш результатов парсинга на диске: один и тот же снимок XML не разбирается дважды
+(повторные запуски scripts/parse_*.py, ноутбуки, перебор снимков в EDA).
+
+Те же функции, что в parse.py, с тем же результатом — drop-in замена:
+  from train_delays.parse_cache import parse_changes_file
+  df = parse_changes_file("data/raw/.../timetable_changes_....xml")
+
+Ключ — sha256(kind | sha256 payload | tz | версия парсера):
+  - версия парсера — хэш исходника parse.py: правка парсера сама делает старые записи
+    недостижимыми, а evict() удаляет каталоги чужих версий целиком;
+  - бэкенд XML в ключ не входит (результат от бэкенда не зависит, см. scripts/check_parsers.py).
+Раскладка:
+  data/processed/_parse_cache/<версия>/<ab>/<ключ>.parquet   # типизированный DataFrame (string, dt[tz])
+Вытеснение — LRU по mtime (попадание обновляет mtime) под бюджетом размера
+TRAIN_DELAYS_PARSE_CACHE_MB (по умолчанию 512 МБ; 0 — кэш выключен).
+"""
+from __future__ import annotations
+import functools, hashlib, io, json, os, pathlib, shutil
+from typing import Callable, Dict, IO, List, Optional, Tuple, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from train_delays import metrics, parse
+from train_delays.parse import XmlSource
+from train_delays.store import STORE_ROOT
+
+PARSE_CACHE_DIR = pathlib.Path(os.getenv("TRAIN_DELAYS_PARSE_CACHE", str(STORE_ROOT / "_parse_cache")))
+PARSE_CACHE_MB = float(os.getenv("TRAIN_DELAYS_PARSE_CACHE_MB", "512"))
+EVICT_TO = 0.9   # после вытеснения кэш занимает не больше этой доли бюджета (запас на следующие записи)
+DTYPES_META = b"train_delays_dtypes"   # точные dtype колонок времени: Parquet не хранит единицу [s]
+
+
+@functools.lru_cache(maxsize=None)
+def parser_version() -> str:
+    """Хэш исходника parse.py — меняется при любой правке парсера."""
+    return hashlib.sha256(pathlib.Path(parse.__file__).read_bytes()).hexdigest()[:16]
+
+
+def _read_source(source: XmlSource) -> bytes:
+    if isinstance(source, (str, os.PathLike)):
+        return pathlib.Path(source).read_bytes()
+    return source.read()
+
+
+class ParseCache:
+    """Кэш DataFrame'ов парсера с LRU-вытеснением под бюджетом размера (байт)."""
+
+    def __init__(self, root: Union[str, pathlib.Path] = PARSE_CACHE_DIR,
+                 max_bytes: Optional[int] = None, version: Optional[str] = None):
+        self.root = pathlib.Path(root)
+        self.max_bytes = int(PARSE_CACHE_MB * 2**20) if max_bytes is None else int(max_bytes)
+        self.version = version or parser_version()
+        self.dir = self.root / self.version
+        self.hits = self.misses = 0
+        self._size: Optional[int] = None   # текущий размер, считается при первой записи
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def key(self, kind: str, payload_sha: str, tz: Optional[str]) -> str:
+        return hashlib.sha256(f"{kind}|{payload_sha}|{tz}|{self.version}".encode()).hexdigest()
+
+    def path(self, key: str) -> pathlib.Path:
+        return self.dir / key[:2] / f"{key}.parquet"
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        path = self.path(key)
+        try:
+            table = pq.read_table(path)
+            os.utime(path)   # LRU: попадание — свежий mtime
+        except (FileNotFoundError, OSError, ValueError, pa.ArrowException):
+            # нет записи / вытеснена параллельно / обрыв записи — считаем промахом
+            return None
+        df = table.to_pandas()
+        dtypes = json.loads((table.schema.metadata or {}).get(DTYPES_META, b"{}"))
+        for col, dtype in dtypes.items():
+            if str(df[col].dtype) != dtype:
+                df[col] = df[col].astype(dtype)
+        return df
+
+    def put(self, key: str, df: pd.DataFrame) -> None:
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        dtypes = {c: str(t) for c, t in df.dtypes.items() if pd.api.types.is_datetime64_any_dtype(t)}
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                               DTYPES_META: json.dumps(dtypes).encode()})
+        pq.write_table(table, tmp)
+        os.replace(tmp, path)
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        else:
+            self._size += path.stat().st_size
+        if self._size > self.max_bytes:
+            self.evict()
+
+    def _entries(self) -> List[Tuple[float, int, pathlib.Path]]:
+        """(mtime, размер, путь) записей текущей версии."""
+        out = []
+        for path in self.dir.glob("*/*.parquet"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            out.append((st.st_mtime, st.st_size, path))
+        return out
+
+    def evict(self, target_bytes: Optional[int] = None) -> int:
+        """
+        Удаляет каталоги других версий парсера, затем самые давно использованные записи,
+        пока кэш не уложится в target_bytes (по умолчанию EVICT_TO × бюджет). Возвращает число удалённых записей.
+        """
+        if target_bytes is None:
+            target_bytes = int(self.max_bytes * EVICT_TO)
+        if self.root.exists():
+            for d in self.root.iterdir():
+                if d.is_dir() and d.name != self.version:
+                    shutil.rmtree(d, ignore_errors=True)
+        entries = sorted(self._entries())
+        size = sum(s for _, s, _ in entries)
+        removed = 0
+        for _, s, path in entries:
+            if size <= target_bytes:
+                break
+            path.unlink(missing_ok=True)
+            size -= s
+            removed += 1
+        self._size = size
+        if removed:
+            metrics.inc("parse_cache_evicted", removed)
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        entries = self._entries()
+        return {"entries": len(entries), "bytes": sum(s for _, s, _ in entries),
+                "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses}
+
+    def parse(self, kind: str, payload: bytes, tz: Optional[str],
+              parse_fn: Callable[[IO[bytes]], pd.DataFrame]) -> pd.DataFrame:
+        """Результат parse_fn(payload) из кэша; при промахе — разбор и запись."""
+        if not self.enabled:
+            return parse_fn(io.BytesIO(payload))
+        key = self.key(kind, hashlib.sha256(payload).hexdigest(), tz)
+        df = self.get(key)
+        if df is not None:
+            self.hits += 1
+            metrics.inc("parse_cache", kind=kind, result="hit")
+            return df
+        self.misses += 1
+        metrics.inc("parse_cache", kind=kind, result="miss")
+        df = parse_fn(io.BytesIO(payload))
+        self.put(key, df)
+        return df
+
+
+_DEFAULT: Optional[ParseCache] = None
+
+
+def default_cache() -> ParseCache:
+    global _DEFAULT
+    if _DEFAULT is None:
+        _DEFAULT = ParseCache()
+    return _DEFAULT
+
+
+# =============== drop-in обёртки parse.py ===============
+# В кэше — обычные (string) таблицы; компактный режим применяется к результату (compact_frame),
+# так что одна запись обслуживает оба режима.
+
+def _compact(df: pd.DataFrame, compact: bool, vocab: Optional[parse.Vocabulary]) -> pd.DataFrame:
+    return parse.compact_frame(df, vocab) if compact or vocab is not None else df
+
+
+def parse_timetable_file(source: XmlSource, tz: str = "Europe/Berlin", backend: Optional[str] = None,
+                         cache: Optional[ParseCache] = None, compact: bool = False,
+                         vocab: Optional[parse.Vocabulary] = None) -> pd.DataFrame:
+    """parse.parse_timetable_file через кэш."""
+    df = (cache or default_cache()).parse(
+        "plan", _read_source(source), tz, lambda f: parse.parse_timetable_file(f, tz=tz, backend=backend))
+    return _compact(df, compact, vocab)
+
+
+def parse_timetable_xml(xml_text: str, tz: str = "Europe/Berlin", backend: Optional[str] = None,
+                        cache: Optional[ParseCache] = None, compact: bool = False,
+                        vocab: Optional[parse.Vocabulary] = None) -> pd.DataFrame:
+    """parse.parse_timetable_xml через кэш (ключ — по UTF-8 байтам строки)."""
+    df = (cache or default_cache()).parse(
+        "plan", xml_text.encode("utf-8"), tz, lambda f: parse.parse_timetable_xml(xml_text, tz=tz, backend=backend))
+    return _compact(df, compact, vocab)
+
+
+def parse_changes_file(source: XmlSource, tz: Optional[str] = "Europe/Berlin", backend: Optional[str] = None,
+                       cache: Optional[ParseCache] = None, compact: bool = False,
+                       vocab: Optional[parse.Vocabulary] = None) -> pd.DataFrame:
+    """parse.parse_changes_file через кэш."""
+    df = (cache or default_cache()).parse(
+        "changes", _read_source(source), tz, lambda f: parse.parse_changes_file(f, tz=tz, backend=backend))
+    return _compact(df, compact, vocab)
+
+
+def parse_changes_xml(xml_text: str, tz: Optional[str] = "Europe/Berlin", backend: Optional[str] = None,
+                      cache: Optional[ParseCache] = None, compact: bool = False,
+                      vocab: Optional[parse.Vocabulary] = None) -> pd.DataFrame:
+    """parse.parse_changes_xml через кэш (ключ — по UTF-8 байтам строки)."""
+    df = (cache or default_cache()).parse(
+        "changes", xml_text.encode("utf-8"), tz, lambda f: parse.parse_changes_xml(xml_text, tz=tz, backend=backend))
+    return _compact(df, compact, vocab)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Кэш результатов парсинга (data/processed/_parse_cache)")
+    parser.add_argument("action", nargs="?", choices=["stats", "evict", "clear"], default="stats",
+                        help="stats — размер; evict — вытеснить до бюджета и убрать старые версии; clear — очистить")
+    parser.add_argument("--root", default=str(PARSE_CACHE_DIR))
+    parser.add_argument("--max-mb", type=float, default=PARSE_CACHE_MB, help="Бюджет размера, МБ")
+    args = parser.parse_args()
+
+    cache = ParseCache(args.root, max_bytes=int(args.max_mb * 2**20))
+    if args.action == "clear":
+        shutil.rmtree(cache.root, ignore_errors=True)
+        print("Кэш очищен:", cache.root)
+    else:
+        if args.action == "evict":
+            print("Вытеснено записей:", cache.evict())
+        st = cache.stats()
+        print(f"Версия парсера: {cache.version}, записей: {st['entries']}, "
+              f"{st['bytes'] / 2**20:.1f} из {st['max_bytes'] / 2**20:.0f} МБ")
@@ -0,0 +1,259 @@
+"""
+Сквозной прогон в одном процессе: fetch → parse → merge → features (для cron раз в несколько минут).
+
+Вместо четырёх процессов и CSV между ними:
+- ответы API парсятся прямо из памяти (сырьё, как и раньше, кладётся в архив data/raw);
+- снимки, уже разобранные раньше (манифест ingest), не парсятся повторно, а в changes
+  пишутся только новые/обновлённые сообщения (train_delays.dedup, как в ingest);
+- merged пересобирается только для затронутых партиций плана (eva × день), признаки —
+  только для их дней; из хранилища читается лишь недостающий контекст (план/изменения
+  этих партиций, merged соседнего дня);
+- всё записывается в processed-хранилище одним блоком в конце, вместе с манифестами
+  ingest и features, так что последующие `ingest` / `features` не повторяют работу.
+
+Запуск: python -m train_delays run --stations "Hannover Hbf" 8000105 [--hours-ahead 1] [--recent]
+"""
+from __future__ import annotations
+import pathlib
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple, Union
+
+import pandas as pd
+import requests
+
+from train_delays import fetch, metrics
+from train_delays.archive import ARCHIVE_ROOT, BERLIN, RawArchive
+from train_delays.dedup import ChangeDeduper
+from train_delays.features import (DELAY_THRESHOLD_MIN, FEATURES_KEY, INPUT_COLUMNS, ROLL_WINDOW_MIN,
+                                   features_for_day, params_tag)
+from train_delays.features import MANIFEST_NAME as FEATURES_MANIFEST
+from train_delays.ingest import DATASET_BY_KIND, latest_payloads, payload_stream, source_key
+from train_delays.ingest import MANIFEST_NAME as PARSE_MANIFEST
+from train_delays.manifest import ManifestWriter, load_manifest
+from train_delays.merge import (CHANGE_READ_COLUMNS, EVENTS, MERGED_KEY, join_plan_changes, read_partition_inputs,
+                                stamp_snapshot)
+from train_delays.parse import parse_changes_xml, parse_timetable_xml
+from train_delays.stations import attach_station_names, get_registry
+from train_delays.store import (PARTITION_TS, STORE_ROOT, UNKNOWN, list_partitions, partition_date,
+                                partition_signature, read_partition, write_partitions)
+
+Partition = Tuple[str, str]   # (eva, 'YYYY-MM-DD')
+
+
+def _shift_day(day: str, days: int) -> str:
+    return (datetime.strptime(day, "%Y-%m-%d") + timedelta(days=days)).strftime("%Y-%m-%d")
+
+
+def _partitions(df: pd.DataFrame, dataset: str) -> pd.Series:
+    """Ключ партиции строки: 'eva|day' (как раскладывает write_partitions)."""
+    evas = df["eva"].astype("string").fillna(UNKNOWN)
+    return evas + "|" + partition_date(df, PARTITION_TS[dataset])
+
+
+# ----------------- шаги -----------------
+def fetch_payloads(
+    stations: Iterable[Union[int, str]],
+    archive: RawArchive,
+    hours_ahead: int = 0,
+    recent: bool = False,
+    now: Optional[datetime] = None,
+) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    PLAN за текущий час (+hours_ahead следующих) и FCHG (или RCHG при recent) по каждой станции.
+    Ответы кладутся в архив; возвращает ([{kind, eva, sha256, fetched_at, prev_sha, xml}], число неудачных
+    запросов), prev_sha — предыдущий снимок того же потока в архиве (см. ingest.source_key).
+    """
+    now = now or datetime.now(BERLIN)
+    last = latest_payloads(archive)
+    slots = [now + timedelta(hours=h) for h in range(hours_ahead + 1)]
+    registry = get_registry()
+    payloads: List[Dict[str, Any]] = []
+    failed = 0
+    for st in stations:
+        eva = registry.resolve(st)
+        tasks = [("plan", t.strftime("%y%m%d"), t.hour) for t in slots]
+        tasks.append(("rchg" if recent else "fchg", None, None))
+        for kind, yymmdd, hh in tasks:
+            try:
+                if kind == "plan":
+                    xml = fetch.get_planned_timetable(eva=eva, date=yymmdd, hour=hh)
+                    entry = archive.put(xml, eva=eva, kind=kind, fetched_at=now, slot=f"{yymmdd}/{hh:02d}")
+                else:
+                    xml = fetch.get_recent_changes(eva) if recent else fetch.get_changes(eva)
+                    entry = archive.put(xml, eva=eva, kind=kind, fetched_at=now)
+            except (requests.RequestException, RuntimeError) as e:
+                print(f"[WARN] {kind} {eva}: {type(e).__name__}: {e}")
+                failed += 1
+                continue
+            stream = payload_stream(entry)
+            payloads.append({"kind": kind, "eva": eva, "sha256": entry["sha256"], "fetched_at": entry["fetched_at"],
+                             "prev_sha": last.get(stream), "xml": xml})
+            last[stream] = entry["sha256"]
+    return payloads, failed
+
+
+def parse_payloads(payloads: List[Dict[str, Any]], done: Set[str]) -> List[Dict[str, Any]]:
+    """
+    XML из памяти → DataFrame'ы; снимки из манифеста ingest (done) и повторы в прогоне пропускаются.
+    Payload, вернувшийся в поток после другого, разбирается ещё раз — с теми же ключами, что дал бы ingest.
+    """
+    parsed: List[Dict[str, Any]] = []
+    seen = set(done)
+    for p in payloads:
+        returned = p.get("prev_sha") not in (None, p["sha256"]) and f"{p['kind']}:{p['sha256']}" in seen
+        key, part_key = source_key(p, returned)
+        if key in seen:
+            continue
+        seen.add(key)
+        parse_fn = parse_timetable_xml if p["kind"] == "plan" else parse_changes_xml
+        df = stamp_snapshot(parse_fn(p["xml"]), p["fetched_at"])
+        parsed.append({"key": key, "kind": p["kind"], "dataset": DATASET_BY_KIND[p["kind"]],
+                       "part_key": part_key, "df": df})
+    return parsed
+
+
+def merge_touched(
+    new_plan: pd.DataFrame,
+    new_chg: pd.DataFrame,
+    root: Union[str, pathlib.Path],
+    tol: pd.Timedelta,
+) -> Dict[Partition, pd.DataFrame]:
+    """
+    Пересобирает merged для партиций плана, которые задевают новые строки: план — сама партиция,
+    изменения — партиции day−1 … day+1 (симметрично окну merge_partition). Вход = хранилище + новое.
+    """
+    plan_keys = _partitions(new_plan, "plan") if not new_plan.empty else pd.Series(dtype="string")
+    chg = new_chg[new_chg["event"].isin(EVENTS) & new_chg["stop_id"].notna()] if not new_chg.empty else new_chg
+    chg_keys = _partitions(chg, "changes") if not chg.empty else pd.Series(dtype="string")
+
+    stored_plan = {(e, d) for e, d, _ in list_partitions("plan", root)}
+    touched: Set[Partition] = {tuple(k.split("|", 1)) for k in plan_keys.unique()}
+    for k in chg_keys.unique():
+        eva, day = k.split("|", 1)
+        if day == UNKNOWN:
+            continue
+        for shift in (-1, 0, 1):
+            part = (eva, _shift_day(day, shift))
+            if part in stored_plan:
+                touched.add(part)
+
+    out: Dict[Partition, pd.DataFrame] = {}
+    for eva, day in sorted(touched):
+        plan, stored_chg = read_partition_inputs(eva, day, root)
+        fresh_plan = new_plan[(plan_keys == f"{eva}|{day}").to_numpy()] if not new_plan.empty else new_plan
+        plan = pd.concat([f for f in (plan, fresh_plan) if not f.empty] or [plan], ignore_index=True)
+        if day != UNKNOWN and not chg.empty:
+            window = {f"{eva}|{_shift_day(day, s)}" for s in (-1, 0, 1)}
+            fresh = chg[chg_keys.isin(window).to_numpy()][CHANGE_READ_COLUMNS]
+            stored_chg = pd.concat([f for f in (stored_chg, fresh) if not f.empty] or [stored_chg],
+                                   ignore_index=True)
+        if plan.empty:
+            continue
+        out[(eva, day)] = attach_station_names(join_plan_changes(plan, stored_chg, tol=tol))
+    return out
+
+
+def features_touched(
+    merged: Dict[Partition, pd.DataFrame],
+    root: Union[str, pathlib.Path],
+    window_min: int,
+    threshold_min: int,
+) -> Dict[str, pd.DataFrame]:
+    """
+    Признаки для дней, где поменялся merged (и следующего дня, если он уже есть — окна и рейсы
+    через полночь). Контекст — merged всех станций за день и предыдущий день, с подменой
+    пересобранных партиций на новые из памяти.
+    """
+    stored_days = {d for _, d, _ in list_partitions("merged", root)}
+    days = {d for _, d in merged if d != UNKNOWN}
+    days |= {_shift_day(d, 1) for d in days if _shift_day(d, 1) in stored_days}
+
+    out: Dict[str, pd.DataFrame] = {}
+    for day in sorted(days):
+        prev = _shift_day(day, -1)
+        frames = [read_partition("merged", e, d, root, columns=INPUT_COLUMNS)
+                  for e, d, _ in list_partitions("merged", root, start=prev, end=day) if (e, d) not in merged]
+        frames += [df[INPUT_COLUMNS] for (e, d), df in merged.items() if d in (prev, day)]
+        frames = [f for f in frames if not f.empty]
+        if frames:
+            out[day] = features_for_day(pd.concat(frames, ignore_index=True), day, window_min, threshold_min)
+    return out
+
+
+# ----------------- прогон -----------------
+def run_pipeline(
+    stations: Iterable[Union[int, str]],
+    raw_root: Union[str, pathlib.Path] = ARCHIVE_ROOT,
+    store_root: Union[str, pathlib.Path] = STORE_ROOT,
+    hours_ahead: int = 0,
+    recent: bool = False,
+    tol: pd.Timedelta = pd.Timedelta(minutes=2),
+    features: bool = True,
+    window_min: int = ROLL_WINDOW_MIN,
+    threshold_min: int = DELAY_THRESHOLD_MIN,
+) -> Dict[str, int]:
+    """fetch → parse → merge → features в памяти, запись в хранилище одним блоком в конце."""
+    store_root = pathlib.Path(store_root)
+    counts = {"fetched": 0, "failed": 0, "parsed": 0, "rows": 0, "merged_partitions": 0,
+              "merged_rows": 0, "feature_days": 0, "feature_rows": 0}
+
+    with metrics.stage("pipeline_step", step="fetch") as st:
+        payloads, counts["failed"] = fetch_payloads(stations, RawArchive(raw_root), hours_ahead, recent)
+        counts["fetched"] = len(payloads)
+        st.set(rows=len(payloads))
+
+    with metrics.stage("pipeline_step", step="parse") as st:
+        done = {k for k, rec in load_manifest(store_root / PARSE_MANIFEST).items() if rec.get("status") == "ok"}
+        parsed = parse_payloads(payloads, done)
+        counts["parsed"] = len(parsed)
+        counts["rows"] = sum(len(p["df"]) for p in parsed)
+        st.set(rows=counts["rows"])
+    if not parsed:
+        return counts
+
+    def _concat(dataset: str) -> pd.DataFrame:
+        frames = [p["df"] for p in parsed if p["dataset"] == dataset and not p["df"].empty]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    with metrics.stage("pipeline_step", step="merge") as st:
+        merged = merge_touched(_concat("plan"), _concat("changes"), store_root, tol)
+        counts["merged_partitions"] = len(merged)
+        counts["merged_rows"] = sum(len(df) for df in merged.values())
+        st.set(rows=counts["merged_rows"])
+
+    feats: Dict[str, pd.DataFrame] = {}
+    if features:
+        with metrics.stage("pipeline_step", step="features") as st:
+            feats = features_touched(merged, store_root, window_min, threshold_min)
+            counts["feature_days"] = len(feats)
+            counts["feature_rows"] = sum(len(df) for df in feats.values())
+            st.set(rows=counts["feature_rows"])
+
+    # ---- единственная запись: сначала данные, затем манифесты (при сбое шаги просто повторятся) ----
+    with metrics.stage("pipeline_step", step="write"):
+        stamp = datetime.now(BERLIN).isoformat(timespec="seconds")
+        parse_recs = []
+        dedup = ChangeDeduper(store_root)
+        for p in parsed:
+            df = dedup.filter(p["df"]) if p["dataset"] == "changes" else p["df"]
+            written = write_partitions(df, p["dataset"], key=p["part_key"], root=store_root)
+            parse_recs.append({"key": p["key"], "parsed_at": stamp, "status": "ok", "dataset": p["dataset"],
+                               "rows": int(len(p["df"])), "written": int(len(df)),
+                               "partitions": [w.relative_to(store_root).as_posix() for w in written]})
+        dedup.save()
+        for df in merged.values():
+            write_partitions(df, "merged", key=MERGED_KEY, root=store_root)
+        for df in feats.values():
+            write_partitions(df, "features", key=FEATURES_KEY, root=store_root)
+
+        with ManifestWriter(store_root / PARSE_MANIFEST) as writer:
+            for rec in parse_recs:
+                writer.write(rec)
+        if feats:
+            params = params_tag(window_min, threshold_min)
+            with ManifestWriter(store_root / FEATURES_MANIFEST) as writer:
+                for day, df in feats.items():
+                    for e, d, part_dir in list_partitions("merged", store_root, start=day, end=day):
+                        writer.write({"key": f"{e}/{d}", "signature": partition_signature(part_dir),
+                                      "params": params, "rows": int(len(df)), "built_at": stamp})
+    return counts
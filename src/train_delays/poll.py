@@ -0,0 +1,191 @@
+"""
+Долгоживущий сборщик изменений: один FCHG-снимок на станцию, дальше — RCHG каждые ~30 с.
+
+Запуск из корня репо (останавливается по Ctrl+C / SIGTERM):
+  python -m train_delays.poll --stations "Hannover Hbf" 8000105 --interval 30
+
+- у каждой станции свой «срок» в планировщике (heap), запросы разнесены per-station jitter'ом;
+- все запросы идут через общий token bucket (квота API) и пул потоков поверх fetch.QUOTA_SESSION;
+  5xx и обрывы повторяются через тот же bucket (crawl.with_retries), а не в urllib3 мимо него;
+- на 429 станция уходит в экспоненциальный backoff, а весь сборщик делает паузу
+  (Retry-After, если сервер его прислал);
+- /rchg отдаёт только последние ~2 минуты: если станция не опрашивалась дольше
+  RCHG_WINDOW_S (ошибки, backoff), следующий запрос — снова полный FCHG, чтобы не было дыр;
+- каждый ответ сразу пишется в архив сырья (train_delays.archive, kind fchg|rchg);
+  пустые дельты без <s> не сохраняются, одинаковые снимки хранятся одним blob'ом.
+"""
+from __future__ import annotations
+import argparse, heapq, pathlib, random, signal, threading, time, traceback
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import requests
+
+from train_delays import fetch
+from train_delays.archive import RawArchive
+from train_delays.crawl import TokenBucket, resolve_eva, retry_after_s, with_retries
+
+POLL_INTERVAL_S = 30.0
+POLL_JITTER_S = 5.0
+RCHG_WINDOW_S = 120.0       # окно, которое покрывает /rchg
+BACKOFF_MAX_S = 600.0
+DEFAULT_WORKERS = 4
+# 429 не повторяем на месте: у него своя обработка (backoff станции + общая пауза)
+RETRY_STATUSES = tuple(s for s in fetch.RETRY_STATUSES if s != 429)
+
+
+class ChangesPoller:
+    """
+    Планировщик опроса fchg/rchg по набору EVA.
+    run() блокирует поток до stop(); все запросы в полёте дожидаются завершения.
+    """
+
+    def __init__(
+        self,
+        evas: Iterable[Union[int, str]],
+        outdir: Union[str, pathlib.Path] = "data/raw",
+        interval_s: float = POLL_INTERVAL_S,
+        jitter_s: float = POLL_JITTER_S,
+        workers: int = DEFAULT_WORKERS,
+        rate_per_min: float = fetch.API_RATE_PER_MIN,
+    ):
+        self.evas = [str(e) for e in evas]
+        self.archive = RawArchive(outdir)
+        self.interval_s = float(interval_s)
+        self.jitter_s = float(jitter_s)
+        self.workers = workers
+        self.bucket = TokenBucket(rate_per_min)
+        self.stats: Dict[str, int] = {"fchg": 0, "rchg": 0, "saved": 0, "errors": 0, "throttled": 0}
+
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._heap: List[Tuple[float, str]] = []
+        self._last_ok: Dict[str, float] = {}         # EVA → monotonic время последнего успешного опроса
+        self._backoff: Dict[str, float] = {}         # EVA → текущий backoff (с)
+        self._paused_until = 0.0                     # глобальная пауза после 429
+
+    # ----------------- планирование -----------------
+    def _schedule(self, eva: str, delay_s: float) -> None:
+        with self._lock:
+            heapq.heappush(self._heap, (time.monotonic() + max(0.0, delay_s), eva))
+
+    def _next_kind(self, eva: str) -> str:
+        last = self._last_ok.get(eva)
+        if last is None or time.monotonic() - last > RCHG_WINDOW_S:
+            return "fchg"
+        return "rchg"
+
+    def _pop_due(self) -> Optional[str]:
+        with self._lock:
+            now = time.monotonic()
+            if self._heap and self._heap[0][0] <= now and now >= self._paused_until:
+                return heapq.heappop(self._heap)[1]
+        return None
+
+    # ----------------- работа -----------------
+    def _save(self, eva: str, kind: str, xml_text: str) -> Optional[Dict[str, Any]]:
+        if kind == "rchg" and "<s " not in xml_text:
+            return None  # пустая дельта
+        return self.archive.put(xml_text, eva=eva, kind=kind, fetched_at=datetime.now(fetch.BERLIN))
+
+    def _poll_one(self, eva: str) -> None:
+        """Один опрос станции; при любом исходе станция снова встаёт в планировщик."""
+        kind = self._next_kind(eva)
+        delay_s = self.interval_s
+        try:
+            delay_s = self._poll(eva, kind)
+        except Exception as e:
+            # не сеть, а, например, OSError при записи в архив (диск полон): станцию не теряем
+            print(f"[ERROR] {kind} {eva}: {type(e).__name__}: {e}")
+            traceback.print_exc()
+            delay_s = self._on_error(eva)
+        finally:
+            self._schedule(eva, delay_s)
+
+    def _poll(self, eva: str, kind: str) -> float:
+        """Запрос + запись в архив; возвращает задержку до следующего опроса станции."""
+        try:
+            get = fetch.get_changes if kind == "fchg" else fetch.get_recent_changes
+            xml_text = with_retries(self.bucket, get, eva, session=fetch.QUOTA_SESSION, statuses=RETRY_STATUSES)
+        except requests.HTTPError as e:
+            resp = e.response
+            if resp is not None and resp.status_code == 429:
+                backoff = min(BACKOFF_MAX_S, max(self.interval_s, 2 * self._backoff.get(eva, 0.0)))
+                pause = retry_after_s(resp) or backoff / 2
+                with self._lock:
+                    self._backoff[eva] = backoff
+                    self._paused_until = max(self._paused_until, time.monotonic() + pause)
+                    self.stats["throttled"] += 1
+                return backoff + random.uniform(0, self.jitter_s)
+            return self._on_error(eva)
+        except (requests.RequestException, RuntimeError):
+            return self._on_error(eva)
+
+        with self._lock:
+            self._last_ok[eva] = time.monotonic()
+            self._backoff.pop(eva, None)
+            self.stats[kind] += 1
+        if self._save(eva, kind, xml_text) is not None:
+            with self._lock:
+                self.stats["saved"] += 1
+        return self.interval_s + random.uniform(-self.jitter_s, self.jitter_s)
+
+    def _on_error(self, eva: str) -> float:
+        """Учитывает ошибку и удваивает backoff станции; возвращает задержку до повтора."""
+        with self._lock:
+            backoff = min(BACKOFF_MAX_S, max(self.interval_s, 2 * self._backoff.get(eva, 0.0)))
+            self._backoff[eva] = backoff
+            self.stats["errors"] += 1
+        return backoff + random.uniform(0, self.jitter_s)
+
+    # ----------------- жизненный цикл -----------------
+    def stop(self) -> None:
+        self._stop.set()
+
+    def run(self) -> Dict[str, int]:
+        """Главный цикл: раздаёт созревшие станции пулу, пока не вызван stop()."""
+        # стартовые сроки размазаны по интервалу, чтобы не бить API пачкой
+        for eva in self.evas:
+            self._schedule(eva, random.uniform(0, min(self.interval_s, self.jitter_s * len(self.evas))))
+
+        in_flight: Dict[str, Future] = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while not self._stop.is_set():
+                for eva, fut in list(in_flight.items()):
+                    if fut.done():
+                        del in_flight[eva]
+                eva = self._pop_due() if len(in_flight) < self.workers else None
+                if eva is None:
+                    self._stop.wait(0.2)
+                    continue
+                in_flight[eva] = pool.submit(self._poll_one, eva)
+            wait(list(in_flight.values()))
+        return dict(self.stats)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Живой сбор изменений: FCHG один раз, затем RCHG по расписанию")
+    parser.add_argument("--stations", nargs="+", required=True, help="Названия станций или EVA-номера")
+    parser.add_argument("--outdir", default="data/raw", help="Корень архива сырья")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL_S, help="Период RCHG, с (по умолчанию 30)")
+    parser.add_argument("--jitter", type=float, default=POLL_JITTER_S, help="Per-station jitter, с")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--rate-per-min", type=float, default=fetch.API_RATE_PER_MIN)
+    args = parser.parse_args(argv)
+
+    evas = [resolve_eva(st) for st in args.stations]
+    poller = ChangesPoller(evas, outdir=args.outdir, interval_s=args.interval, jitter_s=args.jitter,
+                           workers=args.workers, rate_per_min=args.rate_per_min)
+
+    # Корректная остановка: дожидаемся запросов в полёте, файлы не обрываются посередине
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: poller.stop())
+
+    print(f"Опрашиваем {len(evas)} станций каждые ~{args.interval:.0f} с. Остановка: Ctrl+C")
+    stats = poller.run()
+    print("Остановлено:", stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+"""
+Запросы к обработанной истории без загрузки всего датасета в pandas.
+
+  from train_delays.query import query_delays
+  df = query_delays(eva=8000152, last="28D", weekdays=[0], hours=range(7, 10), event="dp")
+
+Что открывается с диска:
+1. партиции eva=<EVA>/date=<YYYY-MM-DD> — по станциям, диапазону дат и дням недели
+   (дата партиции — локальная дата события, см. store.PARTITION_TS);
+2. part-файлы — по min/max из футеров Parquet: время события (planned_ts, иначе changed_ts),
+   локальные часы, delay_min. Статистики файлов кэшируются в
+   data/processed/_stats/<dataset>.jsonl (ключ — путь, проверка по размеру и mtime),
+   поэтому запрос не читает даже футеры неизменившихся файлов;
+3. в файле — только нужные колонки; фильтры (время, день недели, час, событие, задержка,
+   filters=[...]) уходят в сканер pyarrow и отсекают row group'ы по их статистикам.
+Результат — типизированный DataFrame (tz-aware время, string), как у store.read_dataset.
+"""
+from __future__ import annotations
+import argparse, os, pathlib, time
+from datetime import date, datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from train_delays import metrics
+from train_delays.manifest import ManifestWriter, load_manifest
+from train_delays.store import STORE_ROOT, TZ, DateLike, list_partitions, partition_files
+
+STATS_DIR = "_stats"
+# колонки, min/max которых хранится в индексе (время события и задержка)
+STATS_COLUMNS = {
+    "merged": ["planned_ts", "changed_ts", "delay_min"],
+    "features": ["planned_ts", "changed_ts", "delay_min"],
+    "plan": ["planned_ts"],
+    "changes": ["event_ct", "ts"],
+}
+# время события для фильтров: первая непустая из колонок (как features.event_time для merged)
+EVENT_TIME = {
+    "merged": ["planned_ts", "changed_ts"],
+    "features": ["planned_ts", "changed_ts"],
+    "plan": ["planned_ts"],
+    "changes": ["event_ct", "ts"],
+}
+DEFAULT_COLUMNS = ["station", "eva", "stop_id", "event", "planned_ts", "changed_ts", "delay_min",
+                   "line", "tl_category", "tl_number", "platform_actual"]
+COMPACT_EVERY = 2   # индекс переписывается, когда строк в нём больше, чем COMPACT_EVERY × живых ключей
+
+
+# ----------------- статистики файлов -----------------
+def _stat_value(v: Any) -> Any:
+    """min/max из футера → число для JSON (время — ns UTC)."""
+    if isinstance(v, datetime):
+        return int(pd.Timestamp(v).value)
+    if isinstance(v, (int, float, np.integer, np.floating)):
+        return v.item() if isinstance(v, np.generic) else v
+    return None
+
+
+def file_stats(path: pathlib.Path, columns: Sequence[str]) -> Dict[str, Any]:
+    """
+    {"rows": n, "stats": {col: [min, max] | None}} по футеру Parquet (данные не читаются).
+    None — статистик нет (колонка целиком пустая или не записана): такой файл по колонке не отсекается.
+    """
+    md = pq.read_metadata(path)
+    names = [md.schema.column(j).name for j in range(md.num_columns)]
+    stats: Dict[str, Optional[List[Any]]] = {}
+    for col in columns:
+        if col not in names:
+            stats[col] = None
+            continue
+        j = names.index(col)
+        lo = hi = None
+        known = True
+        for i in range(md.num_row_groups):
+            st = md.row_group(i).column(j).statistics
+            if st is None:
+                known = False
+                break
+            if not st.has_min_max:
+                if st.null_count == md.row_group(i).num_rows:
+                    continue   # row group без значений — границ не меняет
+                known = False
+                break
+            a, b = _stat_value(st.min), _stat_value(st.max)
+            if a is None or b is None:
+                known = False
+                break
+            lo = a if lo is None else min(lo, a)
+            hi = b if hi is None else max(hi, b)
+        stats[col] = [lo, hi] if known and lo is not None else None
+    return {"rows": md.num_rows, "stats": stats}
+
+
+class StatsIndex:
+    """Кэш file_stats по файлам датасета: JSONL-манифест, запись устаревает при смене размера/mtime файла."""
+
+    def __init__(self, dataset: str, root: Union[str, pathlib.Path] = STORE_ROOT):
+        self.dataset = dataset
+        self.root = pathlib.Path(root)
+        self.path = self.root / STATS_DIR / f"{dataset}.jsonl"
+        self.columns = STATS_COLUMNS.get(dataset, [])
+        self._lines = 0
+        self._entries: Optional[Dict[str, Dict[str, Any]]] = None
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._entries is None:
+            self._entries = load_manifest(self.path)
+            self._lines = sum(1 for _ in self.path.open(encoding="utf-8")) if self.path.exists() else 0
+        return self._entries
+
+    def get(self, files: Sequence[pathlib.Path]) -> Dict[pathlib.Path, Dict[str, Any]]:
+        """Статистики файлов; новые/изменившиеся считаются по футеру и дописываются в индекс."""
+        entries = self._load()
+        out: Dict[pathlib.Path, Dict[str, Any]] = {}
+        fresh: List[Dict[str, Any]] = []
+        for path in files:
+            st = path.stat()
+            key = path.relative_to(self.root).as_posix()
+            rec = entries.get(key)
+            if rec is None or rec["size"] != st.st_size or rec["mtime_ns"] != st.st_mtime_ns:
+                rec = {"key": key, "size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                       **file_stats(path, self.columns)}
+                entries[key] = rec
+                fresh.append(rec)
+            out[path] = rec
+        if fresh:
+            writer = ManifestWriter(self.path)
+            try:
+                for rec in fresh:
+                    writer.write(rec)
+            finally:
+                writer.close()
+            self._lines += len(fresh)
+            if self._lines > COMPACT_EVERY * len(entries):
+                self.compact()
+        return out
+
+    def compact(self) -> None:
+        """Переписывает индекс: по записи на файл, без записей удалённых файлов."""
+        entries = {k: r for k, r in self._load().items() if (self.root / k).exists()}
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        writer = ManifestWriter(tmp)
+        try:
+            for rec in entries.values():
+                writer.write(rec)
+        finally:
+            writer.close()
+        os.replace(tmp, self.path)
+        self._entries, self._lines = entries, len(entries)
+
+
+# ----------------- запрос -----------------
+def _bound(value: Optional[DateLike], is_end: bool) -> Optional[pd.Timestamp]:
+    """Граница интервала в TZ. Дата без времени: start — начало дня, end — конец дня (включительно)."""
+    if value is None:
+        return None
+    date_only = (isinstance(value, date) and not isinstance(value, datetime)) or \
+                (isinstance(value, str) and len(value.strip()) <= 10)
+    ts = pd.Timestamp(value)
+    ts = ts.tz_localize(TZ) if ts.tzinfo is None else ts.tz_convert(TZ)
+    if date_only and is_end:
+        ts = ts.normalize() + pd.Timedelta(days=1)
+    return ts
+
+
+def _as_list(values: Any) -> Optional[List[Any]]:
+    if values is None:
+        return None
+    return [values] if isinstance(values, (str, int)) else list(values)
+
+
+def _file_may_match(stats: Dict[str, Any], time_cols: List[str], lo: Optional[int], hi: Optional[int],
+                    hours: Optional[set], min_delay: Optional[float], max_delay: Optional[float]) -> bool:
+    """False — по min/max файла в нём точно нет подходящих строк."""
+    st = stats["stats"]
+    if not stats["rows"]:
+        return False
+    bounds = [st.get(c) for c in time_cols]
+    if bounds and all(b is not None for b in bounds):
+        t_min, t_max = min(b[0] for b in bounds), max(b[1] for b in bounds)
+        if (lo is not None and t_max < lo) or (hi is not None and t_min >= hi):
+            return False
+        if hours is not None:
+            a, b = pd.Timestamp(t_min, tz="UTC").tz_convert(TZ), pd.Timestamp(t_max, tz="UTC").tz_convert(TZ)
+            if a.date() == b.date() and not any(a.hour <= h <= b.hour for h in hours):
+                return False
+    d = st.get("delay_min")
+    if d is not None:
+        if (min_delay is not None and d[1] < min_delay) or (max_delay is not None and d[0] > max_delay):
+            return False
+    return True
+
+
+def _event_time_expr(time_cols: List[str]) -> pc.Expression:
+    fields = [pc.field(c) for c in time_cols]
+    return fields[0] if len(fields) == 1 else pc.coalesce(*fields)
+
+
+def _read(files: List[pathlib.Path], columns: Optional[List[str]], expr: Optional[pc.Expression]) -> pd.DataFrame:
+    """
+    Один скан pyarrow по всем файлам (схема — по первому) и одно to_pandas: в разы дешевле,
+    чем pd.read_parquet на файл. Несовместимые схемы (старые записи) — чтение по файлу.
+    """
+    if not files:
+        return pd.DataFrame(columns=columns or [])
+    try:
+        dataset = ds.dataset([str(f) for f in files], format="parquet", schema=pq.read_schema(files[0]))
+        return dataset.to_table(columns=columns, filter=expr).to_pandas()
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        frames = [pd.read_parquet(f, columns=columns, filters=expr) for f in files]
+        nonempty = [f for f in frames if not f.empty]
+        return pd.concat(nonempty, ignore_index=True) if nonempty else frames[0]
+
+
+def query(
+    dataset: str = "merged",
+    eva: Optional[Union[str, int, Iterable[Union[str, int]]]] = None,
+    start: Optional[DateLike] = None,
+    end: Optional[DateLike] = None,
+    last: Optional[Union[str, pd.Timedelta]] = None,
+    weekdays: Optional[Iterable[int]] = None,
+    hours: Optional[Iterable[int]] = None,
+    event: Optional[Union[str, Iterable[str]]] = None,
+    category: Optional[Union[str, Iterable[str]]] = None,
+    min_delay: Optional[float] = None,
+    max_delay: Optional[float] = None,
+    columns: Optional[List[str]] = None,
+    filters: Optional[List[Tuple[str, str, Any]]] = None,
+    root: Union[str, pathlib.Path] = STORE_ROOT,
+) -> pd.DataFrame:
+    """
+    Строки датасета, время события которых в [start, end) (end-дата без времени — включительно;
+    last="28D" — последние 28 дней до end или до сейчас), в дни недели weekdays (0 = пн) и
+    локальные часы hours, с событием event, категорией поезда category (tl_category),
+    delay_min в [min_delay, max_delay] и предикатами filters (как в store.read_dataset).
+    columns=None — все колонки файла.
+    """
+    hi_ts = _bound(end, is_end=True)
+    lo_ts = _bound(start, is_end=False)
+    if last is not None:
+        hi_ts = hi_ts if hi_ts is not None else pd.Timestamp.now(tz=TZ)
+        lo_ts = hi_ts - pd.Timedelta(last)
+    wd = set(_as_list(weekdays)) if weekdays is not None else None
+    hrs = set(_as_list(hours)) if hours is not None else None
+    time_cols = EVENT_TIME.get(dataset, [])
+    has_time_filter = lo_ts is not None or hi_ts is not None or wd is not None or hrs is not None
+
+    with metrics.stage("query", dataset=dataset) as st:
+        # 1. партиции: eva × даты × дни недели
+        d_from = lo_ts.date() if lo_ts is not None else None
+        d_to = (hi_ts - pd.Timedelta(microseconds=1)).date() if hi_ts is not None else None
+        parts = list_partitions(dataset, root, eva=eva, start=d_from, end=d_to)
+        if has_time_filter:
+            parts = [p for p in parts if p[1] != "unknown"]   # строки без времени под фильтр не попадают
+        if wd is not None:
+            parts = [p for p in parts if date.fromisoformat(p[1]).weekday() in wd]
+        files = [f for _, _, d in parts for f in partition_files(d)]
+
+        # 2. файлы: min/max из индекса статистик
+        stats = StatsIndex(dataset, root).get(files)
+        lo_ns = lo_ts.value if lo_ts is not None else None
+        hi_ns = hi_ts.value if hi_ts is not None else None
+        selected = [f for f in files
+                    if _file_may_match(stats[f], time_cols, lo_ns, hi_ns, hrs, min_delay, max_delay)]
+
+        # 3. предикаты для сканера pyarrow
+        conds: List[pc.Expression] = []
+        if has_time_filter and time_cols:
+            ev = _event_time_expr(time_cols)
+            if lo_ts is not None:
+                conds.append(ev >= pa.scalar(lo_ts.to_pydatetime(), type=pa.timestamp("us", tz=TZ)))
+            if hi_ts is not None:
+                conds.append(ev < pa.scalar(hi_ts.to_pydatetime(), type=pa.timestamp("us", tz=TZ)))
+            if wd is not None:
+                conds.append(pc.is_in(pc.day_of_week(ev), pa.array(sorted(wd), pa.int64())))
+            if hrs is not None:
+                conds.append(pc.is_in(pc.hour(ev), pa.array(sorted(hrs), pa.int64())))
+        if event is not None:
+            conds.append(pc.field("event").isin(_as_list(event)))
+        if category is not None:
+            conds.append(pc.field("tl_category").isin(_as_list(category)))
+        if min_delay is not None:
+            conds.append(pc.field("delay_min") >= min_delay)
+        if max_delay is not None:
+            conds.append(pc.field("delay_min") <= max_delay)
+        if filters:
+            conds.append(pq.filters_to_expression(filters))
+        expr = None
+        for c in conds:
+            expr = c if expr is None else expr & c
+
+        df = _read(selected, columns, expr)
+        st.set(rows=len(df), partitions=len(parts), files=len(files), files_read=len(selected))
+    return df
+
+
+def query_delays(
+    eva: Optional[Union[str, int, Iterable[Union[str, int]]]] = None,
+    start: Optional[DateLike] = None,
+    end: Optional[DateLike] = None,
+    event: Optional[Union[str, Iterable[str]]] = None,
+    columns: Optional[List[str]] = None,
+    **kw: Any,
+) -> pd.DataFrame:
+    """
+    Задержки из merged (вместо загрузки merged_with_delays.csv целиком). По умолчанию —
+    колонки DEFAULT_COLUMNS; остальные параметры — как у query (last, weekdays, hours, category,
+    min_delay, max_delay, filters, root).
+    """
+    return query("merged", eva=eva, start=start, end=end, event=event,
+                 columns=DEFAULT_COLUMNS if columns is None else columns, **kw)
+
+
+def _int_list(spec: Optional[str]) -> Optional[List[int]]:
+    """'7-9' | '0,5,6' → [7, 8, 9] | [0, 5, 6]."""
+    if spec is None:
+        return None
+    out: List[int] = []
+    for part in spec.split(","):
+        a, _, b = part.partition("-")
+        out.extend(range(int(a), int(b or a) + 1))
+    return sorted(set(out))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Запрос задержек по истории (merged) с отсечением партиций")
+    parser.add_argument("--store", default=str(STORE_ROOT))
+    parser.add_argument("--dataset", default="merged")
+    parser.add_argument("--eva", nargs="*", default=None)
+    parser.add_argument("--start", default=None, help="YYYY-MM-DD[ HH:MM]")
+    parser.add_argument("--end", default=None, help="YYYY-MM-DD[ HH:MM] (дата — включительно)")
+    parser.add_argument("--last", default=None, help="Окно до --end/сейчас: 28D, 12h, ...")
+    parser.add_argument("--weekdays", default=None, help="0 = пн: '0' | '0-4' | '5,6'")
+    parser.add_argument("--hours", default=None, help="Локальные часы: '7-9' | '7,17'")
+    parser.add_argument("--event", choices=["ar", "dp"], default=None)
+    parser.add_argument("--category", nargs="*", default=None, help="tl_category: ICE RE S ...")
+    parser.add_argument("--min-delay", type=float, default=None)
+    parser.add_argument("--columns", nargs="*", default=None)
+    parser.add_argument("--head", type=int, default=10, help="Сколько строк показать")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    res = query(args.dataset, eva=args.eva, start=args.start, end=args.end, last=args.last,
+                weekdays=_int_list(args.weekdays), hours=_int_list(args.hours), event=args.event,
+                category=args.category, min_delay=args.min_delay, root=args.store,
+                columns=args.columns or (DEFAULT_COLUMNS if args.dataset == "merged" else None))
+    dt = time.perf_counter() - t0
+    print(res.head(args.head).to_string(index=False))
+    if "delay_min" in res.columns and len(res):
+        d = res["delay_min"].astype("Float64")
+        print(f"\nЗадержка, мин: среднее {d.mean():.2f}, p50 {d.quantile(0.5):.0f}, p90 {d.quantile(0.9):.0f}, "
+              f"доля > 5 мин {(d > 5).mean():.1%}")
+    print(f"{len(res)} строк за {dt * 1000:.0f} мс")
@@ -0,0 +1,501 @@
+"""
+Отчёт по задержкам: метрики ноутбука (01_delays_eda) одним векторным проходом — таблицы и
+статичные графики в reports/figures/ без дисплея (matplotlib через объектный API Figure/Agg).
+
+Срезы: overall; by_event (ar/dp); by_peak; by_weekend; by_weekday_hour; top_stations,
+top_platforms (станция × платформа), top_lines. Метрики в каждой строке:
+  events (все события), n (с известной задержкой), mean, share_over_<T> (доля n с задержкой > T мин),
+  n_pos / mean_pos (опоздавшие, задержка > 0), p50/p90/p95.
+Топы — k групп с наибольшей rank_by среди групп с n ≥ min_events.
+
+Как считается (вместо groupby.apply и отдельных полных groupby в ноутбуке):
+1. один проход по строкам (_prepare): задержка → код значения (целые минуты — сдвигом),
+   время события → локальные час и день недели (арифметика по int64), строки → коды словаря pyarrow;
+2. срез — номер группы из кодов ключей и одна гистограмма «группа × значение задержки»
+   (np.bincount, как build_cube в rollup); метрики — именованные отношения сумм весов
+   (_named_aggs: гистограмма @ вес значения), без Python-функции на группу;
+3. перцентили — точные (как Series.quantile, линейная интерполяция) из той же гистограммы.
+   Если групп × значений больше MAX_HIST_CELLS — суммы весов по строкам, гистограмма только для топа.
+
+Запуск из корня репо:
+  python -m train_delays.report --last 28D                      # merged из data/processed
+  python -m train_delays.report --eva 8000152 --start 2025-10-01 --end 2025-10-31 --top 5
+  python -m train_delays.report --input data/processed/plan_parsed.csv
+"""
+from __future__ import annotations
+import argparse, pathlib, sys, time
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from train_delays import metrics
+from train_delays.features import DELAY_THRESHOLD_MIN, PEAK_HOURS, event_time, line_key
+from train_delays.store import STORE_ROOT, TZ
+
+FIGURES_DIR = pathlib.Path("reports/figures")
+# колонки merged, которые нужны отчёту (остальные с диска не читаются)
+REPORT_COLUMNS = ["station", "eva", "event", "planned_ts", "changed_ts", "delay_min",
+                  "line", "tl_category", "platform_planned", "platform_actual"]
+QUANTILES = (0.5, 0.9, 0.95)
+TOP_K = 10
+MIN_EVENTS = 20
+MAX_HIST_CELLS = 20_000_000   # группы × значения задержки в одной гистограмме среза (int64)
+
+# срез → ключи группировки (из _prepare)
+SLICES: Dict[str, List[str]] = {
+    "overall": [],
+    "by_event": ["event"],
+    "by_peak": ["is_peak"],
+    "by_weekend": ["is_weekend"],
+    "by_weekday_hour": ["weekday", "hour"],
+}
+TOPS: Dict[str, List[str]] = {
+    "top_stations": ["station"],
+    "top_platforms": ["station", "platform"],
+    "top_lines": ["line"],
+}
+WEEKDAYS = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+
+
+# ----------------- подготовка (один проход по строкам) -----------------
+Key = Tuple[np.ndarray, pd.Index]   # коды (-1 — нет значения) и подписи
+
+
+def _dictionary(values: Union[pd.Series, pa.Array], name: str) -> Key:
+    """Строки → коды: dictionary_encode в pyarrow (хэш, без сортировки строк); подписи — по алфавиту."""
+    arr = values if isinstance(values, (pa.Array, pa.ChunkedArray)) else pa.array(values.astype("string"))
+    enc = pc.dictionary_encode(arr)
+    if isinstance(enc, pa.ChunkedArray):
+        enc = enc.combine_chunks()
+    labels = np.asarray(enc.dictionary.to_pylist(), dtype=object)
+    order = np.argsort(labels)
+    remap = np.empty(len(order) + 1, dtype=np.int64)
+    remap[order] = np.arange(len(order))
+    remap[-1] = -1   # null → индекс -1 → код -1
+    codes = pc.fill_null(enc.indices, -1).to_numpy(zero_copy_only=False)
+    return remap[codes], pd.Index(labels[order], name=name)
+
+
+def _coalesce(df: pd.DataFrame, cols: Sequence[str]) -> Optional[pa.Array]:
+    """Первая непустая из имеющихся строковых колонок (None — ни одной нет)."""
+    arrays = [pa.array(df[c].astype("string"), type=pa.large_string()) for c in cols if c in df.columns]
+    if not arrays:
+        return None
+    return pc.coalesce(*arrays) if len(arrays) > 1 else arrays[0]
+
+
+def _line_codes(df: pd.DataFrame) -> Key:
+    """
+    Ключ features.line_key ('RE 2', иначе категория) без сборки строки на каждое событие:
+    коды пар (категория, линия), подписи — line_key только для встреченных пар.
+    """
+    cat, cat_labels = _dictionary(df["tl_category"], "tl_category")
+    line, line_labels = _dictionary(df["line"], "line")
+    width = len(line_labels) + 1
+    pair = (cat + 1) * width + (line + 1)   # 0 — пустое значение
+    seen = np.flatnonzero(np.bincount(pair, minlength=(len(cat_labels) + 1) * width))
+    c, l = np.divmod(seen, width)
+    pairs = pd.DataFrame({
+        "tl_category": pd.array(np.where(c > 0, cat_labels.to_numpy()[c - 1], None), dtype="string"),
+        "line": pd.array(np.where(l > 0, line_labels.to_numpy()[l - 1], None), dtype="string"),
+    })
+    codes, labels = pd.factorize(line_key(pairs), sort=True)
+    lookup = np.full(len(cat_labels) * width + width, -1, dtype=np.int64)
+    lookup[seen] = codes
+    return lookup[pair], pd.Index(np.asarray(labels, dtype=object), name="line")
+
+
+def _prepare(df: pd.DataFrame) -> Tuple[np.ndarray, Dict[str, Key]]:
+    """
+    Один проход по строкам → (задержка float64, NaN — неизвестна; ключи). Ключи — целые коды:
+    event, station, platform, line (словарь pyarrow), weekday, hour, is_peak, is_weekend.
+    """
+    d = df["delay_min"].to_numpy(dtype="float64", na_value=np.nan)
+
+    # локальное время → минуты от эпохи; час и день недели — целочисленно (1970-01-01 — четверг)
+    ts = event_time(df)
+    if ts.dt.tz is not None:
+        ts = ts.dt.tz_localize(None)
+    minutes = ts.to_numpy(dtype="datetime64[m]")
+    valid = ~np.isnat(minutes)
+    m = minutes.astype(np.int64)
+    hour = np.where(valid, (m // 60) % 24, -1)
+    weekday = np.where(valid, (m // 1440 + 3) % 7, -1)
+    peak = np.zeros(len(df), dtype=np.int64)
+    for a, b in PEAK_HOURS:
+        peak |= (hour >= a) & (hour <= b)
+    flags = pd.Index([False, True])
+    keys: Dict[str, Key] = {
+        "weekday": (weekday, pd.RangeIndex(7, name="weekday")),
+        "hour": (hour, pd.RangeIndex(24, name="hour")),
+        "is_peak": (peak, flags.rename("is_peak")),
+        "is_weekend": ((weekday >= 5).astype(np.int64), flags.rename("is_weekend")),
+    }
+    if "event" in df.columns:
+        keys["event"] = _dictionary(df["event"], "event")
+    station = _coalesce(df, ["station", "eva"])
+    if station is not None:
+        keys["station"] = _dictionary(station, "station")
+        platform = _coalesce(df, ["platform_actual", "platform_planned", "platform"])
+        if platform is not None:
+            keys["platform"] = _dictionary(platform, "platform")
+    if "line" in df.columns and "tl_category" in df.columns:
+        keys["line"] = _line_codes(df)
+    return d, keys
+
+
+def _value_codes(d: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Задержки → (код на строку: 0 — задержка неизвестна, i + 1 — значение values[i]; values по
+    возрастанию). Целые минуты кодируются сдвигом, без сортировки.
+    """
+    has = ~np.isnan(d)
+    x = d[has]
+    if not len(x):
+        return np.zeros(len(d), dtype=np.int64), np.empty(0)
+    lo, hi = x.min(), x.max()
+    if hi - lo < 100_000 and np.array_equal(x, np.round(x)):
+        return np.where(has, d - lo + 1, 0).astype(np.int64), np.arange(lo, hi + 1)
+    values, inverse = np.unique(x, return_inverse=True)
+    codes = np.zeros(len(d), dtype=np.int64)
+    codes[has] = inverse + 1
+    return codes, values
+
+
+# ----------------- агрегаты -----------------
+def _value_weights(values: np.ndarray, threshold_min: int) -> Dict[str, np.ndarray]:
+    """
+    Веса по коду значения (индекс 0 — задержка неизвестна): сумма веса по группе =
+    гистограмма группы @ вес. has — известна, over — больше порога, pos — больше нуля.
+    """
+    v = np.concatenate(([0.0], values))
+    has = np.concatenate(([0.0], np.ones(len(values))))
+    return {
+        "has": has,
+        "delay": v,
+        "over": has * (v > threshold_min),
+        "pos": has * (v > 0),
+        "delay_pos": np.where(v > 0, v, 0.0),
+    }
+
+
+def _named_aggs(threshold_min: int) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+    """
+    Метрика → (вес-числитель, вес-знаменатель) из _value_weights: сумма числителя по группе,
+    делённая на сумму знаменателя (None — без деления; числитель None — число строк).
+    """
+    return {
+        "events": (None, None),
+        "n": ("has", None),
+        "mean": ("delay", "has"),
+        f"share_over_{threshold_min}": ("over", "has"),
+        "n_pos": ("pos", None),
+        "mean_pos": ("delay_pos", "pos"),
+    }
+
+
+def _cells(keys: Dict[str, Key], names: List[str], n_rows: int, width: int) -> Tuple[np.ndarray, pd.Index]:
+    """
+    Ключи среза → номер группы на строку (-1 — у строки нет какого-то ключа) и индекс групп
+    по возрастанию кодов (как groupby(sort=True)). Если все сочетания × width значений
+    помещаются в MAX_HIST_CELLS — группы плотные (пустые отбросит _slice), иначе — только встреченные.
+    """
+    if not names:
+        return np.zeros(n_rows, dtype=np.int64), pd.Index(["all"])
+    gid = np.zeros(n_rows, dtype=np.int64)
+    missing = np.zeros(n_rows, dtype=bool)
+    sizes = []
+    for name in names:
+        codes, labels = keys[name]
+        gid = gid * len(labels) + codes
+        missing |= codes < 0
+        sizes.append(len(labels))
+    n_cells = int(np.prod(sizes))
+    if n_cells * width <= MAX_HIST_CELLS:
+        gid[missing] = -1
+        labels = [keys[name][1] for name in names]
+        return gid, (pd.MultiIndex.from_product(labels) if len(names) > 1 else labels[0])
+    if n_cells <= max(n_rows, 1 << 20):
+        seen = np.flatnonzero(np.bincount(gid[~missing], minlength=n_cells))
+        lookup = np.full(n_cells, -1, dtype=np.int64)
+        lookup[seen] = np.arange(len(seen))
+        gid = np.where(missing, -1, lookup[np.where(missing, 0, gid)])
+    else:   # очень разреженное произведение словарей — уплотняем сортировкой
+        seen, inverse = np.unique(gid[~missing], return_inverse=True)
+        gid[~missing] = inverse
+        gid[missing] = -1
+    parts = np.unravel_index(seen, sizes)
+    arrays = [keys[name][1][p] for name, p in zip(names, parts)]
+    return gid, (pd.MultiIndex.from_arrays(arrays) if len(names) > 1 else arrays[0])
+
+
+def _hist(gid: np.ndarray, n_groups: int, vcode: np.ndarray, width: int) -> np.ndarray:
+    """Гистограмма группа × код значения одним np.bincount (строки с gid = -1 — в отбрасываемую группу)."""
+    slot = np.where(gid >= 0, gid, n_groups) * width + vcode
+    return np.bincount(slot, minlength=(n_groups + 1) * width).reshape(n_groups + 1, width)[:n_groups]
+
+
+def _hist_quantiles(hist: np.ndarray, values: np.ndarray, qs: Sequence[float]) -> Dict[str, np.ndarray]:
+    """
+    Точные перцентили по строкам гистограммы значений (линейная интерполяция между соседними
+    рангами, как Series.quantile): значение ранга r — первое, где накопленная частота > r.
+    """
+    nv = len(values)
+    cum = np.cumsum(hist, axis=1)
+    total = cum[:, -1] if nv else np.zeros(len(hist), dtype=np.int64)
+    last = np.maximum(total - 1, 0)
+    out: Dict[str, np.ndarray] = {}
+    for q in qs:
+        h = last * q
+        r = np.floor(h)
+        i_lo = np.minimum((cum <= r[:, None]).sum(axis=1), max(nv - 1, 0))
+        i_hi = np.minimum((cum <= np.minimum(r + 1, last)[:, None]).sum(axis=1), max(nv - 1, 0))
+        v = values[i_lo] + (h - r) * (values[i_hi] - values[i_lo]) if nv else np.full(len(hist), np.nan)
+        out[f"p{int(round(q * 100))}"] = np.where(total > 0, v, np.nan)
+    return out
+
+
+def _slice(keys: Dict[str, Key], names: List[str], vcode: np.ndarray, values: np.ndarray,
+           weights: Dict[str, np.ndarray], aggs: Dict[str, Tuple[Optional[str], Optional[str]]],
+           qs: Sequence[float], top_k: Optional[int] = None, rank_by: str = "mean_pos",
+           min_events: int = MIN_EVENTS) -> pd.DataFrame:
+    """
+    Один срез. Обычно — одна гистограмма группа × значение (np.bincount по строкам), из неё и
+    метрики (гистограмма @ веса), и перцентили. Если групп × значений больше MAX_HIST_CELLS —
+    метрики через np.bincount по каждому весу, гистограмма — только для отобранных групп.
+    """
+    width = len(values) + 1
+    gid, index = _cells(keys, names, len(vcode), width)
+    n_groups = len(index)
+    cols = [c for c in weights if any(c in pair for pair in aggs.values())]
+    hist: Optional[np.ndarray] = None
+    if n_groups * width <= MAX_HIST_CELLS:
+        hist = _hist(gid, n_groups, vcode, width)
+        sums = {None: hist.sum(axis=1), **dict(zip(cols, (hist @ np.column_stack([weights[c] for c in cols])).T))}
+    else:
+        slot = np.where(gid >= 0, gid, n_groups)
+        sums = {None: np.bincount(slot, minlength=n_groups + 1)[:n_groups]}
+        for c in cols:
+            sums[c] = np.bincount(slot, weights=weights[c][vcode], minlength=n_groups + 1)[:n_groups]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        res = pd.DataFrame({name: sums[num] / sums[den] if den else sums[num]
+                            for name, (num, den) in aggs.items()}, index=index)
+    res[["events", "n", "n_pos"]] = res[["events", "n", "n_pos"]].astype(np.int64)
+
+    rows = np.flatnonzero(res["events"].to_numpy() > 0) if names else np.arange(n_groups)
+    if top_k is not None:
+        rows = rows[res["n"].to_numpy()[rows] >= min_events]
+        if rank_by in res.columns:
+            ranked = np.nan_to_num(res[rank_by].to_numpy(dtype=np.float64)[rows], nan=-np.inf)
+            rows = rows[np.argsort(-ranked, kind="stable")[:top_k]]
+    res = res.iloc[rows]
+    if hist is not None:
+        hist = hist[rows]
+    elif len(rows) * width <= MAX_HIST_CELLS:
+        lookup = np.full(n_groups + 1, -1, dtype=np.int64)   # + слот для gid = -1
+        lookup[rows] = np.arange(len(rows))
+        hist = _hist(lookup[gid], len(rows), vcode, width)
+    if hist is not None:
+        quant = _hist_quantiles(hist[:, 1:], values, qs)
+    else:   # много групп и разных (нецелых) значений: сортирующий квантиль pandas, без Python на группу
+        lookup = np.full(n_groups + 1, -1, dtype=np.int64)
+        lookup[rows] = np.arange(len(rows))
+        g = lookup[gid]
+        ok = (g >= 0) & (vcode > 0)
+        qdf = pd.Series(values[vcode[ok] - 1]).groupby(g[ok]).quantile(list(qs)).unstack()
+        qdf = qdf.reindex(range(len(rows)))
+        quant = {f"p{int(round(q * 100))}": qdf[q].to_numpy() for q in qs}
+    for name, v in quant.items():
+        res[name] = v
+    if top_k is not None and rank_by not in aggs:   # топ по перцентилю — после их расчёта
+        res = res.sort_values(rank_by, ascending=False, kind="stable").head(top_k)
+    return res
+
+
+def compute_report(
+    df: pd.DataFrame,
+    threshold_min: int = DELAY_THRESHOLD_MIN,
+    quantiles: Sequence[float] = QUANTILES,
+    top_k: int = TOP_K,
+    min_events: int = MIN_EVENTS,
+    rank_by: str = "mean_pos",
+) -> Dict[str, pd.DataFrame]:
+    """
+    merged (или plan_parsed ноутбука: platform вместо platform_actual, без line — нет top_lines)
+    → {срез: таблица}, плюс delay_hist (значение задержки → число событий) для гистограммы.
+    rank_by — метрика топов: mean_pos, mean, share_over_<T>, p90, ...
+    """
+    with metrics.stage("report", step="compute") as st:
+        d, keys = _prepare(df)
+        vcode, values = _value_codes(d)
+        weights = _value_weights(values, threshold_min)
+        aggs = _named_aggs(threshold_min)
+        out: Dict[str, pd.DataFrame] = {}
+        for name, names in SLICES.items():
+            if all(k in keys for k in names):
+                out[name] = _slice(keys, names, vcode, values, weights, aggs, quantiles)
+        for name, names in TOPS.items():
+            if all(k in keys for k in names):
+                out[name] = _slice(keys, names, vcode, values, weights, aggs, quantiles,
+                                   top_k=top_k, rank_by=rank_by, min_events=min_events)
+        counts = np.bincount(vcode, minlength=len(values) + 1)[1:]
+        out["delay_hist"] = pd.DataFrame({"delay_min": values, "events": counts}).set_index("delay_min")
+        st.set(rows=len(df))
+    return out
+
+
+# ----------------- запись -----------------
+def _bar(path: pathlib.Path, labels: Sequence[Any], values: Sequence[float], title: str,
+         xlabel: str, ylabel: str, horizontal: bool = False) -> pathlib.Path:
+    from matplotlib.figure import Figure   # без pyplot: фигура рисуется через Agg, дисплей не нужен
+
+    fig = Figure(figsize=(8, max(3.0, 0.35 * len(labels) + 1.5)) if horizontal else (8, 4.5), layout="tight")
+    ax = fig.add_subplot()
+    if horizontal:
+        ax.barh(list(labels)[::-1], list(values)[::-1])
+    else:
+        ax.bar(list(labels), list(values))
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    fig.savefig(path, dpi=120)
+    return path
+
+
+def _label(index: pd.Index) -> List[str]:
+    return [" / ".join(map(str, v)) if isinstance(v, tuple) else str(v) for v in index]
+
+
+def save_figures(report: Dict[str, pd.DataFrame], out_dir: Union[str, pathlib.Path] = FIGURES_DIR,
+                 threshold_min: int = DELAY_THRESHOLD_MIN, rank_by: str = "mean_pos") -> List[pathlib.Path]:
+    """Графики ноутбука (гистограмма, ar/dp, теплокарта день × час) и топов → PNG в out_dir."""
+    from matplotlib.figure import Figure
+
+    out_dir = pathlib.Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths: List[pathlib.Path] = []
+
+    hist = report["delay_hist"]
+    if len(hist):
+        # хвост после p99 сжимает основную массу в одну полосу — показываем до p99
+        cum = hist["events"].cumsum() / max(int(hist["events"].sum()), 1)
+        hist = hist[hist.index <= hist.index[min(int(np.searchsorted(cum.to_numpy(), 0.99)), len(hist) - 1)]]
+        paths.append(_bar(out_dir / "delay_hist.png", hist.index.to_numpy(), hist["events"],
+                          "Распределение задержек поезда (до p99)", "Задержка (мин.)", "Количество событий"))
+    if "by_event" in report:
+        t = report["by_event"]
+        paths.append(_bar(out_dir / "mean_by_event.png", _label(t.index), t["mean"],
+                          "Средняя задержка по типу события", "Событие (ar=прибытие, dp=отправление)",
+                          "Средняя задержка (минуты)"))
+    share = f"share_over_{threshold_min}"
+    for name, title in (("by_peak", "Пик"), ("by_weekend", "Выходной")):
+        t = report[name]
+        paths.append(_bar(out_dir / f"{name}.png", [f"{title}: {'да' if v else 'нет'}" for v in t.index],
+                          t[share], f"Доля задержек > {threshold_min} мин", "", "Доля"))
+
+    t = report["by_weekday_hour"]
+    if len(t):
+        grid = t["mean"].unstack("hour").reindex(index=range(7), columns=range(24))
+        fig = Figure(figsize=(10, 5), layout="tight")
+        ax = fig.add_subplot()
+        im = ax.imshow(grid.to_numpy(dtype=np.float64), aspect="auto", cmap="magma_r")
+        fig.colorbar(im, ax=ax, label="мин")
+        ax.set_xticks(range(24))
+        ax.set_yticks(range(7), WEEKDAYS)
+        ax.set_title("Средняя задержка (мин) по дню недели и часу")
+        ax.set_xlabel("Час")
+        ax.set_ylabel("День недели")
+        fig.savefig(out_dir / "weekday_hour_mean.png", dpi=120)
+        paths.append(out_dir / "weekday_hour_mean.png")
+
+    for name, what in (("top_stations", "станций"), ("top_platforms", "платформ"), ("top_lines", "линий")):
+        t = report.get(name)
+        if t is None or not len(t):
+            continue
+        paths.append(_bar(out_dir / f"{name}.png", _label(t.index), t[rank_by],
+                          f"Топ-{len(t)} {what} по {rank_by}", rank_by, "", horizontal=True))
+    return paths
+
+
+def write_report(report: Dict[str, pd.DataFrame], out_dir: Union[str, pathlib.Path] = FIGURES_DIR,
+                 threshold_min: int = DELAY_THRESHOLD_MIN, rank_by: str = "mean_pos") -> List[pathlib.Path]:
+    """Таблицы (<срез>.csv) и графики (*.png) в out_dir; возвращает записанные пути."""
+    out_dir = pathlib.Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    with metrics.stage("report", step="write") as st:
+        paths = []
+        for name, table in report.items():
+            path = out_dir / f"{name}.csv"
+            table.to_csv(path)
+            paths.append(path)
+        paths += save_figures(report, out_dir, threshold_min, rank_by)
+        st.set(files=len(paths))
+    return paths
+
+
+def load_events(input_path: Optional[Union[str, pathlib.Path]] = None, **query_kw: Any) -> pd.DataFrame:
+    """
+    События для отчёта: файл (.csv ноутбука или .parquet) либо merged из хранилища через
+    query.query (eva, start, end, last, weekdays, hours, event, category, root) — только REPORT_COLUMNS.
+    """
+    if input_path is None:
+        from train_delays.query import query
+        return query("merged", columns=REPORT_COLUMNS, **query_kw)
+    path = pathlib.Path(input_path)
+    if path.suffix == ".csv":
+        df = pd.read_csv(path)
+        for col in ("planned_ts", "changed_ts"):
+            if col in df.columns:
+                try:
+                    df[col] = pd.to_datetime(df[col], format="ISO8601")
+                except ValueError:   # смещения +01:00/+02:00 по разные стороны перехода на летнее время
+                    df[col] = pd.to_datetime(df[col], format="ISO8601", utc=True).dt.tz_convert(TZ)
+        return df
+    names = pq.read_schema(path).names
+    return pd.read_parquet(path, columns=[c for c in REPORT_COLUMNS + ["platform"] if c in names])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Отчёт по задержкам: таблицы и графики в reports/figures")
+    parser.add_argument("--input", default=None, help="CSV/Parquet с событиями (иначе merged из --store)")
+    parser.add_argument("--store", default=str(STORE_ROOT))
+    parser.add_argument("--eva", nargs="*", default=None)
+    parser.add_argument("--start", default=None, help="YYYY-MM-DD[ HH:MM]")
+    parser.add_argument("--end", default=None, help="YYYY-MM-DD[ HH:MM] (дата — включительно)")
+    parser.add_argument("--last", default=None, help="Окно до --end/сейчас: 28D, 12h, ...")
+    parser.add_argument("--event", choices=["ar", "dp"], default=None)
+    parser.add_argument("--out", default=str(FIGURES_DIR))
+    parser.add_argument("--threshold-min", type=int, default=DELAY_THRESHOLD_MIN, help="Порог «опоздал», мин")
+    parser.add_argument("--top", type=int, default=TOP_K, help="Размер топов станций/платформ/линий")
+    parser.add_argument("--min-events", type=int, default=MIN_EVENTS, help="Минимум событий с задержкой в группе топа")
+    parser.add_argument("--rank-by", default="mean_pos", help="Метрика топов: mean_pos, mean, share_over_<T>, p90")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    if args.input:
+        events = load_events(args.input)
+    else:
+        events = load_events(eva=args.eva, start=args.start, end=args.end, last=args.last,
+                             event=args.event, root=args.store)
+    if events.empty:
+        print("Нет событий за выбранный период — отчёт не строится")
+        sys.exit(0)
+    t1 = time.perf_counter()
+    report = compute_report(events, threshold_min=args.threshold_min, top_k=args.top,
+                            min_events=args.min_events, rank_by=args.rank_by)
+    t2 = time.perf_counter()
+    paths = write_report(report, args.out, args.threshold_min, args.rank_by)
+    t3 = time.perf_counter()
+
+    total = report["overall"].iloc[0]
+    print(f"Всего событий: {int(total['events'])}")
+    print(f"Доля задержек >{args.threshold_min} мин: {total[f'share_over_{args.threshold_min}']:.2%}")
+    print(f"Средняя задержка среди опоздавших: {total['mean_pos']:.1f} мин")
+    for name in ("by_peak", "by_weekend"):
+        print(f"\n{name}:\n{report[name].round(3).to_string()}")
+    print(f"\nФайлов: {len(paths)} в {args.out}; чтение {t1 - t0:.1f} с, расчёт {t2 - t1:.1f} с, "
+          f"запись {t3 - t2:.1f} с")
@@ -0,0 +1,335 @@
+"""
+Предагрегированный куб задержек для дашбордов: станция × линия × день недели × час × событие.
+
+В каждой ячейке — только аддитивные меры, поэтому ячейки складываются в любой срез:
+  events (все события), n (с известной задержкой), sum, sumsq, n_pos/sum_pos (задержка > 0),
+  over_<T> (задержка > T мин для T из THRESHOLDS) и гистограмма h00..hNN по HIST_EDGES —
+  сливаемый скетч распределения: перцентили восстанавливаются из суммы гистограмм
+  (для целых минут в диапазоне -5…60 — точно, дальше — линейно внутри корзины).
+
+Хранение (корень — data/processed/rollup):
+  parts/<eva>_<date>.parquet   # вклад одной merged-партиции (для вычитания при её пересчёте)
+  cube.parquet                 # сумма всех вкладов
+  _manifest.jsonl              # отпечатки merged-партиций, уже учтённых в кубе
+
+update_rollup() сворачивает только новые/изменённые merged-партиции: cube += new − old;
+вклад исчезнувших из merged партиций вычитается, а сами они помечаются в манифесте как removed.
+query() отвечает на вопросы дашборда по кубу (тысячи строк), не трогая сырые события.
+
+Запуск из корня репо:
+  python -m train_delays.rollup update --workers 8
+  python -m train_delays.rollup query --by weekday hour --eva 8000152
+  python -m train_delays.rollup query --by is_peak --metrics mean share_over_5 p90
+"""
+from __future__ import annotations
+import argparse, os, pathlib, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from train_delays.features import PEAK_HOURS, event_time, line_key
+from train_delays.manifest import ManifestWriter, load_manifest
+from train_delays.store import STORE_ROOT, list_partitions, partition_signature, read_partition
+
+ROLLUP_DIR = "rollup"
+CUBE_NAME = "cube.parquet"
+MANIFEST_NAME = "_manifest.jsonl"
+
+DIMS = ["eva", "line", "category", "weekday", "hour", "event"]
+THRESHOLDS = (0, 5, 15)
+# границы корзин гистограммы (мин): поминутно до часа, дальше крупнее; + корзины < первой и ≥ последней
+HIST_EDGES = np.array(list(range(-5, 61)) + [75, 90, 120, 180], dtype=np.float64)
+HIST_BINS = len(HIST_EDGES) + 1
+HIST_COLUMNS = [f"h{i:02d}" for i in range(HIST_BINS)]
+MEASURES = (["events", "n", "sum", "sumsq", "n_pos", "sum_pos"]
+            + [f"over_{t}" for t in THRESHOLDS] + HIST_COLUMNS)
+
+# производные измерения: считаются из hour/weekday во время запроса
+DERIVED_DIMS = {
+    "is_peak": lambda c: np.logical_or.reduce([c["hour"].between(a, b).to_numpy(dtype=bool, na_value=False)
+                                               for a, b in PEAK_HOURS]),
+    "is_weekend": lambda c: (c["weekday"] >= 5).to_numpy(dtype=bool, na_value=False),
+}
+MERGED_COLUMNS = ["eva", "event", "planned_ts", "changed_ts", "delay_min", "line", "tl_category"]
+
+
+def rollup_root(root: Union[str, pathlib.Path] = STORE_ROOT) -> pathlib.Path:
+    return pathlib.Path(root) / ROLLUP_DIR
+
+
+# ----------------- построение -----------------
+def build_cube(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    merged (любая выборка) → ячейки куба. Один groupby на коды измерений; гистограмма —
+    np.bincount по (ячейка, корзина), без цикла по группам.
+    """
+    if df.empty:
+        return pd.DataFrame(columns=DIMS + MEASURES)
+    ts = event_time(df)
+    dims = pd.DataFrame({
+        "eva": df["eva"].astype("string"),
+        "line": line_key(df),
+        "category": df["tl_category"].astype("string"),
+        "weekday": ts.dt.dayofweek.astype("Int8"),
+        "hour": ts.dt.hour.astype("Int8"),
+        "event": df["event"].astype("string"),
+    })
+    cell = dims.groupby(DIMS, dropna=False, sort=False).ngroup().to_numpy()
+    n_cells = int(cell.max()) + 1 if len(cell) else 0
+
+    d = df["delay_min"].to_numpy(dtype="float64", na_value=np.nan)
+    has = ~np.isnan(d)
+    dz = np.where(has, d, 0.0)
+    pos = has & (d > 0)
+
+    def _sum(weights: np.ndarray) -> np.ndarray:
+        return np.bincount(cell, weights=weights, minlength=n_cells)
+
+    out = dims.drop_duplicates().copy()
+    # порядок ячеек: ngroup(sort=False) нумерует группы в порядке первого появления — как drop_duplicates
+    out = out.reset_index(drop=True)
+    measures: Dict[str, np.ndarray] = {
+        "events": np.bincount(cell, minlength=n_cells),
+        "n": _sum(has.astype(np.float64)),
+        "sum": _sum(dz),
+        "sumsq": _sum(dz * dz),
+        "n_pos": _sum(pos.astype(np.float64)),
+        "sum_pos": _sum(np.where(pos, d, 0.0)),
+    }
+    for t in THRESHOLDS:
+        measures[f"over_{t}"] = _sum((has & (d > t)).astype(np.float64))
+    bins = np.searchsorted(HIST_EDGES, d[has], side="right")   # 0 — меньше первой границы
+    hist = np.bincount(cell[has] * HIST_BINS + bins, minlength=n_cells * HIST_BINS).reshape(n_cells, HIST_BINS)
+    for col, values in measures.items():
+        out[col] = values.astype(np.float64 if col in ("sum", "sumsq", "sum_pos") else np.int64)
+    out[HIST_COLUMNS] = hist.astype(np.int64)
+    return out
+
+
+def fold(cube: pd.DataFrame, part: pd.DataFrame, sign: int = 1) -> pd.DataFrame:
+    """cube ± part по ячейкам; пустые ячейки (events == 0) выбрасываются."""
+    if part.empty:
+        return cube
+    part = part.copy()
+    part[MEASURES] = part[MEASURES] * sign
+    both = pd.concat([cube, part], ignore_index=True) if not cube.empty else part
+    out = both.groupby(DIMS, dropna=False, sort=False, as_index=False)[MEASURES].sum()
+    return out[out["events"] != 0].reset_index(drop=True)
+
+
+# ----------------- инкрементальное обновление -----------------
+def _part_path(rroot: pathlib.Path, eva: str, day: str) -> pathlib.Path:
+    return rroot / "parts" / f"{eva}_{day}.parquet"
+
+
+def _build_part(eva: str, day: str, root: str) -> Tuple[str, str, int]:
+    """Воркер: вклад одной merged-партиции → parts/<eva>_<day>.parquet (атомарно)."""
+    merged = read_partition("merged", eva, day, root, columns=MERGED_COLUMNS)
+    part = build_cube(merged)
+    path = _part_path(rollup_root(root), eva, day)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    part.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+    return eva, day, int(len(merged))
+
+
+def _read_part(path: pathlib.Path) -> pd.DataFrame:
+    return pd.read_parquet(path) if path.exists() else pd.DataFrame(columns=DIMS + MEASURES)
+
+
+def update_rollup(
+    root: Union[str, pathlib.Path] = STORE_ROOT,
+    workers: Optional[int] = None,
+    full: bool = False,
+) -> Dict[str, int]:
+    """
+    Сворачивает новые/изменённые merged-партиции в куб: cube = cube − старый вклад + новый.
+    Партиции, которых больше нет в merged, вычитаются из куба и уходят из манифеста.
+    full=True — собрать куб заново из всех партиций.
+    Возвращает {"partitions", "folded", "removed", "rows", "cells"}.
+    """
+    root = pathlib.Path(root)
+    rroot = rollup_root(root)
+    manifest_path = rroot / MANIFEST_NAME
+    cube_path = rroot / CUBE_NAME
+    seen = {} if full else {k: rec for k, rec in load_manifest(manifest_path).items()
+                            if rec.get("status") != "removed"}
+
+    parts = list_partitions("merged", root)
+    sigs = {(e, d): partition_signature(p) for e, d, p in parts}
+    todo = [(e, d) for (e, d), sig in sigs.items() if seen.get(f"{e}/{d}", {}).get("signature") != sig]
+    gone = [tuple(k.split("/", 1)) for k in seen if tuple(k.split("/", 1)) not in sigs]
+    cube = pd.DataFrame(columns=DIMS + MEASURES) if full else _read_part(cube_path)
+    counts = {"partitions": len(parts), "folded": len(todo), "removed": len(gone), "rows": 0,
+              "cells": int(len(cube))}
+    if not todo and not gone and not full:
+        return counts
+
+    # старые вклады вычитаем до того, как воркеры перезапишут их файлы
+    old = [_read_part(_part_path(rroot, e, d)) for e, d in todo + gone if not full and f"{e}/{d}" in seen]
+    for part in old:
+        cube = fold(cube, part, sign=-1)
+
+    workers = workers or os.cpu_count() or 1
+    done: List[Tuple[str, str]] = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_build_part, e, d, str(root)) for e, d in todo]
+        new_parts = []
+        for fut in as_completed(futures):
+            eva, day, rows = fut.result()
+            counts["rows"] += rows
+            done.append((eva, day))
+            new_parts.append(_read_part(_part_path(rroot, eva, day)))
+    if new_parts:
+        cube = fold(cube, pd.concat(new_parts, ignore_index=True))
+
+    rroot.mkdir(parents=True, exist_ok=True)
+    tmp = cube_path.with_name(f".{CUBE_NAME}.{os.getpid()}.tmp")
+    cube.to_parquet(tmp, index=False)
+    os.replace(tmp, cube_path)
+    if full and manifest_path.exists():
+        manifest_path.unlink()
+    # вклады исчезнувших партиций — после куба: без файла повторный прогон вычтет пустоту, а не дважды
+    if full:
+        live = {_part_path(rroot, e, d) for e, d in sigs}
+        stale = [p for p in (rroot / "parts").glob("*.parquet") if p not in live]
+    else:
+        stale = [_part_path(rroot, e, d) for e, d in gone]
+    for path in stale:
+        path.unlink(missing_ok=True)
+    # манифест — после куба: при падении посередине партиции просто свернутся заново
+    stamp = datetime.now().isoformat(timespec="seconds")
+    with ManifestWriter(manifest_path) as writer:
+        for eva, day in done:
+            writer.write({"key": f"{eva}/{day}", "signature": sigs[(eva, day)], "folded_at": stamp})
+        for eva, day in gone:
+            writer.write({"key": f"{eva}/{day}", "status": "removed", "folded_at": stamp})
+    _CACHE.pop(str(cube_path), None)
+    counts["cells"] = int(len(cube))
+    return counts
+
+
+# ----------------- запросы -----------------
+_CACHE: Dict[str, Tuple[int, pd.DataFrame]] = {}
+
+
+def load_cube(root: Union[str, pathlib.Path] = STORE_ROOT) -> pd.DataFrame:
+    """Куб из cube.parquet; в процессе кэшируется до изменения файла (mtime)."""
+    path = rollup_root(root) / CUBE_NAME
+    if not path.exists():
+        raise FileNotFoundError(f"Нет куба {path}. Сначала запусти: python -m train_delays.rollup update")
+    mtime = path.stat().st_mtime_ns
+    hit = _CACHE.get(str(path))
+    if hit is None or hit[0] != mtime:
+        hit = (mtime, pd.read_parquet(path))
+        _CACHE[str(path)] = hit
+    return hit[1]
+
+
+def _hist_quantiles(hist: np.ndarray, qs: Sequence[float]) -> Dict[str, np.ndarray]:
+    """Перцентили по строкам матрицы гистограмм (линейно внутри корзины)."""
+    lo = np.concatenate(([HIST_EDGES[0]], HIST_EDGES))           # корзина 0 (< первой границы) → первая граница
+    hi = np.concatenate((HIST_EDGES, [HIST_EDGES[-1]]))          # последняя (≥ последней) → последняя граница
+    width = hi - lo
+    cum = np.cumsum(hist, axis=1)
+    total = cum[:, -1]
+    out: Dict[str, np.ndarray] = {}
+    for q in qs:
+        target = q * total
+        idx = np.minimum((cum < target[:, None]).sum(axis=1), HIST_BINS - 1)
+        rows = np.arange(len(hist))
+        before = np.where(idx > 0, cum[rows, np.maximum(idx - 1, 0)], 0)
+        in_bin = hist[rows, idx]
+        frac = np.where(in_bin > 0, (target - before) / np.where(in_bin > 0, in_bin, 1), 0.0)
+        # целые минуты в поминутной корзине [k, k+1) — это ровно k
+        value = np.where(width[idx] <= 1, lo[idx], lo[idx] + frac * width[idx])
+        out[f"p{int(round(q * 100))}"] = np.where(total > 0, value, np.nan)
+    return out
+
+
+def query(
+    by: Sequence[str] = (),
+    eva: Optional[Union[str, Iterable[str]]] = None,
+    line: Optional[Union[str, Iterable[str]]] = None,
+    category: Optional[Union[str, Iterable[str]]] = None,
+    event: Optional[str] = None,
+    weekdays: Optional[Iterable[int]] = None,
+    hours: Optional[Iterable[int]] = None,
+    quantiles: Sequence[float] = (0.5, 0.9, 0.95),
+    cube: Optional[pd.DataFrame] = None,
+    root: Union[str, pathlib.Path] = STORE_ROOT,
+) -> pd.DataFrame:
+    """
+    Срез куба: фильтры по измерениям, группировка по by (любые из DIMS и is_peak/is_weekend).
+    Колонки: events, n, mean, std, mean_pos, share_over_<T>, p50/p90/p95.
+    """
+    c = cube if cube is not None else load_cube(root)
+
+    def _isin(col: str, values: Any) -> np.ndarray:
+        values = [values] if isinstance(values, (str, int)) else list(values)
+        return c[col].isin(values).to_numpy(dtype=bool)
+
+    mask = np.ones(len(c), dtype=bool)
+    for col, values in (("eva", eva), ("line", line), ("category", category), ("event", event),
+                        ("weekday", weekdays), ("hour", hours)):
+        if values is not None:
+            mask &= _isin(col, values)
+    c = c[mask]
+
+    by = list(by)
+    keys = [pd.Series(DERIVED_DIMS[b](c), index=c.index, name=b) if b in DERIVED_DIMS else c[b] for b in by]
+    if keys:
+        agg = c[MEASURES].groupby(keys, dropna=False, sort=True).sum()
+    else:
+        agg = c[MEASURES].sum().to_frame().T
+    n = agg["n"].to_numpy(dtype=np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = agg["sum"].to_numpy() / n
+        res = pd.DataFrame({
+            "events": agg["events"].to_numpy(dtype=np.int64),
+            "n": n.astype(np.int64),
+            "mean": mean,
+            "std": np.sqrt(np.maximum(agg["sumsq"].to_numpy() / n - mean * mean, 0.0)),
+            "mean_pos": agg["sum_pos"].to_numpy() / agg["n_pos"].to_numpy(dtype=np.float64),
+            **{f"share_over_{t}": agg[f"over_{t}"].to_numpy() / n for t in THRESHOLDS},
+        }, index=agg.index)
+    for name, values in _hist_quantiles(agg[HIST_COLUMNS].to_numpy(dtype=np.float64), quantiles).items():
+        res[name] = values
+    return res
+
+
+def weekday_hour_mean(eva: Optional[Union[str, Iterable[str]]] = None, **kw: Any) -> pd.DataFrame:
+    """Теплокарта ноутбука: средняя задержка, дни недели × часы."""
+    return query(by=["weekday", "hour"], eva=eva, **kw)["mean"].unstack("hour")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Куб задержек для дашбордов (инкрементальный)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_upd = sub.add_parser("update", help="Свернуть новые/изменённые merged-партиции в куб")
+    p_upd.add_argument("--store", default=str(STORE_ROOT))
+    p_upd.add_argument("--workers", type=int, default=None)
+    p_upd.add_argument("--full", action="store_true", help="Собрать куб заново")
+    p_q = sub.add_parser("query", help="Срез куба")
+    p_q.add_argument("--store", default=str(STORE_ROOT))
+    p_q.add_argument("--by", nargs="*", default=[], choices=DIMS + list(DERIVED_DIMS))
+    p_q.add_argument("--eva", nargs="*", default=None)
+    p_q.add_argument("--line", nargs="*", default=None)
+    p_q.add_argument("--event", choices=["ar", "dp"], default=None)
+    p_q.add_argument("--metrics", nargs="*", default=None, help="Колонки результата (по умолчанию все)")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    if args.cmd == "update":
+        print("Rollup:", update_rollup(args.store, workers=args.workers, full=args.full),
+              f"за {time.perf_counter() - t0:.1f} с")
+    else:
+        res = query(by=args.by, eva=args.eva, line=args.line, event=args.event, root=args.store)
+        if args.metrics:
+            res = res[args.metrics]
+        print(res.round(2).to_string())
+        print(f"\n{len(res)} строк за {(time.perf_counter() - t0) * 1000:.0f} мс")
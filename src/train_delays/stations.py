@@ -0,0 +1,201 @@
+"""
+Локальный реестр станций: имя ↔ EVA ↔ ds100 без лишних запросов к /station/{name}.
+
+Файл data/stations.json наполняется результатами find_station (_parse_stations_xml) и
+живёт между запусками. Поверх файла — LRU в памяти для «запрос → EVA» с TTL:
+свежая запись отдаётся офлайн, устаревшая обновляется из API (а при сетевой ошибке
+используется как есть). Поиск по префиксу и EVA → имя/ds100 работают полностью офлайн.
+
+CLI:
+  python -m train_delays.stations search Hann
+  python -m train_delays.stations resolve "Hannover Hbf"
+"""
+from __future__ import annotations
+import argparse, json, os, pathlib, re, threading, time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import pandas as pd
+
+REGISTRY_PATH = pathlib.Path("data/stations.json")
+STATION_TTL_S = 30 * 24 * 3600   # имена/EVA почти не меняются — месяц без перепроверки
+LRU_SIZE = 512
+
+_WS_RE = re.compile(r"\s+")
+
+
+def _norm(name: str) -> str:
+    """Ключ для сравнения имён: без регистра и лишних пробелов."""
+    return _WS_RE.sub(" ", name).strip().casefold()
+
+
+class StationRegistry:
+    """Реестр станций с файловым бэкендом. Потокобезопасен (краулер зовёт его из пула)."""
+
+    def __init__(self, path: Union[str, pathlib.Path] = REGISTRY_PATH,
+                 ttl_s: float = STATION_TTL_S, lru_size: int = LRU_SIZE):
+        self.path = pathlib.Path(path)
+        self.ttl_s = ttl_s
+        self.lru_size = lru_size
+        self._lock = threading.RLock()
+        self._lru: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._stations: Dict[str, Dict[str, Any]] = {}   # EVA → запись станции (+updated_at)
+        self._queries: Dict[str, Dict[str, Any]] = {}    # норм. запрос → {"eva", "updated_at"}
+        self._load()
+
+    # ----------------- файл -----------------
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        data = json.loads(self.path.read_text(encoding="utf-8"))
+        self._stations = data.get("stations", {})
+        self._queries = data.get("queries", {})
+
+    def _save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        payload = {"stations": self._stations, "queries": self._queries}
+        tmp.write_text(json.dumps(payload, ensure_ascii=False, indent=1, sort_keys=True), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+    # ----------------- наполнение -----------------
+    def add(self, stations: Iterable[Dict[str, Any]], query: Optional[str] = None) -> None:
+        """Записи из _parse_stations_xml/find_station → реестр (и привязка запроса к первой станции)."""
+        now = time.time()
+        stations = [s for s in stations if s.get("evaNr")]
+        with self._lock:
+            for st in stations:
+                self._stations[str(st["evaNr"])] = {**st, "evaNr": str(st["evaNr"]), "updated_at": now}
+            if query is not None and stations:
+                eva = str(stations[0]["evaNr"])
+                self._queries[_norm(query)] = {"eva": eva, "updated_at": now}
+                self._remember(_norm(query), eva, now)
+            self._save()
+
+    def _remember(self, key: str, eva: str, updated_at: float) -> None:
+        self._lru[key] = (eva, updated_at)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.lru_size:
+            self._lru.popitem(last=False)
+
+    # ----------------- офлайн-запросы -----------------
+    def lookup(self, name: str) -> Optional[Tuple[str, float]]:
+        """Офлайн: имя → (EVA, время записи) по кэшу запросов или точному имени станции."""
+        key = _norm(name)
+        with self._lock:
+            hit = self._lru.get(key)
+            if hit is not None:
+                self._lru.move_to_end(key)
+                return hit
+            q = self._queries.get(key)
+            if q is not None:
+                self._remember(key, q["eva"], q["updated_at"])
+                return q["eva"], q["updated_at"]
+            for eva, st in self._stations.items():
+                if st.get("name") and _norm(st["name"]) == key:
+                    self._remember(key, eva, st["updated_at"])
+                    return eva, st["updated_at"]
+        return None
+
+    def by_eva(self, eva: Union[int, str]) -> Optional[Dict[str, Any]]:
+        return self._stations.get(str(eva))
+
+    def name_for(self, eva: Union[int, str]) -> Optional[str]:
+        st = self.by_eva(eva)
+        return st.get("name") if st else None
+
+    def ds100_for(self, eva: Union[int, str]) -> Optional[str]:
+        st = self.by_eva(eva)
+        return st.get("ds100") if st else None
+
+    def search(self, prefix: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Офлайн-поиск по началу имени (или любого слова имени), без регистра."""
+        p = _norm(prefix)
+
+        def _matches(name: str) -> bool:
+            n = _norm(name)
+            return n.startswith(p) or any(w.startswith(p) for w in n.split(" "))
+
+        with self._lock:
+            found = [st for st in self._stations.values() if st.get("name") and _matches(st["name"])]
+        # сначала совпадения с начала имени, затем по алфавиту
+        found.sort(key=lambda st: (not _norm(st["name"]).startswith(p), st["name"]))
+        return found[:limit]
+
+    # ----------------- онлайн-обновление -----------------
+    def resolve(self, station: Union[int, str], online: bool = True) -> str:
+        """
+        Имя или EVA → EVA. Свежая запись — без сети; устаревшая или отсутствующая —
+        через find_station (если online). При ошибке сети устаревшая запись всё равно отдаётся.
+        """
+        s = str(station).strip()
+        if s.isdigit():
+            return s
+        hit = self.lookup(s)
+        if hit is not None and (not online or time.time() - hit[1] < self.ttl_s):
+            return hit[0]
+        if not online:
+            raise KeyError(f"Station '{s}' is not in the local registry ({self.path})")
+
+        from train_delays.fetch import find_station  # поздний импорт: fetch сам использует реестр
+        import requests
+        try:
+            stations = find_station(s, limit=5)
+        except requests.RequestException:
+            if hit is not None:
+                return hit[0]
+            raise
+        if not stations:
+            raise ValueError(f"No station found for name='{s}'")
+        if not stations[0].get("evaNr"):
+            raise ValueError("EVA number not found in station payload.")
+        self.add(stations, query=s)
+        return str(stations[0]["evaNr"])
+
+
+_DEFAULT: Optional[StationRegistry] = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def get_registry() -> StationRegistry:
+    """Общий реестр процесса (data/stations.json)."""
+    global _DEFAULT
+    with _DEFAULT_LOCK:
+        if _DEFAULT is None:
+            _DEFAULT = StationRegistry()
+        return _DEFAULT
+
+
+def attach_station_names(df: pd.DataFrame, registry: Optional[StationRegistry] = None) -> pd.DataFrame:
+    """
+    Имя станции по eva из реестра (корень XML не всегда совпадает с eva строки).
+    Там, где реестр молчит, остаётся исходное значение station.
+    """
+    if df.empty or "eva" not in df.columns:
+        return df
+    registry = registry or get_registry()
+    evas = df["eva"].dropna().unique()
+    names = {e: registry.name_for(e) for e in evas}
+    mapped = df["eva"].map({e: n for e, n in names.items() if n}).astype("string")
+    df = df.copy()
+    df["station"] = mapped.fillna(df["station"]) if "station" in df.columns else mapped
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Локальный реестр станций (data/stations.json)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_search = sub.add_parser("search", help="Офлайн-поиск по префиксу имени")
+    p_search.add_argument("prefix")
+    p_search.add_argument("--limit", type=int, default=10)
+    p_resolve = sub.add_parser("resolve", help="Имя → EVA (обновит реестр из API при необходимости)")
+    p_resolve.add_argument("name")
+    p_resolve.add_argument("--offline", action="store_true")
+    args = parser.parse_args()
+
+    reg = get_registry()
+    if args.cmd == "search":
+        for st in reg.search(args.prefix, limit=args.limit):
+            print(f"{st['evaNr']:>8}  {st.get('ds100') or '':<6} {st['name']}")
+    else:
+        print(reg.resolve(args.name, online=not args.offline))
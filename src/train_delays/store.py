@@ -0,0 +1,211 @@
+"""
+Хранилище обработанных таблиц: Parquet, партиционированный по станции и дню.
+
+Раскладка (корень по умолчанию — data/processed):
+  data/processed/<dataset>/eva=<EVA>/date=<YYYY-MM-DD>/part-<key>.parquet
+
+- dataset: "plan" | "changes" | "merged" | "features" (и любые производные таблицы);
+- date — локальная дата (Europe/Berlin) события: planned_ts для plan/merged,
+  event_ct (иначе ts) для changes; строки без времени/EVA попадают в "unknown";
+- key — идентификатор источника (например, sha256 сырого payload'а): повторная запись
+  с тем же key заменяет файл, поэтому перепарсинг одного снимка идемпотентен.
+
+Parquet хранит tz-aware datetime, StringDtype и category как есть — после чтения
+не нужно заново парсить даты из текста, как было с CSV.
+"""
+from __future__ import annotations
+import hashlib, os, pathlib, re
+from datetime import date, datetime
+from typing import Any, Iterable, List, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+STORE_ROOT = pathlib.Path("data/processed")
+TZ = "Europe/Berlin"
+UNKNOWN = "unknown"
+
+# колонка(и) времени, по которой строка попадает в дневную партицию
+PARTITION_TS = {
+    "plan": ["planned_ts"],
+    "changes": ["event_ct", "ts"],
+    "merged": ["planned_ts", "changed_ts"],
+    "features": ["planned_ts", "changed_ts"],
+}
+
+_PART_RE = re.compile(r"^eva=(?P<eva>[^/]+)$")
+_DATE_RE = re.compile(r"^date=(?P<date>[^/]+)$")
+
+DateLike = Union[str, date, datetime, pd.Timestamp]
+
+
+def partition_date(df: pd.DataFrame, ts_cols: Sequence[str]) -> pd.Series:
+    """Локальная дата события в виде 'YYYY-MM-DD' (первая непустая из ts_cols), иначе 'unknown'."""
+    ts = None
+    for col in ts_cols:
+        if col in df.columns:
+            ts = df[col] if ts is None else ts.fillna(df[col])
+    if ts is None:
+        return pd.Series(UNKNOWN, index=df.index)
+    ts = pd.to_datetime(ts)
+    if ts.dt.tz is not None:
+        ts = ts.dt.tz_convert(TZ)
+    return ts.dt.strftime("%Y-%m-%d").fillna(UNKNOWN)
+
+
+def _to_date_str(value: Optional[DateLike]) -> Optional[str]:
+    if value is None:
+        return None
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert(TZ)
+    return ts.strftime("%Y-%m-%d")
+
+
+def dataset_path(dataset: str, root: Union[str, pathlib.Path] = STORE_ROOT) -> pathlib.Path:
+    return pathlib.Path(root) / dataset
+
+
+# ----------------- запись -----------------
+def write_partitions(
+    df: pd.DataFrame,
+    dataset: str,
+    key: str,
+    root: Union[str, pathlib.Path] = STORE_ROOT,
+    ts_cols: Optional[Sequence[str]] = None,
+) -> List[pathlib.Path]:
+    """
+    Раскладывает df по партициям (eva × локальная дата) и пишет part-<key>.parquet в каждую.
+    Файл с тем же key заменяется атомарно. Возвращает список записанных файлов.
+    """
+    if df.empty:
+        return []
+    ts_cols = ts_cols if ts_cols is not None else PARTITION_TS.get(dataset, [])
+    evas = df["eva"].astype("string").fillna(UNKNOWN) if "eva" in df.columns else pd.Series(UNKNOWN, index=df.index)
+    days = partition_date(df, ts_cols)
+
+    base = dataset_path(dataset, root)
+    written: List[pathlib.Path] = []
+    for (eva, day), idx in df.groupby([evas, days], sort=True).groups.items():
+        part_dir = base / f"eva={eva}" / f"date={day}"
+        part_dir.mkdir(parents=True, exist_ok=True)
+        path = part_dir / f"part-{key}.parquet"
+        tmp = part_dir / f".part-{key}.{os.getpid()}.tmp"
+        df.loc[idx].reset_index(drop=True).to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+        written.append(path)
+    return written
+
+
+# ----------------- чтение -----------------
+def list_partitions(
+    dataset: str,
+    root: Union[str, pathlib.Path] = STORE_ROOT,
+    eva: Optional[Union[str, int, Iterable[Union[str, int]]]] = None,
+    start: Optional[DateLike] = None,
+    end: Optional[DateLike] = None,
+) -> List[Tuple[str, str, pathlib.Path]]:
+    """
+    Партиции (eva, date, dir) с отсечением по EVA и диапазону дат [start, end] (включительно).
+    Партиции "unknown" по дате отдаются только без фильтра по датам.
+    """
+    base = dataset_path(dataset, root)
+    if not base.exists():
+        return []
+    if eva is None:
+        eva_set = None
+    elif isinstance(eva, (str, int)):
+        eva_set = {str(eva)}
+    else:
+        eva_set = {str(e) for e in eva}
+    d_from, d_to = _to_date_str(start), _to_date_str(end)
+
+    out: List[Tuple[str, str, pathlib.Path]] = []
+    for eva_dir in sorted(base.iterdir()):
+        m = _PART_RE.match(eva_dir.name)
+        if not m or (eva_set is not None and m.group("eva") not in eva_set):
+            continue
+        for date_dir in sorted(eva_dir.iterdir()):
+            d = _DATE_RE.match(date_dir.name)
+            if not d:
+                continue
+            day = d.group("date")
+            if (d_from or d_to) and day == UNKNOWN:
+                continue
+            if (d_from and day < d_from) or (d_to and day > d_to):
+                continue
+            out.append((m.group("eva"), day, date_dir))
+    return out
+
+
+def partition_files(part_dir: pathlib.Path) -> List[pathlib.Path]:
+    return sorted(part_dir.glob("part-*.parquet"))
+
+
+def _read_file(path: pathlib.Path, columns: Optional[List[str]],
+               filters: Optional[List[Tuple[str, str, Any]]]) -> pd.DataFrame:
+    """
+    Один part-файл. Колонки, которых нет в файлах, записанных до их появления в схеме
+    (например, fetched_at в changes), приходят пустыми (None), а не ошибкой pyarrow.
+    """
+    try:
+        return pd.read_parquet(path, columns=columns, filters=filters)
+    except pa.ArrowInvalid:
+        if columns is None:
+            raise
+        have = set(pq.read_schema(path).names)
+        if all(c in have for c in columns) or any(f[0] not in have for f in filters or []):
+            raise
+        df = pd.read_parquet(path, columns=[c for c in columns if c in have], filters=filters)
+        return df.assign(**{c: pd.Series(None, index=df.index, dtype=object)
+                            for c in columns if c not in have})[columns]
+
+
+def partition_signature(part_dir: pathlib.Path) -> str:
+    """Отпечаток партиции: имена, размеры и mtime её part-файлов (для инкрементальных пересчётов)."""
+    h = hashlib.sha1()
+    for p in partition_files(part_dir):
+        st = p.stat()
+        h.update(f"{p.name}:{st.st_size}:{st.st_mtime_ns};".encode("utf-8"))
+    return h.hexdigest()
+
+
+def read_partition(
+    dataset: str,
+    eva: Union[str, int],
+    day: str,
+    root: Union[str, pathlib.Path] = STORE_ROOT,
+    columns: Optional[List[str]] = None,
+    filters: Optional[List[Tuple[str, str, Any]]] = None,
+) -> pd.DataFrame:
+    """Одна партиция (eva, day) целиком, включая day == 'unknown'."""
+    part_dir = dataset_path(dataset, root) / f"eva={eva}" / f"date={day}"
+    frames = [_read_file(p, columns, filters) for p in partition_files(part_dir)]
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame(columns=columns or [])
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_dataset(
+    dataset: str,
+    root: Union[str, pathlib.Path] = STORE_ROOT,
+    eva: Optional[Union[str, int, Iterable[Union[str, int]]]] = None,
+    start: Optional[DateLike] = None,
+    end: Optional[DateLike] = None,
+    columns: Optional[List[str]] = None,
+    filters: Optional[List[Tuple[str, str, Any]]] = None,
+) -> pd.DataFrame:
+    """
+    Читает датасет с отсечением партиций (eva, даты), проекцией колонок и
+    предикатами pyarrow (filters=[("event", "==", "ar"), ...]). Типы колонок сохраняются.
+    """
+    frames = []
+    for _, _, part_dir in list_partitions(dataset, root, eva=eva, start=start, end=end):
+        for path in partition_files(part_dir):
+            frames.append(_read_file(path, columns, filters))
+    frames = [f for f in frames if not f.empty]
+    if not frames:
+        return pd.DataFrame(columns=columns or [])
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,320 @@
+"""
+Локальная заглушка DB Timetables API: та же раскладка URL, ответы из архива или синтетика.
+
+Запуск из корня репо:
+  python -m train_delays.stub_api --port 8089 --source synthetic --latency-ms 80 --rate-429 0.05
+  DB_API_BASE=http://127.0.0.1:8089 python -m train_delays.crawl --stations "Hannover Hbf" ...
+
+Эндпоинты (любой префикс перед /timetables/v1 допускается, как у BASE маркетплейса):
+  /timetables/v1/station/{name}
+  /timetables/v1/plan/{eva}/{YYMMDD}/{HH}
+  /timetables/v1/fchg/{eva}
+  /timetables/v1/rchg/{eva}
+  /_stats                        # счётчики заглушки (JSON)
+
+Источники ответов (--source):
+- replay    — архив сырья (train_delays.archive): plan по (eva, слот YYMMDD/HH), fchg/rchg —
+              снимки станции по кругу в порядке fetched_at, станции — из data/stations.json;
+              если ответа нет: 404 (или синтетика с --fallback);
+- synthetic — train_delays.synth, детерминированно по (seed, eva, дата, час);
+- record    — прокси в настоящий API (--upstream, ключи клиента пробрасываются),
+              успешные XML-ответы пишутся в архив — потом их можно проигрывать в replay.
+
+plan и station отдаются с ETag; If-None-Match с тем же ETag → 304 (счётчик not_modified).
+
+Сбои (до формирования ответа): задержка latency ± jitter, 429 с Retry-After, 5xx
+(500/502/503/504, как RETRY_STATUSES в fetch.py), «зависание» на hang_s с обрывом соединения.
+"""
+from __future__ import annotations
+import argparse, hashlib, json, pathlib, random, re, threading, time
+from collections import Counter
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple, Union
+from urllib.parse import unquote
+
+from train_delays import synth
+from train_delays.archive import ARCHIVE_ROOT, BERLIN, RawArchive
+
+SOURCES = ("replay", "synthetic", "record")
+UPSTREAM = "https://apis.deutschebahn.com/db-api-marketplace/apis"
+ERROR_STATUSES = (500, 502, 503, 504)
+DEFAULT_HANG_S = 60.0
+
+_ROUTE_RE = re.compile(r"/timetables/v1/(?P<kind>station|plan|fchg|rchg)/(?P<rest>[^?]+)")
+_PLAN_RE = re.compile(r"^(?P<eva>\d+)/(?P<date>\d{6})/(?P<hour>\d{1,2})$")
+
+
+class StubApi:
+    """Логика заглушки без HTTP: маршрутизация, сбои, источники ответов, статистика."""
+
+    def __init__(
+        self,
+        source: str = "synthetic",
+        raw_root: Union[str, pathlib.Path] = ARCHIVE_ROOT,
+        fallback: bool = False,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        rate_429: float = 0.0,
+        rate_5xx: float = 0.0,
+        rate_timeout: float = 0.0,
+        hang_s: float = DEFAULT_HANG_S,
+        retry_after_s: Optional[int] = 1,
+        seed: int = 0,
+        stops_per_hour: int = synth.STOPS_PER_HOUR,
+        msgs_per_stop: int = synth.MSGS_PER_STOP,
+        upstream: str = UPSTREAM,
+        require_auth: bool = True,
+    ):
+        if source not in SOURCES:
+            raise ValueError(f"source must be one of {SOURCES}")
+        self.source = source
+        self.archive = RawArchive(raw_root)
+        self.fallback = fallback
+        self.latency_s = latency_ms / 1000
+        self.jitter_s = jitter_ms / 1000
+        self.rate_429, self.rate_5xx, self.rate_timeout = rate_429, rate_5xx, rate_timeout
+        self.hang_s = hang_s
+        self.retry_after_s = retry_after_s
+        self.seed = seed
+        self.stops_per_hour = stops_per_hour
+        self.msgs_per_stop = msgs_per_stop
+        self.upstream = upstream.rstrip("/")
+        self.require_auth = require_auth
+
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats: Counter = Counter()
+        self._plans: Dict[Tuple[str, str], str] = {}          # (eva, "YYMMDD/HH") → sha256
+        self._snapshots: Dict[Tuple[str, str], List[str]] = {}  # (kind, eva) → sha256 по порядку
+        self._cursor: Counter = Counter()
+        if source == "replay":
+            self.reindex()
+
+    # ----------------- источники -----------------
+    def reindex(self) -> None:
+        """Перечитывает index.jsonl архива (для replay)."""
+        plans: Dict[Tuple[str, str], str] = {}
+        snaps: Dict[Tuple[str, str], List[str]] = {}
+        for e in self.archive.entries():
+            if e["kind"] == "plan" and e.get("slot"):
+                plans[(e["eva"], e["slot"])] = e["sha256"]
+            elif e["kind"] in ("fchg", "rchg"):
+                snaps.setdefault((e["kind"], e["eva"]), []).append(e["sha256"])
+        with self._lock:
+            self._plans, self._snapshots = plans, snaps
+
+    def _replay(self, kind: str, key: str) -> Optional[str]:
+        if kind == "station":
+            from train_delays.stations import get_registry  # реестр нужен только в replay
+            found = get_registry().search(key, limit=5)
+            if not found:
+                return None
+            items = "".join(
+                f"<station name=\"{st['name']}\" eva=\"{st['evaNr']}\" ds100=\"{st.get('ds100') or ''}\"/>"
+                for st in found)
+            return f"<?xml version='1.0' encoding='UTF-8'?>\n<stations>{items}</stations>\n"
+        if kind == "plan":
+            m = _PLAN_RE.match(key)
+            sha = self._plans.get((m.group("eva"), f"{m.group('date')}/{int(m.group('hour')):02d}"))
+            return self.archive.read_text(sha) if sha else None
+        with self._lock:
+            shas = self._snapshots.get((kind, key))
+            if not shas:
+                return None
+            sha = shas[self._cursor[(kind, key)] % len(shas)]
+            self._cursor[(kind, key)] += 1
+        return self.archive.read_text(sha)
+
+    def _synthetic(self, kind: str, key: str) -> str:
+        if kind == "station":
+            return synth.stations_xml(key)
+        if kind == "plan":
+            m = _PLAN_RE.match(key)
+            return synth.plan_xml(m.group("eva"), m.group("date"), int(m.group("hour")),
+                                  stops_per_hour=self.stops_per_hour, seed=self.seed)
+        return synth.changes_xml(key, now=datetime.now(BERLIN), recent=(kind == "rchg"),
+                                 stops_per_hour=self.stops_per_hour, msgs_per_stop=self.msgs_per_stop,
+                                 seed=self.seed)
+
+    def _record(self, kind: str, key: str, path: str, headers: Dict[str, str]) -> Tuple[int, str]:
+        import requests  # только для record
+        fwd = {k: v for k, v in headers.items() if k.lower() in ("db-client-id", "db-api-key", "accept")}
+        r = requests.get(self.upstream + path, headers=fwd, timeout=30)
+        if r.status_code == 200 and kind != "station" and "xml" in (r.headers.get("Content-Type") or ""):
+            eva = key.split("/", 1)[0]
+            slot = None
+            if kind == "plan":
+                m = _PLAN_RE.match(key)
+                slot = f"{m.group('date')}/{int(m.group('hour')):02d}"
+            self.archive.put(r.text, eva=eva, kind=kind, fetched_at=datetime.now(BERLIN), slot=slot)
+            self._count("recorded")
+        return r.status_code, r.text
+
+    # ----------------- обработка запроса -----------------
+    def _count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self.stats[key] += n
+
+    def fault(self) -> Optional[str]:
+        """Какой сбой выпал этому запросу: 'timeout' | '429' | '5xx' | None (вероятности независимы)."""
+        with self._lock:
+            r_timeout, r_429, r_5xx = self._rng.random(), self._rng.random(), self._rng.random()
+        if r_timeout < self.rate_timeout:
+            return "timeout"
+        if r_429 < self.rate_429:
+            return "429"
+        if r_5xx < self.rate_5xx:
+            return "5xx"
+        return None
+
+    def delay(self) -> None:
+        if self.latency_s or self.jitter_s:
+            with self._lock:
+                d = self.latency_s + self._rng.uniform(-self.jitter_s, self.jitter_s)
+            time.sleep(max(0.0, d))
+
+    def respond(self, path: str, headers: Dict[str, str]) -> Tuple[int, Dict[str, str], str]:
+        """(status, заголовки, тело) для GET path. Сбои и задержку применяет вызывающий код."""
+        m = _ROUTE_RE.search(path)
+        if not m:
+            return 404, {}, "Not Found"
+        kind, key = m.group("kind"), unquote(m.group("rest")).strip("/")
+        if kind == "plan" and not _PLAN_RE.match(key):
+            return 400, {}, "Bad Request: expected /plan/{eva}/{YYMMDD}/{HH}"
+        if self.require_auth and not (headers.get("DB-Client-Id") and headers.get("DB-Api-Key")):
+            return 401, {}, "Unauthorized"
+        xml_headers = {"Content-Type": "application/xml; charset=utf-8"}
+
+        if self.source == "record":
+            status, body = self._record(kind, key, path[m.start():], headers)
+            return status, xml_headers if status == 200 else {}, body
+        body = self._replay(kind, key) if self.source == "replay" else None
+        if body is None and (self.source == "synthetic" or self.fallback):
+            body = self._synthetic(kind, key)
+        if body is None:
+            return 404, {}, "Not Found"
+        if kind in ("plan", "station"):
+            # валидатор для условных запросов (HTTP-кэш fetch): тот же ответ → 304 без тела
+            etag = '"%s"' % hashlib.sha256(body.encode("utf-8")).hexdigest()[:20]
+            if headers.get("If-None-Match") == etag:
+                self._count("not_modified")
+                return 304, {"ETag": etag}, ""
+            xml_headers["ETag"] = etag
+        return 200, xml_headers, body
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "StubServer"
+    protocol_version = "HTTP/1.1"  # keep-alive, как у настоящего API (пул соединений в SESSION)
+
+    def log_message(self, fmt: str, *args: Any) -> None:
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def _send(self, status: int, headers: Dict[str, str], body: str) -> None:
+        data = body.encode("utf-8")
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        self.server.api._count(f"status_{status}")
+        self.server.api._count("bytes_out", len(data))
+
+    def do_GET(self) -> None:
+        api = self.server.api
+        if self.path.rstrip("/") == "/_stats":
+            self._send(200, {"Content-Type": "application/json"}, json.dumps(dict(api.stats), sort_keys=True))
+            return
+        api._count("requests")
+        fault = api.fault()
+        if fault == "timeout":
+            api._count("fault_timeout")
+            time.sleep(api.hang_s)
+            self.close_connection = True  # ответа не будет: клиент упирается в свой таймаут
+            return
+        api.delay()
+        if fault == "429":
+            api._count("fault_429")
+            headers = {"Retry-After": str(api.retry_after_s)} if api.retry_after_s is not None else {}
+            self._send(429, headers, "Too Many Requests")
+            return
+        if fault == "5xx":
+            api._count("fault_5xx")
+            with api._lock:
+                status = api._rng.choice(ERROR_STATUSES)
+            self._send(status, {}, "Upstream error (stub)")
+            return
+        status, headers, body = api.respond(self.path, dict(self.headers))
+        self._send(status, headers, body)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, api: StubApi, host: str = "127.0.0.1", port: int = 0, verbose: bool = False):
+        super().__init__((host, port), _Handler)
+        self.api = api
+        self.verbose = verbose
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def serve_in_thread(api: Optional[StubApi] = None, host: str = "127.0.0.1", port: int = 0) -> StubServer:
+    """
+    Поднимает заглушку в фоновом потоке (порт 0 — любой свободный). Для бенчмарков и проверок:
+      srv = serve_in_thread(StubApi(latency_ms=50)); fetch.BASE = srv.base_url; ...; srv.shutdown()
+    """
+    server = StubServer(api or StubApi(), host, port)
+    threading.Thread(target=server.serve_forever, name="stub-api", daemon=True).start()
+    return server
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Локальная заглушка DB Timetables API (replay/synthetic/record)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--source", choices=SOURCES, default="synthetic")
+    parser.add_argument("--raw", default=str(ARCHIVE_ROOT), help="Архив сырья для replay/record")
+    parser.add_argument("--fallback", action="store_true", help="replay: синтетика, если в архиве нет ответа")
+    parser.add_argument("--upstream", default=UPSTREAM, help="record: адрес настоящего API")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="Доля ответов 500/502/503/504")
+    parser.add_argument("--rate-timeout", type=float, default=0.0, help="Доля запросов без ответа")
+    parser.add_argument("--hang-s", type=float, default=DEFAULT_HANG_S, help="Сколько «висит» запрос-таймаут")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After у 429, с")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stops-per-hour", type=int, default=synth.STOPS_PER_HOUR)
+    parser.add_argument("--msgs-per-stop", type=int, default=synth.MSGS_PER_STOP)
+    parser.add_argument("--no-auth", action="store_true", help="Не требовать DB-Client-Id/DB-Api-Key")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args(argv)
+
+    api = StubApi(
+        source=args.source, raw_root=args.raw, fallback=args.fallback,
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        rate_429=args.rate_429, rate_5xx=args.rate_5xx, rate_timeout=args.rate_timeout,
+        hang_s=args.hang_s, retry_after_s=args.retry_after, seed=args.seed,
+        stops_per_hour=args.stops_per_hour, msgs_per_stop=args.msgs_per_stop,
+        upstream=args.upstream, require_auth=not args.no_auth,
+    )
+    server = StubServer(api, args.host, args.port, verbose=args.verbose)
+    print(f"Заглушка API ({args.source}) на {server.base_url} — DB_API_BASE={server.base_url}. Остановка: Ctrl+C")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print("Остановлено:", dict(api.stats))
+
+
+if __name__ == "__main__":
+    main()
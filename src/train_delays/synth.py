@@ -0,0 +1,360 @@
+"""
+Синтетические ответы DB Timetables API (station / plan / fchg / rchg) в том же XML-формате.
+
+Генерация детерминирована: одинаковые (seed, eva, YYMMDD, HH) дают байт-в-байт одинаковый
+план, а stop_id в изменениях совпадают со stop_id плана — merge сопоставляет их по ключу.
+
+Два режима:
+- отдельные станции (plan_stops): остановки каждой станции независимы — так отвечает
+  заглушка API (train_delays.stub_api) на любой EVA;
+- сеть (SynthNetwork): линии проходят через несколько станций из заданного набора, один
+  рейс (trip) имеет общий id на всех станциях маршрута, а задержка накапливается по пути —
+  как в настоящих данных. На ней строится архив для бенчмарков (write_archive).
+
+Сообщения <m> (на уровне <s> и внутри <ar>/<dp>) имеют стабильные id и ts: каждый
+FCHG-снимок повторяет все уже опубликованные к моменту now сообщения, RCHG — только
+опубликованные за последние RCHG_WINDOW_MIN минут.
+"""
+from __future__ import annotations
+import pathlib, zlib, random
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+from xml.sax.saxutils import quoteattr
+from zoneinfo import ZoneInfo
+
+BERLIN = ZoneInfo("Europe/Berlin")
+
+STOPS_PER_HOUR = 20
+MSGS_PER_STOP = 2
+CHANGED_SHARE = 0.6       # доля остановок, по которым в fchg есть сообщения
+FCHG_HOURS = (-1, 0, 1, 2)  # часы вокруг «сейчас», которые покрывает fchg
+RCHG_WINDOW_MIN = 2       # /rchg — изменения за последние ~2 минуты
+S_LEVEL_MSG_SHARE = 0.15  # доля остановок с сообщением на уровне <s> (информация/качество)
+
+# (категория, filter flag, owner)
+CATEGORIES = [("ICE", "F", "80"), ("IC", "F", "80"), ("RE", "N", "800244"),
+              ("RB", "N", "800244"), ("S", "S", "800244")]
+PLACES = ["Hamburg Hbf", "Bremen Hbf", "Nienburg(Weser)", "Lehrte", "Braunschweig Hbf",
+          "Hannover-Linden", "Wunstorf", "Celle", "Hildesheim Hbf", "Göttingen", "Minden(Westf)"]
+DELAY_CODES = [43, 45, 47, 80, 91]   # c у сообщений t="d"
+QUALITY_CODES = [13, 70, 73, 82]     # c у сообщений t="f" (качество/сервис)
+
+
+def _rng(*parts: Any) -> random.Random:
+    """Отдельный детерминированный ГСЧ на набор ключей (не зависит от PYTHONHASHSEED)."""
+    return random.Random(zlib.crc32("|".join(map(str, parts)).encode("utf-8")))
+
+
+def _fmt(ts: datetime) -> str:
+    return ts.strftime("%y%m%d%H%M")
+
+
+def _hour_start(yymmdd: str, hour: int) -> datetime:
+    return datetime.strptime(f"{yymmdd}{int(hour):02d}", "%y%m%d%H").replace(tzinfo=BERLIN)
+
+
+def station_eva(name: str) -> str:
+    """Синтетический, но стабильный EVA для имени станции."""
+    return str(8000000 + zlib.crc32(name.strip().casefold().encode("utf-8")) % 100000)
+
+
+def station_name(eva: Union[int, str]) -> str:
+    return f"Synth {eva}"
+
+
+def stations_xml(name: str) -> str:
+    """Ответ /station/{name}: одна станция с синтетическим EVA."""
+    eva = station_eva(name)
+    ds100 = "S" + eva[-4:]
+    return (f"<?xml version='1.0' encoding='UTF-8'?>\n<stations>"
+            f"<station name={quoteattr(name)} eva=\"{eva}\" ds100=\"{ds100}\" db=\"true\" "
+            f"creationts=\"{datetime.now(BERLIN).strftime('%y-%m-%d %H:%M:%S.000')}\"/></stations>\n")
+
+
+# ----------------- план: отдельные станции -----------------
+def plan_stops(
+    eva: Union[int, str],
+    yymmdd: str,
+    hour: int,
+    stops_per_hour: int = STOPS_PER_HOUR,
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    """Остановки плана за час: stop_id, категория, pt прибытия/отправления, платформа, маршрут."""
+    rng = _rng(seed, "plan", eva, yymmdd, hour)
+    base = _hour_start(yymmdd, hour)
+    stops: List[Dict[str, Any]] = []
+    for i in range(stops_per_hour):
+        cat, flag, owner = rng.choice(CATEGORIES)
+        minute = rng.randrange(60)
+        ar_ts = base + timedelta(minutes=minute)
+        dwell = rng.choice((1, 2, 3, 5))
+        origin = ar_ts - timedelta(minutes=rng.randrange(5, 240))
+        trip = rng.getrandbits(63) - (1 << 62)
+        kind = rng.random()
+        stops.append({
+            "stop_id": f"{trip}-{_fmt(origin)}-{rng.randrange(1, 25)}",
+            "category": cat, "flag": flag, "owner": owner,
+            "number": str(rng.randrange(100, 99999)),
+            "line": str(rng.randrange(1, 40)) if cat in ("RE", "RB", "S") else None,
+            "platform": str(rng.randrange(1, 14)),
+            # ~10% начинают маршрут здесь (только dp), ~10% заканчивают (только ar)
+            "ar": None if kind < 0.1 else ar_ts,
+            "dp": None if kind > 0.9 else ar_ts + timedelta(minutes=dwell),
+            "from": "|".join(rng.sample(PLACES, rng.randrange(1, 4))),
+            "to": "|".join(rng.sample(PLACES, rng.randrange(1, 4))),
+            "delay": max(0, int(rng.expovariate(1 / 4))),  # большинство 0–5 мин, редкие длинные хвосты
+        })
+    return stops
+
+
+# ----------------- план: сеть линий -----------------
+class SynthNetwork:
+    """
+    Линии поверх набора станций. Каждая линия — упорядоченный маршрут из 2..max_route станций
+    с временем хода между соседними; рейсы отправляются с начальной станции через равные
+    интервалы. Задержка рейса начинается на старте и меняется на каждом перегоне
+    (набор или нагон), так что по соседним станциям она коррелирует.
+    """
+
+    def __init__(
+        self,
+        evas: Sequence[Union[int, str]],
+        stops_per_hour: int = STOPS_PER_HOUR,
+        seed: int = 0,
+        max_route: int = 8,
+        names: Optional[Dict[str, str]] = None,
+    ):
+        self.evas = [str(e) for e in evas]
+        self.seed = seed
+        self.names = {e: (names or {}).get(e) or station_name(e) for e in self.evas}
+        rng = _rng(seed, "network", ",".join(self.evas))
+
+        n_lines = max(1, len(self.evas))
+        self.lines: List[Dict[str, Any]] = []
+        for i in range(n_lines):
+            cat, flag, owner = rng.choice(CATEGORIES)
+            size = min(len(self.evas), rng.randrange(2, max_route + 1)) if len(self.evas) > 1 else 1
+            route = rng.sample(self.evas, size)
+            offsets = [0]
+            for _ in route[1:]:
+                offsets.append(offsets[-1] + rng.randrange(6, 35))
+            self.lines.append({
+                "index": i, "category": cat, "flag": flag, "owner": owner,
+                "line": str(rng.randrange(1, 40)) if cat in ("RE", "RB", "S") else None,
+                "number_base": rng.randrange(100, 900) * 100,
+                "route": route, "offsets": offsets, "phase": rng.randrange(60),
+                "platforms": {e: str(rng.randrange(1, 14)) for e in route},
+            })
+        # интервал движения подбираем так, чтобы на станцию приходилось ~stops_per_hour остановок в час
+        visits = sum(len(ln["route"]) for ln in self.lines)
+        self.trips_per_hour = max(1, round(stops_per_hour * len(self.evas) / visits))
+        self._by_eva: Dict[str, List[Any]] = {}
+        for ln in self.lines:
+            for pos, e in enumerate(ln["route"]):
+                self._by_eva.setdefault(e, []).append((ln, pos))
+
+    def __contains__(self, eva: Union[int, str]) -> bool:
+        return str(eva) in self._by_eva
+
+    def _trip_delays(self, ln: Dict[str, Any], origin: datetime) -> List[int]:
+        rng = _rng(self.seed, "trip", ln["index"], _fmt(origin))
+        delay = max(0, int(rng.expovariate(1 / 3)))
+        out = []
+        for _ in ln["route"]:
+            out.append(delay)
+            delay = max(0, delay + int(round(rng.gauss(0.3, 1.5))))
+        return out
+
+    def plan_stops(self, eva: Union[int, str], yymmdd: str, hour: int) -> List[Dict[str, Any]]:
+        """Остановки рейсов всех линий, проходящих через eva, с прибытием в этот час."""
+        eva = str(eva)
+        start = _hour_start(yymmdd, hour)
+        end = start + timedelta(hours=1)
+        step = 60 / self.trips_per_hour
+        stops: List[Dict[str, Any]] = []
+        for ln, pos in self._by_eva.get(eva, []):
+            offset = ln["offsets"][pos]
+            # рейсы, которые дойдут до eva в [start, end): отправление с начальной станции раньше на offset
+            origin_hour = (start - timedelta(minutes=offset + 60)).replace(minute=0)
+            while origin_hour < end:
+                for k in range(self.trips_per_hour):
+                    origin = origin_hour + timedelta(minutes=int(ln["phase"] % step + k * step))
+                    ar_ts = origin + timedelta(minutes=offset)
+                    if not (start <= ar_ts < end):
+                        continue
+                    trip = _rng(self.seed, "tripid", ln["index"], _fmt(origin)).getrandbits(63) - (1 << 62)
+                    route = ln["route"]
+                    stops.append({
+                        "stop_id": f"{trip}-{_fmt(origin)}-{pos + 1}",
+                        "category": ln["category"], "flag": ln["flag"], "owner": ln["owner"],
+                        "number": str(ln["number_base"] + (origin.hour * self.trips_per_hour + k) % 100),
+                        "line": ln["line"],
+                        "platform": ln["platforms"][eva],
+                        "ar": None if pos == 0 else ar_ts,
+                        "dp": None if pos == len(route) - 1 else ar_ts + timedelta(minutes=1 if pos else 0),
+                        "from": "|".join(self.names[e] for e in route[:pos]),
+                        "to": "|".join(self.names[e] for e in route[pos + 1:]),
+                        "delay": self._trip_delays(ln, origin)[pos],
+                    })
+                origin_hour += timedelta(hours=1)
+        stops.sort(key=lambda st: (st["ar"] or st["dp"], st["stop_id"]))
+        return stops
+
+
+def _stops_for(eva: Union[int, str], yymmdd: str, hour: int, stops_per_hour: int, seed: int,
+               network: Optional[SynthNetwork]) -> List[Dict[str, Any]]:
+    if network is not None and eva in network:
+        return network.plan_stops(eva, yymmdd, hour)
+    return plan_stops(eva, yymmdd, hour, stops_per_hour, seed)
+
+
+def _station_for(eva: Union[int, str], network: Optional[SynthNetwork]) -> str:
+    if network is not None and eva in network:
+        return network.names[str(eva)]
+    return station_name(eva)
+
+
+def plan_xml(
+    eva: Union[int, str],
+    yymmdd: str,
+    hour: int,
+    stops_per_hour: int = STOPS_PER_HOUR,
+    seed: int = 0,
+    station: Optional[str] = None,
+    network: Optional[SynthNetwork] = None,
+) -> str:
+    """Ответ /plan/{eva}/{YYMMDD}/{HH}."""
+    station = station or _station_for(eva, network)
+    out = [f"<?xml version='1.0' encoding='UTF-8'?>\n<timetable station={quoteattr(station)} eva=\"{eva}\">"]
+    for st in _stops_for(eva, yymmdd, hour, stops_per_hour, seed, network):
+        parts = [f"<s id=\"{st['stop_id']}\">",
+                 f"<tl f=\"{st['flag']}\" t=\"p\" o=\"{st['owner']}\" c=\"{st['category']}\" n=\"{st['number']}\"/>"]
+        line = f" l=\"{st['line']}\"" if st["line"] else ""
+        if st["ar"] is not None:
+            parts.append(f"<ar pt=\"{_fmt(st['ar'])}\" pp=\"{st['platform']}\"{line} ppth={quoteattr(st['from'])}/>")
+        if st["dp"] is not None:
+            parts.append(f"<dp pt=\"{_fmt(st['dp'])}\" pp=\"{st['platform']}\"{line} ppth={quoteattr(st['to'])}/>")
+        parts.append("</s>")
+        out.append("".join(parts))
+    out.append("</timetable>\n")
+    return "\n".join(out)
+
+
+# ----------------- изменения -----------------
+def _message(rng: random.Random, msg_id: str, ts: datetime, kind: str) -> str:
+    if kind == "d":
+        return f"<m id=\"{msg_id}\" t=\"d\" c=\"{rng.choice(DELAY_CODES)}\" ts=\"{_fmt(ts)}\"/>"
+    if kind == "f":
+        return f"<m id=\"{msg_id}\" t=\"f\" c=\"{rng.choice(QUALITY_CODES)}\" ts=\"{_fmt(ts)}\"/>"
+    return (f"<m id=\"{msg_id}\" t=\"h\" c=\"0\" cat=\"Information\" ts=\"{_fmt(ts)}\" "
+            f"from=\"{_fmt(ts)}\" to=\"{_fmt(ts + timedelta(hours=6))}\" pr=\"{rng.randrange(1, 4)}\"/>")
+
+
+def _stop_changes(st: Dict[str, Any], eva: Union[int, str], now: datetime, msgs_per_stop: int,
+                  seed: int, since: Optional[datetime] = None) -> Optional[str]:
+    """
+    <s> с <ar>/<dp> (ct, иногда cp) и сообщениями, опубликованными к now (и после since — для rchg).
+    Всё, кроме отбора по времени, стабильно для stop_id. None — если сообщений в окне нет.
+    """
+    rng = _rng(seed, "chg", eva, st["stop_id"])
+    new_platform = str(rng.randrange(1, 14)) if rng.random() < 0.08 else None
+    published = 0
+
+    def _visible(ts: datetime) -> bool:
+        return ts <= now and (since is None or ts > since)
+
+    parts = [f"<s id=\"{st['stop_id']}\" eva=\"{eva}\">"]
+    if rng.random() < S_LEVEL_MSG_SHARE:
+        ts = (st["ar"] or st["dp"]) - timedelta(minutes=rng.randrange(30, 180))
+        kind = rng.choice(("h", "f"))
+        if _visible(ts):
+            msg_id = "r%d" % zlib.crc32(f"{st['stop_id']}|s".encode("utf-8"))
+            parts.append(_message(_rng(seed, "msg", st["stop_id"], "s"), msg_id, ts, kind))
+            published += 1
+    for event in ("ar", "dp"):
+        pt = st[event]
+        if pt is None:
+            continue
+        ct = pt + timedelta(minutes=st["delay"])
+        cp = f" cp=\"{new_platform}\"" if new_platform else ""
+        msgs = []
+        for k in range(msgs_per_stop):
+            ts = pt - timedelta(minutes=rng.randrange(0, 60))
+            code_rng = _rng(seed, "msg", st["stop_id"], event, k)
+            if _visible(ts):
+                msg_id = "r%d" % zlib.crc32(f"{st['stop_id']}|{event}|{k}".encode("utf-8"))
+                msgs.append(_message(code_rng, msg_id, ts, "d"))
+        published += len(msgs)
+        parts.append(f"<{event} ct=\"{_fmt(ct)}\"{cp}>{''.join(msgs)}</{event}>")
+    parts.append("</s>")
+    return "".join(parts) if published else None
+
+
+def changes_xml(
+    eva: Union[int, str],
+    now: Optional[datetime] = None,
+    recent: bool = False,
+    stops_per_hour: int = STOPS_PER_HOUR,
+    msgs_per_stop: int = MSGS_PER_STOP,
+    seed: int = 0,
+    station: Optional[str] = None,
+    network: Optional[SynthNetwork] = None,
+) -> str:
+    """
+    Ответ /fchg/{eva} (recent=False) или /rchg/{eva} (recent=True) на момент now:
+    изменения по остановкам плана за часы FCHG_HOURS вокруг now.
+    """
+    now = (now or datetime.now(BERLIN)).astimezone(BERLIN).replace(second=0, microsecond=0)
+    station = station or _station_for(eva, network)
+    since = now - timedelta(minutes=RCHG_WINDOW_MIN) if recent else None
+    out = [f"<?xml version='1.0' encoding='UTF-8'?>\n<timetable station={quoteattr(station)} eva=\"{eva}\">"]
+    for dh in FCHG_HOURS:
+        hour_ts = now + timedelta(hours=dh)
+        for st in _stops_for(eva, hour_ts.strftime("%y%m%d"), hour_ts.hour, stops_per_hour, seed, network):
+            if _rng(seed, "changed", st["stop_id"]).random() >= CHANGED_SHARE:
+                continue
+            s = _stop_changes(st, eva, now, msgs_per_stop, seed, since=since)
+            if s is not None:
+                out.append(s)
+    out.append("</timetable>\n")
+    return "\n".join(out)
+
+
+# ----------------- архив для бенчмарков -----------------
+def write_archive(
+    root: Union[str, pathlib.Path],
+    evas: Iterable[Union[int, str]],
+    days: Iterable[str],
+    hours: Iterable[int],
+    stops_per_hour: int = STOPS_PER_HOUR,
+    msgs_per_stop: int = MSGS_PER_STOP,
+    snapshots_per_hour: int = 1,
+    seed: int = 0,
+) -> Dict[str, int]:
+    """
+    Наполняет архив сырья (train_delays.archive) как после crawl + poll по сети SynthNetwork:
+    plan на каждый (eva, день, час) и snapshots_per_hour FCHG-снимков в час на станцию.
+    Возвращает {"plan", "fchg", "bytes"}.
+    """
+    from train_delays.archive import RawArchive
+
+    evas = [str(e) for e in evas]
+    hours = list(hours)
+    network = SynthNetwork(evas, stops_per_hour=stops_per_hour, seed=seed)
+    archive = RawArchive(root)
+    counts = {"plan": 0, "fchg": 0, "bytes": 0}
+    for yymmdd in days:
+        for hh in hours:
+            start = _hour_start(yymmdd, hh)
+            for eva in evas:
+                xml = plan_xml(eva, yymmdd, hh, network=network)
+                archive.put(xml, eva=eva, kind="plan", fetched_at=start - timedelta(days=1), slot=f"{yymmdd}/{hh:02d}")
+                counts["plan"] += 1
+                counts["bytes"] += len(xml)
+                for k in range(snapshots_per_hour):
+                    now = start + timedelta(minutes=k * 60 // snapshots_per_hour)
+                    xml = changes_xml(eva, now=now, msgs_per_stop=msgs_per_stop, seed=seed, network=network)
+                    archive.put(xml, eva=eva, kind="fchg", fetched_at=now)
+                    counts["fchg"] += 1
+                    counts["bytes"] += len(xml)
+    return counts
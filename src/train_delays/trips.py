@@ -0,0 +1,449 @@
+"""
+Индекс рейсов: события всех собранных станций, собранные в упорядоченные прогоны рейсов.
+
+stop_id = "<trip>-<YYMMDDHHMM старта>-<номер остановки>" (см. features.trip_parts), поэтому
+рейс узнаётся на каждой станции без парных джойнов станций: ключи рейсов хэшируются одним
+factorize, события упорядочиваются одной сортировкой (рейс, номер остановки, ar/dp), а всё
+остальное — сдвиги и reduceat по границам рейсов.
+
+Таблицы (корень — data/processed/trips, день — локальная дата старта рейса из ключа):
+  stops/<date>.parquet   # остановка рейса: eva, план/задержка прибытия и отправления,
+                         # предыдущая собранная остановка и набор задержки на перегоне (gain)
+  runs/<date>.parquet    # рейс целиком: первая/последняя собранная остановка, задержки, max
+  _manifest.jsonl        # отпечатки merged-партиций, из которых собран день
+
+Собираются только остановки на собранных станциях: «перегон» — между соседними собранными
+остановками рейса (seq_gap > 1 — между ними были несобранные). Рейс дня d читается из merged
+за d и d + 1 (ночные рейсы), поэтому изменение merged-дня пересобирает дни d − 1 и d.
+Партиции без даты (unknown) в индекс не попадают — без времени рейс не упорядочить.
+
+Запросы:
+  segment_gain()  — набор задержки по перегонам (prev_eva → eva);
+  delay_origins() — где у рейса началась задержка (первая остановка с задержкой ≥ порога);
+  trips_through() — все рейсы через EVA X в окне времени, целиком.
+
+Запуск из корня репо:
+  python -m train_delays.trips build --workers 8
+  python -m train_delays.trips segments --eva 8000105
+  python -m train_delays.trips origins --threshold-min 5
+  python -m train_delays.trips through --eva 8000105 --from "2025-10-16 08:00" --to "2025-10-16 10:00"
+"""
+from __future__ import annotations
+import argparse, hashlib, os, pathlib, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from train_delays.features import DELAY_THRESHOLD_MIN, trip_parts
+from train_delays.manifest import ManifestWriter, load_manifest
+from train_delays.store import STORE_ROOT, TZ, UNKNOWN, DateLike, list_partitions, partition_signature, read_dataset
+
+TRIPS_DIR = "trips"
+MANIFEST_NAME = "_manifest.jsonl"
+TABLES = ("stops", "runs")
+
+MERGED_COLUMNS = ["station", "eva", "stop_id", "event", "planned_ts", "changed_ts", "delay_min",
+                  "line", "tl_category", "train_run_id"]
+
+
+def trips_root(root: Union[str, pathlib.Path] = STORE_ROOT) -> pathlib.Path:
+    return pathlib.Path(root) / TRIPS_DIR
+
+
+def _int_col(values: np.ndarray) -> pd.Series:
+    """float с NaN → Int32 (задержки — целые минуты)."""
+    return pd.Series(values).astype("Int32")
+
+
+# ----------------- сборка -----------------
+def build_stops(merged: pd.DataFrame) -> pd.DataFrame:
+    """
+    merged (любая выборка) → одна строка на остановку рейса, строки рейса подряд по stop_seq.
+    Задержка на входе в остановку — прибытие (иначе отправление), на выходе — отправление
+    (иначе прибытие); gain — вход здесь минус выход на предыдущей собранной остановке,
+    dwell_gain — набор за стоянку.
+    """
+    trips = trip_parts(merged["stop_id"])
+    ok = (trips["trip_key"].notna() & trips["stop_seq"].notna()).to_numpy(dtype=bool)
+    df, trips = merged[ok], trips[ok]
+    if df.empty:
+        return pd.DataFrame()
+
+    # группировка — один хэш-проход по ключам рейсов, порядок — одна сортировка
+    codes, uniques = pd.factorize(trips["trip_key"], sort=True)
+    seq = trips["stop_seq"].to_numpy(dtype=np.int64)
+    is_dp = df["event"].eq("dp").to_numpy(dtype=bool, na_value=False)
+    order = np.lexsort((is_dp, seq, codes))
+    codes, seq, is_dp = codes[order], seq[order], is_dp[order]
+    s = df.iloc[order].reset_index(drop=True)
+
+    new_stop = np.ones(len(s), dtype=bool)
+    new_stop[1:] = (codes[1:] != codes[:-1]) | (seq[1:] != seq[:-1])
+    first = np.flatnonzero(new_stop)
+    stop_idx = np.cumsum(new_stop) - 1
+    n = len(first)
+
+    delay = s["delay_min"].to_numpy(dtype="float64", na_value=np.nan)
+    arr_delay, dep_delay = np.full(n, np.nan), np.full(n, np.nan)
+    arr_delay[stop_idx[~is_dp]] = delay[~is_dp]
+    dep_delay[stop_idx[is_dp]] = delay[is_dp]
+    # время — через int64 (UTC, нс): присваивание tz-aware Timestamp'ов по позициям идёт через объекты
+    planned = pd.to_datetime(s["planned_ts"], utc=True).to_numpy(dtype="datetime64[ns]").view("i8")
+    nat = np.iinfo(np.int64).min
+    arr_ns, dep_ns = np.full(n, nat), np.full(n, nat)
+    arr_ns[stop_idx[~is_dp]] = planned[~is_dp]
+    dep_ns[stop_idx[is_dp]] = planned[is_dp]
+    arr_planned = pd.Series(pd.to_datetime(arr_ns, utc=True)).dt.tz_convert(TZ)
+    dep_planned = pd.Series(pd.to_datetime(dep_ns, utc=True)).dt.tz_convert(TZ)
+
+    delay_in = np.where(np.isnan(arr_delay), dep_delay, arr_delay)
+    delay_out = np.where(np.isnan(dep_delay), arr_delay, dep_delay)
+    stop_code, stop_seq = codes[first], seq[first]
+    same_trip = np.zeros(n, dtype=bool)
+    same_trip[1:] = stop_code[1:] == stop_code[:-1]
+    prev_out = np.full(n, np.nan)
+    prev_out[1:] = delay_out[:-1]
+    prev_out[~same_trip] = np.nan
+    prev_seq = np.full(n, np.nan)
+    prev_seq[1:] = stop_seq[:-1]
+    prev_seq[~same_trip] = np.nan
+
+    head = s.iloc[first].reset_index(drop=True)
+    eva = head["eva"].astype("string")
+    out = pd.DataFrame({
+        "trip_key": pd.Series(uniques[stop_code], dtype="string"),
+        "stop_seq": pd.Series(stop_seq).astype("Int16"),
+        "eva": eva,
+        "station": head["station"].astype("string"),
+        "category": head["tl_category"].astype("string"),
+        "line": head["line"].astype("string"),
+        "train_run_id": head["train_run_id"].astype("string"),
+        "arr_planned": arr_planned,
+        "dep_planned": dep_planned,
+        "arr_delay": _int_col(arr_delay),
+        "dep_delay": _int_col(dep_delay),
+        "prev_eva": eva.shift(1).where(same_trip),
+        "seq_gap": _int_col(stop_seq - prev_seq).astype("Int16"),
+        "gain": _int_col(delay_in - prev_out),
+        "dwell_gain": _int_col(dep_delay - arr_delay),
+    })
+    return out
+
+
+def trip_start(trip_key: pd.Series) -> pd.Series:
+    """Плановый старт рейса из ключа ('…-YYMMDDHHMM'), локальное время; не разобрался — NaT."""
+    raw = pd.to_datetime(trip_key.str.slice(-10), format="%y%m%d%H%M", errors="coerce")
+    return raw.dt.tz_localize(TZ, ambiguous="NaT", nonexistent="shift_forward")
+
+
+def build_runs(stops: pd.DataFrame) -> pd.DataFrame:
+    """Сводка по рейсам из stops (строки рейса подряд): reduceat по границам, без groupby."""
+    if stops.empty:
+        return pd.DataFrame()
+    key = stops["trip_key"].to_numpy(dtype=object)
+    bounds = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    last = np.r_[bounds[1:], len(stops)] - 1
+
+    arr = stops["arr_delay"].to_numpy(dtype="float64", na_value=np.nan)
+    dep = stops["dep_delay"].to_numpy(dtype="float64", na_value=np.nan)
+    delay_out = np.where(np.isnan(dep), arr, dep)
+    delay_in = np.where(np.isnan(arr), dep, arr)
+    gain = stops["gain"].to_numpy(dtype="float64", na_value=np.nan)
+    first_planned = stops["dep_planned"].fillna(stops["arr_planned"])
+    last_planned = stops["arr_planned"].fillna(stops["dep_planned"])
+
+    with np.errstate(invalid="ignore"):
+        max_delay = np.fmax.reduceat(np.fmax(delay_in, delay_out), bounds)
+        max_gain = np.fmax.reduceat(gain, bounds)
+    # перегон с наибольшим набором: позиция максимума внутри рейса
+    trip_of = np.repeat(np.arange(len(bounds)), np.diff(np.r_[bounds, len(stops)]))
+    hit = np.flatnonzero(gain == max_gain[trip_of])
+    _, first_hit = np.unique(trip_of[hit], return_index=True)
+    max_gain_eva = pd.Series(pd.NA, index=range(len(bounds)), dtype="string")
+    max_gain_eva.iloc[trip_of[hit[first_hit]]] = stops["eva"].to_numpy()[hit[first_hit]]
+
+    trip_key = stops["trip_key"].iloc[bounds].reset_index(drop=True)
+    return pd.DataFrame({
+        "trip_key": trip_key,
+        "start_ts": trip_start(trip_key),
+        "category": stops["category"].iloc[bounds].reset_index(drop=True),
+        "line": stops["line"].iloc[bounds].reset_index(drop=True),
+        "train_run_id": stops["train_run_id"].iloc[bounds].reset_index(drop=True),
+        "n_stops": pd.Series(last - bounds + 1).astype("Int16"),
+        "first_seq": stops["stop_seq"].iloc[bounds].reset_index(drop=True),
+        "last_seq": stops["stop_seq"].iloc[last].reset_index(drop=True),
+        "first_eva": stops["eva"].iloc[bounds].reset_index(drop=True),
+        "last_eva": stops["eva"].iloc[last].reset_index(drop=True),
+        "first_planned": first_planned.iloc[bounds].reset_index(drop=True),
+        "last_planned": last_planned.iloc[last].reset_index(drop=True),
+        "first_delay": _int_col(delay_out[bounds]),
+        "last_delay": _int_col(delay_in[last]),
+        "max_delay": _int_col(max_delay),
+        "max_gain": _int_col(max_gain),
+        "max_gain_eva": max_gain_eva,
+    })
+
+
+def trip_day(stops: pd.DataFrame) -> np.ndarray:
+    """День рейса для раскладки: дата старта из ключа, иначе дата первой собранной остановки."""
+    key = stops["trip_key"].to_numpy(dtype=object)
+    bounds = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+    # даты считаются на рейс (strftime по строкам — самое дорогое место сборки)
+    start = trip_start(stops["trip_key"].iloc[bounds].reset_index(drop=True))
+    fallback = stops["dep_planned"].fillna(stops["arr_planned"]).iloc[bounds].reset_index(drop=True)
+    day = start.fillna(fallback).dt.strftime("%Y-%m-%d").fillna(UNKNOWN).to_numpy(dtype=object)
+    return np.repeat(day, np.diff(np.r_[bounds, len(stops)]))
+
+
+# ----------------- инкрементальное обновление -----------------
+def _next_day(day: str) -> str:
+    return (datetime.strptime(day, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+def _table_path(troot: pathlib.Path, table: str, day: str) -> pathlib.Path:
+    return troot / table / f"{day}.parquet"
+
+
+def _write_atomic(df: pd.DataFrame, path: pathlib.Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    df.to_parquet(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def _build_day(day: str, root: str) -> Dict[str, Any]:
+    """Воркер: рейсы, стартовавшие в day (merged за day и следующий день) → stops/runs."""
+    t0 = time.perf_counter()
+    merged = read_dataset("merged", root, start=day, end=_next_day(day), columns=MERGED_COLUMNS)
+    stops = build_stops(merged) if not merged.empty else pd.DataFrame()
+    troot = trips_root(root)
+    if not stops.empty:
+        stops = stops[trip_day(stops) == day].reset_index(drop=True)
+    if stops.empty:
+        for table in TABLES:
+            _table_path(troot, table, day).unlink(missing_ok=True)
+        return {"day": day, "stops": 0, "trips": 0}
+    runs = build_runs(stops)
+    _write_atomic(stops, _table_path(troot, "stops", day))
+    _write_atomic(runs, _table_path(troot, "runs", day))
+    return {"day": day, "stops": int(len(stops)), "trips": int(len(runs)),
+            "seconds": round(time.perf_counter() - t0, 3)}
+
+
+def build_trip_index(
+    root: Union[str, pathlib.Path] = STORE_ROOT,
+    workers: Optional[int] = None,
+    full: bool = False,
+) -> Dict[str, int]:
+    """
+    Пересобирает дни индекса, чьи merged-партиции (день и следующий) изменились.
+    Возвращает {"days", "built", "stops", "trips"}.
+    """
+    root = pathlib.Path(root)
+    troot = trips_root(root)
+    manifest_path = troot / MANIFEST_NAME
+    seen = {} if full else load_manifest(manifest_path)
+
+    by_day: Dict[str, List[str]] = {}
+    for e, d, p in list_partitions("merged", root):
+        if d != UNKNOWN:
+            by_day.setdefault(d, []).append(f"{e}:{partition_signature(p)}")
+    # рейс дня d (с ночными — до d + 1) — и рейсы дня d − 1, доехавшие до d
+    days = sorted(by_day)
+    candidates = sorted(set(days) | {(datetime.strptime(d, "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+                                     for d in days})
+    sigs: Dict[str, str] = {}
+    for day in candidates:
+        h = hashlib.sha1()
+        for d in (day, _next_day(day)):
+            h.update(f"{d}={','.join(sorted(by_day.get(d, [])))};".encode("utf-8"))
+        sigs[day] = h.hexdigest()
+    todo = [d for d in candidates if seen.get(d, {}).get("signature") != sigs[d]]
+    counts = {"days": len(candidates), "built": len(todo), "stops": 0, "trips": 0}
+    if not todo:
+        return counts
+
+    workers = workers or os.cpu_count() or 1
+    if full and manifest_path.exists():
+        manifest_path.unlink()
+    with ManifestWriter(manifest_path) as writer, ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_build_day, d, str(root)) for d in todo]
+        for fut in as_completed(futures):
+            res = fut.result()
+            counts["stops"] += res["stops"]
+            counts["trips"] += res["trips"]
+            writer.write({"key": res["day"], "signature": sigs[res["day"]], "stops": res["stops"],
+                          "trips": res["trips"], "built_at": datetime.now().isoformat(timespec="seconds")})
+    return counts
+
+
+# ----------------- запросы -----------------
+def _day_str(value: DateLike) -> str:
+    ts = pd.Timestamp(value)
+    return (ts.tz_convert(TZ) if ts.tzinfo is not None else ts).strftime("%Y-%m-%d")
+
+
+def load_index(
+    table: str = "stops",
+    root: Union[str, pathlib.Path] = STORE_ROOT,
+    start: Optional[DateLike] = None,
+    end: Optional[DateLike] = None,
+) -> pd.DataFrame:
+    """stops или runs за дни старта рейсов [start, end] (включительно); строки рейса подряд."""
+    d_from = _day_str(start) if start is not None else None
+    d_to = _day_str(end) if end is not None else None
+    base = trips_root(root) / table
+    if not base.exists():
+        raise FileNotFoundError(f"Нет индекса {base}. Сначала запусти: python -m train_delays.trips build")
+    frames = []
+    for path in sorted(base.glob("*.parquet")):
+        day = path.stem
+        if (d_from and day < d_from) or (d_to and day > d_to):
+            continue
+        frames.append(pd.read_parquet(path))
+    frames = [f for f in frames if not f.empty]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def segment_gain(
+    stops: Optional[pd.DataFrame] = None,
+    eva: Optional[Union[str, Iterable[str]]] = None,
+    adjacent_only: bool = False,
+    **kw: Any,
+) -> pd.DataFrame:
+    """
+    Набор задержки по перегонам prev_eva → eva: n, mean/median gain, доля перегонов с набором,
+    средняя задержка на входе. eva — перегоны, прилегающие к станции(ям) с любой стороны;
+    adjacent_only — только перегоны без несобранных остановок между ними.
+    """
+    s = stops if stops is not None else load_index("stops", **kw)
+    s = s[s["gain"].notna() & s["prev_eva"].notna()]
+    if adjacent_only:
+        s = s[s["seq_gap"].eq(1).fillna(False)]
+    if eva is not None:
+        evas = [eva] if isinstance(eva, str) else list(eva)
+        s = s[s["eva"].isin(evas) | s["prev_eva"].isin(evas)]
+    gain = s["gain"].astype("float64")
+    delay_in = s["arr_delay"].astype("float64").fillna(s["dep_delay"].astype("float64"))
+    g = pd.DataFrame({"prev_eva": s["prev_eva"], "eva": s["eva"], "gain": gain,
+                      "gained": (gain > 0).astype("float64"), "delay_in": delay_in})
+    res = g.groupby(["prev_eva", "eva"], sort=False).agg(
+        n=("gain", "size"), mean_gain=("gain", "mean"), median_gain=("gain", "median"),
+        share_gained=("gained", "mean"), mean_delay_in=("delay_in", "mean"),
+    )
+    return res.sort_values("mean_gain", ascending=False)
+
+
+def delay_origins(
+    stops: Optional[pd.DataFrame] = None,
+    threshold_min: int = DELAY_THRESHOLD_MIN,
+    **kw: Any,
+) -> pd.DataFrame:
+    """
+    Где началась задержка: для каждого рейса, набравшего ≥ threshold_min, — первая собранная
+    остановка с такой задержкой (задержка на выходе). origin_known=False — рейс пришёл на
+    первую собранную остановку уже опоздавшим и не с начальной станции (начало — до покрытия).
+    """
+    s = stops if stops is not None else load_index("stops", **kw)
+    if s.empty:
+        return pd.DataFrame()
+    key = s["trip_key"].to_numpy(dtype=object)
+    first_of_trip = np.r_[True, key[1:] != key[:-1]]
+    arr = s["arr_delay"].to_numpy(dtype="float64", na_value=np.nan)
+    dep = s["dep_delay"].to_numpy(dtype="float64", na_value=np.nan)
+    delay_out = np.where(np.isnan(dep), arr, dep)
+    with np.errstate(invalid="ignore"):
+        hit = np.flatnonzero(delay_out >= threshold_min)
+    trip_no = np.cumsum(first_of_trip) - 1
+    _, first_hit = np.unique(trip_no[hit], return_index=True)
+    rows = hit[first_hit]
+    o = s.iloc[rows].reset_index(drop=True)
+    at_first = first_of_trip[rows]
+    return pd.DataFrame({
+        "trip_key": o["trip_key"],
+        "origin_eva": o["eva"],
+        "origin_station": o["station"],
+        "origin_seq": o["stop_seq"],
+        "prev_eva": o["prev_eva"],
+        "delay": _int_col(delay_out[rows]),
+        "gain": o["gain"],
+        "origin_known": ~at_first | o["stop_seq"].eq(1).fillna(False).to_numpy(dtype=bool),
+    })
+
+
+def trips_through(
+    eva: Union[str, int],
+    start: DateLike,
+    end: DateLike,
+    stops: Optional[pd.DataFrame] = None,
+    root: Union[str, pathlib.Path] = STORE_ROOT,
+) -> pd.DataFrame:
+    """Все остановки рейсов, проходящих через eva с плановым временем в [start, end)."""
+    t0, t1 = pd.Timestamp(start), pd.Timestamp(end)
+    t0 = t0.tz_localize(TZ) if t0.tzinfo is None else t0.tz_convert(TZ)
+    t1 = t1.tz_localize(TZ) if t1.tzinfo is None else t1.tz_convert(TZ)
+    # рейс, который проходит станцию в окне, мог стартовать накануне
+    s = stops if stops is not None else load_index("stops", root, start=t0 - pd.Timedelta(days=1), end=t1)
+    if s.empty:
+        return s
+    at = s["eva"].eq(str(eva)).to_numpy(dtype=bool, na_value=False)
+    when = s["arr_planned"].fillna(s["dep_planned"])
+    at &= ((when >= t0) & (when < t1)).to_numpy(dtype=bool, na_value=False)
+    keys = s["trip_key"][at].unique()
+    return s[s["trip_key"].isin(keys).to_numpy(dtype=bool)].reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Индекс рейсов: прогоны по станциям и распространение задержек")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_b = sub.add_parser("build", help="Пересобрать изменившиеся дни индекса")
+    p_b.add_argument("--store", default=str(STORE_ROOT))
+    p_b.add_argument("--workers", type=int, default=None)
+    p_b.add_argument("--full", action="store_true", help="Собрать индекс заново")
+    p_s = sub.add_parser("segments", help="Набор задержки по перегонам")
+    p_s.add_argument("--eva", nargs="*", default=None)
+    p_s.add_argument("--adjacent-only", action="store_true", help="Только перегоны без пропущенных станций")
+    p_s.add_argument("--top", type=int, default=20)
+    p_o = sub.add_parser("origins", help="Где начинаются задержки")
+    p_o.add_argument("--threshold-min", type=int, default=DELAY_THRESHOLD_MIN)
+    p_o.add_argument("--top", type=int, default=20)
+    p_t = sub.add_parser("through", help="Рейсы через станцию в окне времени")
+    p_t.add_argument("--eva", required=True)
+    p_t.add_argument("--from", dest="t_from", required=True, help="Начало окна, напр. '2025-10-16 08:00'")
+    p_t.add_argument("--to", dest="t_to", required=True, help="Конец окна (не включительно)")
+    for p in (p_s, p_o, p_t):
+        p.add_argument("--store", default=str(STORE_ROOT))
+    for p in (p_s, p_o):
+        p.add_argument("--start", default=None, help="Дата старта рейсов от (YYYY-MM-DD)")
+        p.add_argument("--end", default=None, help="Дата старта рейсов до (YYYY-MM-DD), включительно")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    if args.cmd == "build":
+        print("Trips:", build_trip_index(args.store, workers=args.workers, full=args.full),
+              f"за {time.perf_counter() - t0:.1f} с")
+    elif args.cmd == "segments":
+        res = segment_gain(eva=args.eva, adjacent_only=args.adjacent_only, root=args.store,
+                           start=args.start, end=args.end)
+        print(res.head(args.top).round(2).to_string())
+        print(f"\n{len(res)} перегонов за {(time.perf_counter() - t0) * 1000:.0f} мс")
+    elif args.cmd == "origins":
+        res = delay_origins(threshold_min=args.threshold_min, root=args.store, start=args.start, end=args.end)
+        if res.empty:
+            print("Нет рейсов с задержкой ≥", args.threshold_min, "мин")
+        else:
+            known = res[res["origin_known"]]
+            top = known.groupby(["origin_eva", "origin_station"], sort=False).size().sort_values(ascending=False)
+            print(top.head(args.top).rename("trips").to_string())
+            print(f"\nРейсов с задержкой: {len(res)}, начало в покрытии: {len(known)}"
+                  f" ({(time.perf_counter() - t0) * 1000:.0f} мс)")
+    else:
+        res = trips_through(args.eva, args.t_from, args.t_to, root=args.store)
+        cols = ["trip_key", "stop_seq", "eva", "station", "arr_planned", "dep_planned",
+                "arr_delay", "dep_delay", "gain"]
+        print(res[cols].to_string(index=False) if not res.empty else "Нет рейсов в окне")
+        n = res["trip_key"].nunique() if not res.empty else 0
+        print(f"\n{n} рейсов за {(time.perf_counter() - t0) * 1000:.0f} мс")
@@ -0,0 +1,10 @@
+# tests/conftest.py
+# Тесты запускаются из корня репо: python -m pytest -q
+# src/ и корень репо (scripts) — в sys.path, как при PYTHONPATH=src:.
+from __future__ import annotations
+import pathlib, sys
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+for p in (ROOT / "src", ROOT):
+    if str(p) not in sys.path:
+        sys.path.insert(0, str(p))
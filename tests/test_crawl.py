@@ -0,0 +1,93 @@
+# tests/test_crawl.py
+from __future__ import annotations
+
+import pytest
+import requests
+
+from train_delays import crawl, fetch
+from train_delays.archive import RawArchive
+from train_delays.manifest import load_manifest
+from train_delays.stub_api import StubApi, serve_in_thread
+
+
+class CountingBucket(crawl.TokenBucket):
+    acquired = 0
+
+    def acquire(self) -> None:
+        CountingBucket.acquired += 1
+        super().acquire()
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = serve_in_thread(StubApi(rate_429=0.2, rate_5xx=0.2, retry_after_s=0, seed=3))
+    monkeypatch.setattr(fetch, "BASE", server.base_url)
+    monkeypatch.setattr(fetch, "HTTP_CACHE", None)
+    monkeypatch.setattr(fetch, "RETRY_BACKOFF", 0.0)
+    monkeypatch.setenv("DB_CLIENT_ID", "test")
+    monkeypatch.setenv("DB_API_KEY", "test")
+    monkeypatch.setattr(crawl, "TokenBucket", CountingBucket)
+    CountingBucket.acquired = 0
+    yield server.api
+    server.shutdown()
+
+
+def test_every_attempt_takes_a_token(stub, tmp_path):
+    counts = crawl.crawl(["8000105", "8000101"], date_from="2025-10-16", hours="6-12",
+                         outdir=tmp_path, workers=2, rate_per_min=60_000)
+    assert counts["ok"] + counts["failed"] == counts["total"] == 16
+    assert stub.stats["fault_429"] + stub.stats["fault_5xx"] > 0
+    # ретраи 429/5xx идут через bucket, а не в urllib3 мимо него
+    assert stub.stats["requests"] == CountingBucket.acquired
+
+
+def test_with_retries_gives_up_after_attempts(stub):
+    stub.rate_5xx, stub.rate_429 = 1.0, 0.0
+    bucket = CountingBucket(60_000)
+    with pytest.raises(requests.HTTPError):
+        crawl.with_retries(bucket, fetch.get_changes, "8000105", session=fetch.QUOTA_SESSION, attempts=3)
+    assert CountingBucket.acquired == stub.stats["requests"] == 3
+
+
+def test_with_retries_does_not_retry_other_statuses(monkeypatch):
+    calls = []
+
+    def not_found():
+        calls.append(1)
+        resp = requests.Response()
+        resp.status_code = 404
+        raise requests.HTTPError(response=resp)
+
+    with pytest.raises(requests.HTTPError):
+        crawl.with_retries(crawl.TokenBucket(60_000), not_found)
+    assert len(calls) == 1
+
+
+def _kinds(outdir) -> list:
+    return [e["kind"] for e in RawArchive(outdir).iter_entries()]
+
+
+def test_fchg_is_fetched_again_for_another_date_range(stub, tmp_path):
+    stub.rate_429 = stub.rate_5xx = 0.0
+    first = crawl.crawl(["8000105"], date_from="2025-10-16", hours="8", outdir=tmp_path, workers=1)
+    again = crawl.crawl(["8000105"], date_from="2025-10-16", hours="8", outdir=tmp_path, workers=1)
+    other = crawl.crawl(["8000105"], date_from="2025-10-17", hours="8", outdir=tmp_path, workers=1)
+    assert (first["ok"], again["skipped"], other["ok"]) == (2, 2, 2)
+    assert sorted(_kinds(tmp_path)) == ["fchg", "fchg", "plan", "plan"]
+
+
+def test_archive_write_error_is_recorded_per_task(stub, tmp_path, monkeypatch):
+    stub.rate_429 = stub.rate_5xx = 0.0
+    put = RawArchive.put
+
+    def put_or_fail(self, content, *, kind, **kwargs):
+        if kind == "fchg":
+            raise OSError(28, "No space left on device")
+        return put(self, content, kind=kind, **kwargs)
+
+    monkeypatch.setattr(RawArchive, "put", put_or_fail)
+    counts = crawl.crawl(["8000105"], date_from="2025-10-16", hours="6-9", outdir=tmp_path, workers=1)
+    assert (counts["ok"], counts["failed"]) == (4, 1)
+    recs = load_manifest(tmp_path / crawl.MANIFEST_NAME)
+    assert len(recs) == 5
+    assert [r["error"] for r in recs.values() if r["status"] == "error"] == ["OSError: [Errno 28] No space left on device"]
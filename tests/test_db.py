@@ -0,0 +1,78 @@
+# tests/test_db.py
+from __future__ import annotations
+
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from train_delays import db, parse
+from train_delays.merge import stamp_snapshot
+from train_delays.store import write_partitions
+
+
+def snapshot(ct: str, ts: str, fetched_at: str) -> pd.DataFrame:
+    xml = (f'<timetable station="X" eva="1">'
+           f'<s id="a-1"><ar ct="{ct}"><m id="r1" ts="{ts}"/></ar></s></timetable>')
+    return stamp_snapshot(parse.parse_changes_xml(xml), fetched_at)
+
+
+def stored_ct(conn: sqlite3.Connection) -> list:
+    out = db.read_sql(conn, "SELECT event_ct FROM changes", table="changes")
+    return out["event_ct"].dt.strftime("%H:%M").tolist()
+
+
+OLD = ("2510160815", "2510160750", "2025-10-16T07:55:00+02:00")
+NEWER_TS = ("2510160805", "2510160758", "2025-10-16T08:01:00+02:00")
+SAME_TS_FRESHER = ("2510160805", "2510160750", "2025-10-16T08:01:00+02:00")
+
+
+@pytest.mark.parametrize("newer", [NEWER_TS, SAME_TS_FRESHER])
+@pytest.mark.parametrize("reverse", [False, True])
+def test_upsert_keeps_newer_state_regardless_of_load_order(newer, reverse):
+    conn = db.connect(":memory:")
+    frames = [snapshot(*newer), snapshot(*OLD)]
+    for df in (frames if reverse else frames[::-1]):
+        db.ingest_frame(conn, "changes", df)
+    assert stored_ct(conn) == ["08:05"]
+
+
+def test_reload_of_same_snapshot_is_idempotent():
+    conn = db.connect(":memory:")
+    for _ in range(2):
+        db.ingest_frame(conn, "changes", snapshot(*OLD))
+    assert stored_ct(conn) == ["08:15"]
+
+
+def test_load_store_ignores_part_file_order(tmp_path):
+    # part-a читается раньше part-b, но в нём более свежий снимок
+    write_partitions(snapshot(*NEWER_TS), "changes", "a", tmp_path)
+    write_partitions(snapshot(*OLD), "changes", "b", tmp_path)
+    conn = db.connect(":memory:")
+    db.load_store(conn, tmp_path, datasets=("changes",))
+    assert stored_ct(conn) == ["08:05"]
+
+
+def test_connect_adds_missing_columns_to_old_db(tmp_path):
+    path = tmp_path / "old.sqlite"
+    conn = db.connect(path)
+    conn.execute("ALTER TABLE changes DROP COLUMN fetched_at")   # схема до появления колонки
+    conn.close()
+    conn = db.connect(path)
+    cols = {row[1] for row in conn.execute("PRAGMA table_info(changes)")}
+    assert set(db.TABLES["changes"]["columns"]) <= cols
+    db.ingest_frame(conn, "changes", snapshot(*OLD))
+    assert stored_ct(conn) == ["08:15"]
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+def test_plan_upsert_keeps_latest_snapshot(reverse):
+    def plan(pp: str, fetched_at: str) -> pd.DataFrame:
+        xml = f'<timetable station="X" eva="1"><s id="a-1"><ar pt="2510160800" pp="{pp}"/></s></timetable>'
+        return stamp_snapshot(parse.parse_timetable_xml(xml), fetched_at)
+
+    conn = db.connect(":memory:")
+    frames = [plan("3", "2025-10-16T06:00:00+02:00"), plan("1", "2025-10-15T06:00:00+02:00")]
+    for df in (frames if reverse else frames[::-1]):
+        db.ingest_frame(conn, "plan", df)
+    assert db.read_sql(conn, "SELECT platform_planned FROM plan", table="plan")["platform_planned"].tolist() == ["3"]
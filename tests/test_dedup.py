@@ -0,0 +1,69 @@
+# tests/test_dedup.py
+from __future__ import annotations
+
+import pandas as pd
+
+from train_delays import merge, parse
+from train_delays.dedup import ChangeDeduper, MessageIndex, message_keys
+from train_delays.merge import stamp_snapshot
+
+PLAN_XML = ('<timetable station="X" eva="1"><s id="a-2510160800-1">'
+            '<tl c="RE" n="7"/><ar pt="2510160800" pp="1"/></s></timetable>')
+
+
+def changes_xml(ct: str, cp: str = "1") -> str:
+    # одно и то же <m> (id и ts), меняется только ct/cp события
+    return ('<timetable station="X" eva="1"><s id="a-2510160800-1" eva="1">'
+            f'<ar ct="{ct}" cp="{cp}"><m id="r1" t="d" c="43" ts="2510160750"/></ar></s></timetable>')
+
+
+def test_repeated_message_is_dropped(tmp_path):
+    dedup = ChangeDeduper(tmp_path)
+    first = dedup.filter(parse.parse_changes_xml(changes_xml("2510160805")))
+    again = dedup.filter(parse.parse_changes_xml(changes_xml("2510160805")))
+    assert len(first) == 1
+    assert again.empty
+
+
+def test_moved_ct_with_same_message_passes(tmp_path):
+    dedup = ChangeDeduper(tmp_path)
+    first = dedup.filter(parse.parse_changes_xml(changes_xml("2510160805")))
+    moved = dedup.filter(parse.parse_changes_xml(changes_xml("2510160815")))
+    assert len(moved) == 1
+
+    chg = pd.concat([first, moved], ignore_index=True)
+    out = merge.join_plan_changes(parse.parse_timetable_xml(PLAN_XML), chg, pd.Timedelta(minutes=30))
+    assert out["delay_min"].tolist() == [15]
+
+
+def test_moved_platform_passes(tmp_path):
+    dedup = ChangeDeduper(tmp_path)
+    dedup.filter(parse.parse_changes_xml(changes_xml("2510160805", cp="1")))
+    moved = dedup.filter(parse.parse_changes_xml(changes_xml("2510160805", cp="4")))
+    assert moved["platform"].tolist() == ["4"]
+
+
+def test_keys_survive_save_and_reload(tmp_path):
+    df = parse.parse_changes_xml(changes_xml("2510160805"))
+    dedup = ChangeDeduper(tmp_path)
+    dedup.filter(df)
+    dedup.save()
+    assert ChangeDeduper(tmp_path).filter(df).empty
+    idx = MessageIndex(tmp_path / "_dedup" / "eva=1.npz")
+    assert set(idx.keys) == set(message_keys(df)[0])
+
+
+def test_return_to_earlier_state_passes(tmp_path):
+    # ct 08:05 → 08:15 → 08:05: третий снимок снова меняет состояние и должен дойти до merge
+    cts = ["2510160805", "2510160815", "2510160805"]
+    snaps = [stamp_snapshot(parse.parse_changes_xml(changes_xml(ct)), f"2025-10-16T07:5{i}:00+02:00")
+             for i, ct in enumerate(cts)]
+    dedup = ChangeDeduper(tmp_path)
+    emitted = [dedup.filter(df) for df in snaps]
+    assert [len(df) for df in emitted] == [1, 1, 1]
+
+    plan = parse.parse_timetable_xml(PLAN_XML)
+    tol = pd.Timedelta(minutes=30)
+    with_dedup = merge.join_plan_changes(plan, pd.concat(emitted, ignore_index=True), tol)
+    without = merge.join_plan_changes(plan, pd.concat(snaps, ignore_index=True), tol)
+    assert with_dedup["delay_min"].tolist() == without["delay_min"].tolist() == [5]
@@ -0,0 +1,72 @@
+# tests/test_ingest.py
+from __future__ import annotations
+
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from train_delays.archive import BERLIN, RawArchive
+from train_delays.ingest import MANIFEST_NAME, discover_sources, ingest_all, latest_payloads
+from train_delays.manifest import load_manifest
+from train_delays.merge import join_plan_changes, read_partition_inputs
+from train_delays.pipeline import parse_payloads
+from train_delays.store import list_partitions
+
+PLAN_XML = ('<timetable station="X" eva="1"><s id="a-2510160800-1">'
+            '<tl c="RE" n="7"/><ar pt="2510160800" pp="1"/></s></timetable>')
+
+
+def changes_xml(ct: str) -> str:
+    return ('<timetable station="X" eva="1"><s id="a-2510160800-1" eva="1">'
+            f'<ar ct="{ct}"><m id="r1" t="d" c="43" ts="2510160750"/></ar></s></timetable>')
+
+
+def at(hhmm: str) -> datetime:
+    return datetime(2025, 10, 16, int(hhmm[:2]), int(hhmm[2:]), tzinfo=BERLIN)
+
+
+@pytest.fixture
+def raw(tmp_path):
+    # fchg: A (+5) → B (+15) → A (+5) → A ещё раз
+    archive = RawArchive(tmp_path / "raw")
+    archive.put(PLAN_XML, 1, "plan", fetched_at=at("0600"))
+    for hhmm, ct in [("0750", "2510160805"), ("0755", "2510160815"),
+                     ("0758", "2510160805"), ("0759", "2510160805")]:
+        archive.put(changes_xml(ct), 1, "fchg", fetched_at=at(hhmm))
+    return tmp_path / "raw"
+
+
+def test_returning_payload_is_a_separate_source(raw):
+    srcs = [s for s in discover_sources(raw) if s["kind"] == "fchg"]
+    assert [s["fetched_at"][11:16] for s in sorted(srcs, key=lambda s: s["order"])] == ["07:50", "07:55", "07:58"]
+    assert len({s["part_key"] for s in srcs}) == 3
+
+
+@pytest.mark.parametrize("dedup", [True, False])
+def test_merge_sees_return_to_earlier_payload(raw, tmp_path, dedup):
+    store = tmp_path / "store"
+    counts = ingest_all(raw, store, workers=1, dedup=dedup)
+    assert counts["failed"] == 0
+    (_, day, _), = list_partitions("plan", store)
+    plan, chg = read_partition_inputs("1", day, store)
+    out = join_plan_changes(plan, chg, tol=pd.Timedelta(minutes=2))
+    assert out["delay_min"].tolist() == [5]
+    # повторный запуск ничего не разбирает заново
+    assert ingest_all(raw, store, workers=1, dedup=dedup)["parsed"] == 0
+
+
+def test_pipeline_uses_the_same_key_for_returning_payload(raw, tmp_path):
+    store = tmp_path / "store"
+    ingest_all(raw, store, workers=1)
+    done = {k for k, rec in load_manifest(store / MANIFEST_NAME).items() if rec.get("status") == "ok"}
+    archive = RawArchive(raw)
+    prev = latest_payloads(archive)[("fchg", "1", None)]
+    payloads = []
+    for hhmm, ct in [("0800", "2510160815"), ("0801", "2510160815")]:   # вернулся B, затем повтор B
+        e = archive.put(changes_xml(ct), 1, "fchg", fetched_at=at(hhmm))
+        payloads.append({**e, "prev_sha": prev, "xml": changes_xml(ct)})
+        prev = e["sha256"]
+    parsed = parse_payloads(payloads, done)
+    assert [p["key"] for p in parsed] == [f"fchg:{payloads[0]['sha256']}@{payloads[0]['fetched_at']}"]
+    assert parsed[0]["key"] in {s["key"] for s in discover_sources(raw)}
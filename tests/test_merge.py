@@ -0,0 +1,180 @@
+# tests/test_merge.py
+from __future__ import annotations
+
+import pandas as pd
+import pytest
+
+from train_delays import parse
+from train_delays.merge import (CHANGE_READ_COLUMNS, SNAPSHOT_COLUMN, delay_minutes, join_plan_changes,
+                                latest_change_state, read_partition_inputs, stamp_snapshot)
+from train_delays.store import write_partitions
+
+TOL = pd.Timedelta(minutes=2)
+
+
+def plan_xml(*stops: str) -> str:
+    return f'<timetable station="X" eva="1">{"".join(stops)}</timetable>'
+
+
+def changes_xml(*stops: str) -> str:
+    return f'<timetable station="X" eva="1">{"".join(stops)}</timetable>'
+
+
+def snapshot(xml: str, fetched_at: str) -> pd.DataFrame:
+    return stamp_snapshot(parse.parse_changes_xml(xml), fetched_at)
+
+
+# ----------------- задержка -----------------
+def test_delay_minutes_sign_and_rounding():
+    planned = pd.Series(pd.to_datetime(["2025-10-16 08:00"] * 5 + [None]).tz_localize("Europe/Berlin"))
+    changed = planned.iloc[:1].repeat(6).reset_index(drop=True) + pd.to_timedelta(
+        ["5min", "-2min", "89s", "91s", "-91s", "1min"])
+    out = delay_minutes(planned, changed)
+    assert str(out.dtype) == "Int64"
+    assert out.iloc[:5].tolist() == [5, -2, 1, 2, -2]   # раньше плана — отрицательная
+    assert out.isna().tolist() == [False] * 5 + [True]
+
+
+# ----------------- последнее состояние -----------------
+def test_latest_state_takes_max_ts():
+    chg = parse.parse_changes_xml(changes_xml(
+        '<s id="a-1"><ar ct="2510160805"><m id="r1" ts="2510160750"/></ar></s>',
+        '<s id="a-1"><ar ct="2510160810"><m id="r2" ts="2510160755"/></ar></s>',
+    ))
+    state = latest_change_state(chg.iloc[::-1])
+    assert state["msg_id"].tolist() == ["r2"]
+    assert state["event_ct"].dt.minute.tolist() == [10]
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+def test_latest_state_tie_on_ts_prefers_fresher_snapshot(reverse):
+    # одинаковый ts сообщения; более свежий снимок сдвинул ct назад — он и должен победить
+    old = snapshot(changes_xml('<s id="a-1"><ar ct="2510160815"><m id="r1" ts="2510160750"/></ar></s>'),
+                   "2025-10-16T07:55:00+02:00")
+    new = snapshot(changes_xml('<s id="a-1"><ar ct="2510160805"><m id="r1" ts="2510160750"/></ar></s>'),
+                   "2025-10-16T08:01:00+02:00")
+    frames = [new, old] if reverse else [old, new]
+    state = latest_change_state(pd.concat(frames, ignore_index=True))
+    assert state["event_ct"].dt.minute.tolist() == [5]
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+def test_latest_state_tie_without_snapshot_time_uses_ct(reverse):
+    rows = [parse.parse_changes_xml(changes_xml(f'<s id="a-1"><ar ct="{ct}"><m id="r1" ts="2510160750"/></ar></s>'))
+            for ct in ("2510160805", "2510160815")]
+    chg = pd.concat(rows[::-1] if reverse else rows, ignore_index=True)
+    assert SNAPSHOT_COLUMN not in chg.columns
+    assert latest_change_state(chg)["event_ct"].dt.minute.tolist() == [15]
+
+
+def test_latest_state_old_rows_without_snapshot_time_lose():
+    # changes, записанные до колонки fetched_at, читаются с None в ней
+    old = parse.parse_changes_xml(changes_xml('<s id="a-1"><ar ct="2510160815"><m id="r1" ts="2510160750"/></ar></s>'))
+    old[SNAPSHOT_COLUMN] = None
+    new = snapshot(changes_xml('<s id="a-1"><ar ct="2510160805"><m id="r1" ts="2510160750"/></ar></s>'),
+                   "2025-10-16T08:01:00+02:00")
+    state = latest_change_state(pd.concat([new, old], ignore_index=True))
+    assert state["event_ct"].dt.minute.tolist() == [5]
+
+
+def test_partition_inputs_read_old_parts_without_snapshot_time(tmp_path):
+    write_partitions(parse.parse_timetable_xml(plan_xml('<s id="a-1"><ar pt="2510160800"/></s>')),
+                     "plan", key="p", root=tmp_path)
+    old = parse.parse_changes_xml(changes_xml('<s id="a-1"><ar ct="2510160815"><m id="r1" ts="2510160750"/></ar></s>'))
+    new = snapshot(changes_xml('<s id="a-1"><ar ct="2510160805"><m id="r1" ts="2510160750"/></ar></s>'),
+                   "2025-10-16T08:01:00+02:00")
+    # имя part-файла старого снимка сортируется после нового
+    write_partitions(old, "changes", key="ff", root=tmp_path)
+    write_partitions(new, "changes", key="00", root=tmp_path)
+
+    plan, chg = read_partition_inputs("1", "2025-10-16", tmp_path)
+    assert chg[SNAPSHOT_COLUMN].isna().sum() == 1
+    assert join_plan_changes(plan, chg, TOL)["delay_min"].tolist() == [5]
+
+
+# ----------------- key join и fallback по времени -----------------
+PLAN = plan_xml(
+    '<s id="a-1"><ar pt="2510160800" pp="1"/><dp pt="2510160802" pp="1"/></s>',
+    '<s id="b-1"><ar pt="2510161000" pp="2"/></s>',   # есть stop_id, своих изменений нет
+    '<s><ar pt="2510161001"/></s>',    # без stop_id — только по времени
+    '<s><dp pt="2510161100"/></s>',
+)
+CHANGES = changes_xml(
+    # по ключу время не ограничено: +25 мин больше tol
+    '<s id="a-1"><ar ct="2510160825" cp="5"><m id="r1" ts="2510160750"/></ar></s>',
+    # ar 10:02 — в ±tol и от b-1 (10:00, есть stop_id), и от ar 10:01 без stop_id
+    '<s id="c-1"><ar ct="2510161002"><m id="r2" ts="2510160950"/></ar></s>',
+    # dp в 11:10 — вне tol для dp 11:00 без stop_id
+    '<s id="d-1"><dp ct="2510161110"><m id="r3" ts="2510161050"/></dp></s>',
+)
+
+
+def _by_planned(out: pd.DataFrame) -> pd.DataFrame:
+    return out.assign(hm=out["planned_ts"].dt.strftime("%H:%M")).set_index(["hm", "event"])
+
+
+def test_key_join_ignores_tolerance():
+    out = _by_planned(join_plan_changes(parse.parse_timetable_xml(PLAN), parse.parse_changes_xml(CHANGES), TOL))
+    row = out.loc[("08:00", "ar")]
+    assert (row["match"], row["delay_min"], row["platform_actual"]) == ("key", 25, "5")
+    # у dp той же остановки изменений нет: плановая платформа, без задержки
+    row = out.loc[("08:02", "dp")]
+    assert pd.isna(row["match"]) and pd.isna(row["delay_min"]) and row["platform_actual"] == "1"
+    # изменение c-1 в 10:02 в пределах tol, но строка с stop_id по времени не сопоставляется
+    assert pd.isna(out.loc[("10:00", "ar"), "match"])
+
+
+def test_time_fallback_within_tolerance():
+    out = _by_planned(join_plan_changes(parse.parse_timetable_xml(PLAN), parse.parse_changes_xml(CHANGES), TOL))
+    row = out.loc[("10:01", "ar")]
+    assert (row["match"], row["delay_min"]) == ("time", 1)
+    assert pd.isna(out.loc[("11:00", "dp"), "match"])   # 10 мин > tol
+    wide = _by_planned(join_plan_changes(parse.parse_timetable_xml(PLAN), parse.parse_changes_xml(CHANGES),
+                                         pd.Timedelta(minutes=15)))
+    assert wide.loc[("11:00", "dp"), "match"] == "time"
+
+
+# ----------------- несколько снимков плана -----------------
+def plan_snapshot(pp: str, fetched_at: str) -> pd.DataFrame:
+    return stamp_snapshot(parse.parse_timetable_xml(plan_xml(f'<s id="a-1"><ar pt="2510160800" pp="{pp}"/></s>')),
+                          fetched_at)
+
+
+OLD_PLAN = ("1", "2025-10-15T06:00:00+02:00")
+NEW_PLAN = ("3", "2025-10-16T06:00:00+02:00")   # перенос на другую платформу
+
+
+@pytest.mark.parametrize("reverse", [False, True])
+def test_conflicting_plan_snapshots_latest_fetch_wins(reverse):
+    frames = [plan_snapshot(*NEW_PLAN), plan_snapshot(*OLD_PLAN)]
+    plan = pd.concat(frames if reverse else frames[::-1], ignore_index=True)
+    out = join_plan_changes(plan, parse.parse_changes_xml(changes_xml()), TOL)
+    assert out["platform_actual"].tolist() == ["3"]
+    assert SNAPSHOT_COLUMN not in out.columns   # схема merged не меняется
+
+
+def test_conflicting_plan_snapshots_ignore_part_file_order(tmp_path):
+    # part-00 читается первым, но в нём более свежий снимок
+    write_partitions(plan_snapshot(*NEW_PLAN), "plan", key="00", root=tmp_path)
+    write_partitions(plan_snapshot(*OLD_PLAN), "plan", key="ff", root=tmp_path)
+    plan, chg = read_partition_inputs("1", "2025-10-16", tmp_path)
+    assert join_plan_changes(plan, chg, TOL)["platform_actual"].tolist() == ["3"]
+
+
+# ----------------- пустые изменения -----------------
+def test_plan_with_empty_changes():
+    out = join_plan_changes(parse.parse_timetable_xml(PLAN), pd.DataFrame(columns=CHANGE_READ_COLUMNS), TOL)
+    assert len(out) == 5
+    assert out["match"].isna().all() and out["delay_min"].isna().all()
+    assert out["platform_actual"].tolist() == out["platform_planned"].tolist()
+
+@pytest.mark.parametrize("unit", ["us", "ns"])
+def test_orphan_plan_without_changes(unit):
+    # план без stop_id (партиция day == unknown) и ни одного изменения: fallback по времени
+    # не должен падать на разных единицах datetime64 плана и пустого состояния
+    plan = parse.parse_timetable_xml(plan_xml('<s><ar pt="2510160800"/></s>'))
+    plan["planned_ts"] = plan["planned_ts"].dt.as_unit(unit)
+    out = join_plan_changes(plan, pd.DataFrame(columns=CHANGE_READ_COLUMNS), TOL)
+    assert len(out) == 1
+    assert out["match"].isna().all()
+    assert out["delay_min"].isna().all()
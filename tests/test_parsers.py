@@ -0,0 +1,44 @@
+# tests/test_parsers.py
+# Дифференциальная проверка XML-бэкендов parse.py: каждый бэкенд в обоих режимах (из строки и
+# из потока) должен давать ту же таблицу, что etree. Документы — синтетика и пограничные случаи
+# из scripts/check_parsers.py (там же прогон по архиву сырья и --bench).
+from __future__ import annotations
+import io
+
+import pandas as pd
+import pytest
+
+from scripts.check_parsers import BROKEN, PARSERS, synthetic_fixtures
+
+FIXTURES = list(synthetic_fixtures())
+
+
+@pytest.fixture(params=["etree", "expat", "lxml"])
+def backend(request) -> str:
+    if request.param == "lxml":
+        pytest.importorskip("lxml", reason="XML-бэкенд lxml не установлен")
+    return request.param
+
+
+@pytest.mark.parametrize("name,kind,data", FIXTURES, ids=[f[0] for f in FIXTURES])
+def test_backend_matches_etree(backend, name, kind, data):
+    from_text, from_file = PARSERS[kind]
+    try:
+        text = data.decode("utf-8")
+    except UnicodeDecodeError:
+        text = None   # не-UTF-8 документ — только файловый режим
+    if text is not None:
+        ref = from_text(text, backend="etree")
+        pd.testing.assert_frame_equal(from_text(text, backend=backend), ref)
+    else:
+        ref = from_file(io.BytesIO(data), backend="etree")
+    pd.testing.assert_frame_equal(from_file(io.BytesIO(data), backend=backend), ref)
+
+
+@pytest.mark.parametrize("name,kind,text", BROKEN, ids=[b[0] for b in BROKEN])
+def test_broken_xml_raises(backend, name, kind, text):
+    from_text, from_file = PARSERS[kind]
+    with pytest.raises(RuntimeError):
+        from_text(text, backend=backend)
+    with pytest.raises(RuntimeError):
+        from_file(io.BytesIO(text.encode("utf-8")), backend=backend)
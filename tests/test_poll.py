@@ -0,0 +1,98 @@
+# tests/test_poll.py
+from __future__ import annotations
+
+import pytest
+
+from train_delays import fetch, poll
+from train_delays.crawl import TokenBucket
+from train_delays.poll import ChangesPoller
+from train_delays.stub_api import StubApi, serve_in_thread
+
+FCHG = '<timetable station="X" eva="1"><s id="a-1"><ar ct="2510160805"/></s></timetable>'
+
+
+@pytest.fixture
+def poller(tmp_path) -> ChangesPoller:
+    return ChangesPoller(["1"], outdir=tmp_path, jitter_s=0.0, rate_per_min=6000)
+
+
+def _scheduled(p: ChangesPoller) -> list:
+    return [eva for _, eva in p._heap]
+
+
+def test_ok_poll_is_saved_and_rescheduled(poller, monkeypatch):
+    monkeypatch.setattr(fetch, "get_changes", lambda eva, **kw: FCHG)
+    poller._poll_one("1")
+    assert _scheduled(poller) == ["1"]
+    assert (poller.stats["fchg"], poller.stats["saved"], poller.stats["errors"]) == (1, 1, 0)
+
+
+def test_archive_write_failure_keeps_station(poller, monkeypatch):
+    monkeypatch.setattr(fetch, "get_changes", lambda eva, **kw: FCHG)
+
+    def disk_full(*args, **kwargs):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(poller.archive, "put", disk_full)
+    poller._poll_one("1")
+    assert _scheduled(poller) == ["1"]
+    assert poller.stats["errors"] == 1
+    assert poller._backoff["1"] == poller.interval_s
+
+
+def test_unexpected_fetch_error_keeps_station(poller, monkeypatch, capsys):
+    def broken(eva, **kw):
+        raise ValueError("bad payload")
+
+    monkeypatch.setattr(fetch, "get_changes", broken)
+    poller._poll_one("1")
+    assert _scheduled(poller) == ["1"]
+    assert "[ERROR] fchg 1: ValueError: bad payload" in capsys.readouterr().out
+
+
+def test_backoff_doubles_up_to_limit(poller, monkeypatch):
+    def failing(eva, **kw):
+        raise RuntimeError("HTTP 500")
+
+    monkeypatch.setattr(fetch, "get_changes", failing)
+    for _ in range(20):
+        poller._poll_one("1")
+    assert poller._backoff["1"] == poll.BACKOFF_MAX_S
+    assert len(_scheduled(poller)) == 20
+
+
+class CountingBucket(TokenBucket):
+    def __init__(self, rate_per_min: float):
+        super().__init__(rate_per_min)
+        self.acquired = 0
+
+    def acquire(self) -> None:
+        self.acquired += 1
+        super().acquire()
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = serve_in_thread(StubApi(retry_after_s=0, seed=1))
+    monkeypatch.setattr(fetch, "BASE", server.base_url)
+    monkeypatch.setattr(fetch, "RETRY_BACKOFF", 0.0)
+    monkeypatch.setenv("DB_CLIENT_ID", "test")
+    monkeypatch.setenv("DB_API_KEY", "test")
+    yield server.api
+    server.shutdown()
+
+
+def test_5xx_retries_take_tokens(poller, stub):
+    stub.rate_5xx = 1.0
+    poller.bucket = CountingBucket(6000)
+    poller._poll_one("8000105")
+    assert stub.stats["requests"] == poller.bucket.acquired == fetch.RETRY_TOTAL + 1
+    assert poller.stats["errors"] == 1
+
+
+def test_429_is_not_retried_in_place(poller, stub):
+    stub.rate_429 = 1.0
+    poller.bucket = CountingBucket(6000)
+    poller._poll_one("8000105")
+    assert stub.stats["requests"] == poller.bucket.acquired == 1
+    assert poller.stats["throttled"] == 1
@@ -0,0 +1,31 @@
+# tests/test_report.py
+from __future__ import annotations
+import os, pathlib, subprocess, sys
+
+import pytest
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+
+def _run(module: str, *args: str) -> subprocess.CompletedProcess:
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([str(ROOT / "src"), str(ROOT)])}
+    return subprocess.run([sys.executable, "-m", module, *args], cwd=ROOT, env=env,
+                          capture_output=True, text=True, timeout=120)
+
+
+@pytest.mark.parametrize("module", ["train_delays.report", "scripts.check_report"])
+def test_empty_store_exits_cleanly(module, tmp_path):
+    out = tmp_path / "figures"
+    extra = ["--out", str(out)] if module == "train_delays.report" else []
+    res = _run(module, "--store", str(tmp_path / "processed"), *extra)
+    assert res.returncode == 0, res.stderr
+    assert "Нет событий" in res.stdout
+    assert not out.exists()
+
+
+def test_empty_csv_exits_cleanly(tmp_path):
+    csv = tmp_path / "events.csv"
+    csv.write_text("station,eva,event,planned_ts,changed_ts,delay_min\n", encoding="utf-8")
+    res = _run("train_delays.report", "--input", str(csv), "--out", str(tmp_path / "figures"))
+    assert res.returncode == 0, res.stderr
+    assert "Нет событий" in res.stdout
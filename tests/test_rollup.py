@@ -0,0 +1,50 @@
+# tests/test_rollup.py
+from __future__ import annotations
+
+import shutil
+
+import pandas as pd
+
+from train_delays import parse
+from train_delays.manifest import load_manifest
+from train_delays.merge import MERGED_KEY, join_plan_changes
+from train_delays.rollup import MANIFEST_NAME, MEASURES, build_cube, load_cube, rollup_root, update_rollup
+from train_delays.store import list_partitions, read_dataset, write_partitions
+
+PLAN_XML = ('<timetable station="X" eva="1">'
+            '<s id="a-1"><tl c="RE" n="7"/><ar pt="2510160800"/></s>'
+            '<s id="b-1"><tl c="RE" n="9"/><ar pt="2510170900"/></s></timetable>')
+CHANGES_XML = ('<timetable station="X" eva="1">'
+               '<s id="a-1"><ar ct="2510160805"><m id="r1" ts="2510160750"/></ar></s>'
+               '<s id="b-1"><ar ct="2510170920"><m id="r2" ts="2510170850"/></ar></s></timetable>')
+
+
+def totals(cube: pd.DataFrame) -> dict:
+    return {c: int(cube[c].sum()) for c in ("events", "n", "sum")}
+
+
+def test_partition_removed_from_merged_leaves_the_cube(tmp_path):
+    merged = join_plan_changes(parse.parse_timetable_xml(PLAN_XML), parse.parse_changes_xml(CHANGES_XML),
+                               pd.Timedelta(minutes=2))
+    write_partitions(merged, "merged", key=MERGED_KEY, root=tmp_path)
+    update_rollup(tmp_path, workers=1)
+    assert totals(load_cube(tmp_path)) == {"events": 2, "n": 2, "sum": 25}
+
+    (_, _, gone_dir), = list_partitions("merged", tmp_path, start="2025-10-17", end="2025-10-17")
+    shutil.rmtree(gone_dir)
+    counts = update_rollup(tmp_path, workers=1)
+    assert (counts["folded"], counts["removed"]) == (0, 1)
+    cube = load_cube(tmp_path)
+    assert totals(cube) == {"events": 1, "n": 1, "sum": 5}
+    expected = build_cube(read_dataset("merged", tmp_path))
+    assert cube[MEASURES].sum().equals(expected[MEASURES].sum())
+    assert load_manifest(rollup_root(tmp_path) / MANIFEST_NAME)["1/2025-10-17"]["status"] == "removed"
+    assert not (rollup_root(tmp_path) / "parts" / "1_2025-10-17.parquet").exists()
+
+    # повторный прогон ничего не вычитает второй раз; вернувшаяся партиция сворачивается заново
+    assert update_rollup(tmp_path, workers=1)["removed"] == 0
+    back = merged[merged["planned_ts"].dt.day == 17]
+    write_partitions(back, "merged", key=MERGED_KEY, root=tmp_path)
+    counts = update_rollup(tmp_path, workers=1)
+    assert (counts["folded"], counts["removed"]) == (1, 0)
+    assert totals(load_cube(tmp_path)) == {"events": 2, "n": 2, "sum": 25}